@@ -188,6 +188,10 @@ class OutputInfo(NamedTuple):
     updated: Union[datetime.date, datetime.datetime, None]
     sitemap: bool
     sitemap_priority: float
+    # False if the output file was left untouched since it is up to date
+    written: bool = True
+    # digest of the output file, if known
+    digest: Optional[str] = None
 
 
 BuildResult = List[Tuple[ContentSrc, Set[ContentPath], Sequence[OutputInfo]]]
@@ -0,0 +1,62 @@
+"""Content bodies shared with builder processes through a memory mapped file.
+
+Bodies are written to a single file by the parent process, and the
+pickled Site holds only their offsets. Worker processes map the file and
+read a body on demand, so the pages are shared between the workers
+instead of being copied into each of them.
+"""
+
+from __future__ import annotations
+
+import mmap
+from typing import Any, Dict, NamedTuple
+
+# Smaller bodies are pickled with the Site as usual.
+MIN_BODY_SIZE = 1024
+
+_mmaps: Dict[str, mmap.mmap] = {}
+
+
+class BodyRef(NamedTuple):
+    filename: str
+    offset: int
+    size: int
+
+    def read(self) -> bytes:
+        mm = _mmaps.get(self.filename)
+        if mm is None:
+            with open(self.filename, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            _mmaps[self.filename] = mm
+
+        return mm[self.offset : self.offset + self.size]
+
+
+class BodyArena:
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self._file = open(filename, "wb")
+        self._offset = 0
+
+    def __enter__(self) -> BodyArena:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def add(self, body: bytes) -> BodyRef:
+        self._file.write(body)
+        ref = BodyRef(self.filename, self._offset, len(body))
+        self._offset += len(body)
+        return ref
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def close() -> None:
+    """Unmap all body files opened in this process."""
+
+    for mm in _mmaps.values():
+        mm.close()
+    _mmaps.clear()
@@ -1,17 +1,23 @@
 from __future__ import annotations
 
-import asyncio
+import collections
 import logging
 import multiprocessing
+import multiprocessing.connection
 import os
 import pickle
+import queue
 import tempfile
+import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
 from typing import (
     TYPE_CHECKING,
     Any,
+    Callable,
+    Deque,
     Dict,
+    Iterable,
+    Iterator,
     List,
     Optional,
     Sequence,
@@ -21,18 +27,20 @@ from typing import (
     Union,
 )
 
-from jinja2 import Environment
 
 from miyadaiku import (
     BuildResult,
     ContentPath,
+    ContentSrc,
     DependsDict,
+    OutputInfo,
     PathTuple,
     parse_dir,
     repr_contentpath,
 )
 
-from . import context, depends, extend, mp_log, sitemap
+from . import arena, context, depends, extend, mp_log, sitemap
+from .jinjaenv import Environment
 
 if TYPE_CHECKING:
     from .contents import Content
@@ -53,6 +61,10 @@ class Builder:
     def __init__(self, content: Content) -> None:
         self.contentpath = content.src.contentpath
 
+    def get_size(self, site: Site) -> int:
+        content = site.files.get_content(self.contentpath)
+        return len(content.body or b"")
+
     def build_context(self, site: Site, jinjaenv: Environment) -> context.OutputContext:
         content = site.files.get_content(self.contentpath)
         contexttype = context.CONTEXTS.get(
@@ -187,6 +199,9 @@ class IndexBuilder(Builder):
         self.cur_page = cur_page
         self.num_pages = num_pages
 
+    def get_size(self, site: Site) -> int:
+        return sum(len(site.files.get_content(path).body or b"") for path in self.items)
+
 
 BUILDERS: Dict[str, Type[Builder]] = {
     "binary": Builder,
@@ -205,209 +220,634 @@ def create_builders(site: Site, content: Content) -> List[Builder]:
 
 
 MIN_BATCH_SIZE = 10
+MAX_CHUNK_SIZE = 20
+CHUNKS_PER_WORKER = 4
+
+# Estimated build time in seconds per byte of source. Used to order
+# builders that have no build duration recorded by the previous build.
+BYTE_COST = 0.000001
+
+
+def sort_builders(
+    site: Site, builders: Sequence[Builder], costs: depends.BuildCosts
+) -> List[Builder]:
+    """Sort builders by estimated cost, longest first."""
 
+    counts = collections.Counter(builder.contentpath for builder in builders)
+
+    def estimate(builder: Builder) -> float:
+        if builder.contentpath in costs:
+            return costs[builder.contentpath] / counts[builder.contentpath]
+        return builder.get_size(site) * BYTE_COST
+
+    return sorted(builders, key=estimate, reverse=True)
+
+
+def split_batch(
+    builders: Sequence[Any], num_workers: Optional[int] = None
+) -> Sequence[Any]:
+    """Split builders into small chunks, which are fed to the workers on demand."""
 
-def split_batch(builders: Sequence[Any]) -> Sequence[Any]:
     num = len(builders)
-    max_batches = (num // MIN_BATCH_SIZE) or 1
-    batch_count = min(max_batches, multiprocessing.cpu_count())
-    batches: List[List[Builder]] = [[] for _ in range(batch_count)]
+    if not num:
+        return []
 
-    for i, builder in enumerate(builders):
-        batches[i % batch_count].append(builder)
+    num_workers = num_workers or multiprocessing.cpu_count()
+    chunksize = num // (num_workers * CHUNKS_PER_WORKER)
+    chunksize = max(1, min(chunksize, MAX_CHUNK_SIZE))
 
-    return batches
+    return [list(builders[i : i + chunksize]) for i in range(0, num, chunksize)]
 
 
-def build_batch(
-    site: Site, jinjaev: Environment, builders: List[Builder]
-) -> Tuple[int, int, BuildResult, Set[ContentPath],]:
+BatchResult = Tuple[
+    int,
+    int,
+    BuildResult,
+    Set[ContentPath],
+    depends.BuildCosts,
+    depends.PageReads,
+]
+
+# (contentpath, result or None, error, duration, config and templates read)
+# of a builder
+BuiltRec = Tuple[
+    ContentPath,
+    Optional[Tuple[ContentSrc, Set[ContentPath], Sequence[OutputInfo]]],
+    bool,
+    float,
+    depends.Reads,
+]
+
+
+class BatchResults:
+    """Accumulates BuiltRecs into BatchResult."""
+
+    def __init__(self) -> None:
+        self.ok = self.err = 0
+        self.results: BuildResult = []
+        self.errors: Set[ContentPath] = set()
+        self.costs: Dict[ContentPath, float] = collections.defaultdict(float)
+        self.reads: depends.PageReads = {}
+
+    def add(self, rec: BuiltRec) -> None:
+        contentpath, result, error, cost, reads = rec
+        if result:
+            self.ok += 1
+            self.results.append(result)
+        if error:
+            self.err += 1
+            self.errors.add(contentpath)
+        self.costs[contentpath] += cost
+        if contentpath in self.reads:
+            self.reads[contentpath][0].update(reads[0])
+            self.reads[contentpath][1].update(reads[1])
+        else:
+            self.reads[contentpath] = reads
+
+    def get(self) -> BatchResult:
+        return (
+            self.ok,
+            self.err,
+            self.results,
+            self.errors,
+            dict(self.costs),
+            self.reads,
+        )
+
 
-    ret: BuildResult = []
-    errors: Set[ContentPath] = set()
+def iter_build(
+    site: Site, jinjaev: Environment, builders: List[Builder]
+) -> Iterator[BuiltRec]:
 
-    ok = err = 0
     for builder in builders:
+        start = time.perf_counter()
         try:
-            new_context = builder.build_context(site, jinjaev)
-            context = extend.run_pre_build(new_context)
-            if not context:
-                continue
-            logger.info("Building %s", context.content.src.repr_filename())
-            filenames = context.build()
-            extend.run_post_build(context, filenames)
-
-            ret.append(
-                (
-                    context.content.src,
-                    set(context.depends),
-                    filenames,
-                )
-            )
-            ok += 1
+            with site.config.record() as configs, jinjaev.record_templates() as templates:
+                reads = (configs, templates)
+                new_context = builder.build_context(site, jinjaev)
+                context = extend.run_pre_build(new_context)
+                if not context:
+                    yield (
+                        builder.contentpath,
+                        None,
+                        False,
+                        time.perf_counter() - start,
+                        reads,
+                    )
+                    continue
+
+                if extend.hooks_pre_build:
+                    # hooks may update the content
+                    context.content.invalidate_metadata()
+                    site.render_cache.invalidate(context.content.src.contentpath)
+                    site.files.invalidate_index()
+
+                logger.info("Building %s", context.content.src.repr_filename())
+                filenames = context.build()
+                extend.run_post_build(context, filenames)
+
+            result = (context.content.src, set(context.depends), filenames)
+            yield builder.contentpath, result, False, time.perf_counter() - start, reads
 
         except Exception:
-            err += 1
-            errors.add(builder.contentpath)
             logger.exception(
                 "Error while building %s", repr_contentpath(builder.contentpath)
             )
+            yield builder.contentpath, None, True, time.perf_counter() - start, ({}, {})
+
+
+def build_batch(
+    site: Site, jinjaev: Environment, builders: List[Builder]
+) -> BatchResult:
 
-    return ok, err, ret, errors
+    ret = BatchResults()
+    for rec in iter_build(site, jinjaev, builders):
+        ret.add(rec)
+    return ret.get()
 
 
-def mp_build_batch(queue: Any, picklefile: str, builders: List[Builder]) -> None:
+MAX_STREAM_RESULTS = 50
+STREAM_INTERVAL = 0.5
+
+
+class ResultStream:
+    """Sends build results of a worker process to the parent in small groups."""
+
+    def __init__(self, resultqueue: Any, workerid: int) -> None:
+        self._queue = resultqueue
+        self._workerid = workerid
+        self._recs: List[BuiltRec] = []
+        self._last = time.monotonic()
+
+    def add(self, rec: BuiltRec) -> None:
+        self._recs.append(rec)
+        if (len(self._recs) >= MAX_STREAM_RESULTS) or (
+            time.monotonic() - self._last >= STREAM_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        # send log records before results of the builders
+        mp_log.flush_mp_logging()
+
+        if self._recs:
+            self._queue.put(("BUILT", self._workerid, self._recs))
+            self._recs = []
+        self._last = time.monotonic()
+
+
+def mp_worker(taskqueue: Any, resultqueue: Any, workerid: int) -> None:
     try:
-        site = pickle.load(open(picklefile, "rb"))
-        mp_log.init_mp_logging(queue)
-        try:
-            site.load_hooks()
-            site.load_modules()
-            jinjaenv = site.build_jinjaenv()
+        mp_log.init_mp_logging(resultqueue)
+        stream = ResultStream(resultqueue, workerid)
+
+        site: Optional[Site] = None
+        jinjaenv: Optional[Environment] = None
+
+        while True:
+            task = taskqueue.get()
+            if task is None:
+                break
+
+            if task[0] == "SITE":
+                site = jinjaenv = None
+                arena.close()
+                try:
+                    site = pickle.load(open(task[1], "rb"))
+                    site.load_hooks()
+                    site.load_modules()
+                    jinjaenv = site.build_jinjaenv()
+                except Exception:
+                    site = jinjaenv = None
+                    logger.exception("Error in builder process:")
+                    mp_log.flush_mp_logging()
+
+            elif task[0] == "BUILD":
+                builders: List[Builder] = task[1]
+                if site and jinjaenv:
+                    for rec in iter_build(site, jinjaenv, builders):
+                        stream.add(rec)
+                else:
+                    # failed to initialize site
+                    for b in builders:
+                        stream.add((b.contentpath, None, True, 0.0, ({}, {})))
 
-            ret = build_batch(site, jinjaenv, builders)
-            queue.put(("RESULT", ret))
-        except:  # NOQA
-            logger.exception("Error in builder process:")
-            raise
+                stream.flush()
+                resultqueue.put(("DONE", workerid))
 
-        finally:
-            mp_log.flush_mp_logging()
-            queue.put(None)
-            queue.close()
-            queue.join_thread()
+            elif task[0] == "RELEASE":
+                site = jinjaenv = None
+                arena.close()
+                resultqueue.put(("RELEASED", workerid))
+
+        resultqueue.close()
+        resultqueue.join_thread()
     except:  # noqa
         traceback.print_exc()
         raise
 
 
+def dump_site(site: Site, picklefile: str, arenafile: str) -> None:
+    """Pickle site to picklefile. Large content bodies are written to
+    arenafile instead, and builder processes read them on demand."""
+
+    stored: List[Tuple[Content, bytes]] = []
+    try:
+        with arena.BodyArena(arenafile) as bodyarena:
+            for _, content in site.files.items():
+                body = content.store_body(bodyarena)
+                if body is not None:
+                    stored.append((content, body))
+
+        with open(picklefile, "wb") as f:
+            pickle.dump(site, f)
+
+    finally:
+        for content, body in stored:
+            content.body = body
+
+
 def dispatch_log(msgs: List[Dict[str, Any]]) -> None:
     for msg in msgs:
         lv = msg["levelno"]
         logger.log(lv, msg["msg"], extra=dict(msgdict=msg))
 
 
-def run_build(
-    loop: asyncio.AbstractEventLoop, picklefile: str, batch: List[Builder]
-) -> List[Tuple[str, Any]]:
-    queue: Any = multiprocessing.Queue()
-    p = multiprocessing.Process(target=mp_build_batch, args=(queue, picklefile, batch))
-    p.start()
-    msgs = []
-    while True:
-        msg = queue.get()
-        if msg is None:
-            break
-        if msg[0] == "LOGS":
-            loop.call_soon_threadsafe(dispatch_log, msg[1])
+PROGRESS_INTERVAL = 10.0
 
-        elif msg[0] == "RESULT":
-            msgs.append(msg)
+# number of chunks sent to a worker ahead of its results
+PREFETCH_CHUNKS = 2
 
-    queue.close()
-    queue.join_thread()
 
-    p.join()
-    return msgs
+class BuildPool:
+    """Long-lived builder processes.
 
+    Worker processes are started on demand and kept running until close()
+    is called, so that a pool can be reused across builds in watch mode.
+    Each worker loads the Site and Jinja environment once per build, and
+    then receives chunks of builders whenever it finishes the previous one.
+    Content bodies are not copied to the workers, but shared through a
+    memory mapped file (see miyadaiku.arena).
 
-async def submit(
-    site: Site, batches: Sequence[List[Builder]]
-) -> Tuple[int, int, BuildResult, Set[ContentPath],]:
+    Log records and results are streamed from the workers while building.
+    Each worker has its own result queue, so that a worker exited while
+    writing to the queue does not block the other workers.
+    """
 
-    fd, picklefile = tempfile.mkstemp()
+    num_workers: int
+    _workers: List[Tuple[multiprocessing.Process, Any]]
+    _resultqueues: List[Any]
 
-    try:
-        sitestr = pickle.dumps(site)
-        os.write(fd, sitestr)
-        os.close(fd)
-        fd = 0
-
-        loop = asyncio.get_running_loop()
-        futs = []
-        results = []
-        errors = set()
-
-        # build Queue here for Python 3.9 issue35943
-        # force importing multiprocessing.* modules
-        dmy_executor = ThreadPoolExecutor(max_workers=1)
-        fut = loop.run_in_executor(dmy_executor, run_build, loop, picklefile, [])
-        await fut
-
-        executor = ThreadPoolExecutor(max_workers=len(batches))
-        for batch in batches:
-            futs.append(
-                loop.run_in_executor(executor, run_build, loop, picklefile, batch)
+    def __init__(self, num_workers: Optional[int] = None) -> None:
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self._workers = []
+        self._resultqueues = []
+
+    def __enter__(self) -> BuildPool:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _new_worker(self, workerid: int) -> Tuple[multiprocessing.Process, Any, Any]:
+        taskqueue: Any = multiprocessing.Queue()
+        resultqueue: Any = multiprocessing.Queue()
+        p = multiprocessing.Process(
+            target=mp_worker,
+            args=(taskqueue, resultqueue, workerid),
+            daemon=True,
+        )
+        p.start()
+        return p, taskqueue, resultqueue
+
+    def _restart_worker(self, workerid: int) -> None:
+        p, taskqueue = self._workers[workerid]
+        logger.error(
+            "Builder process %s exited unexpectedly (exit code: %s)", p.pid, p.exitcode
+        )
+        p.join()
+        for q in (taskqueue, self._resultqueues[workerid]):
+            q.cancel_join_thread()
+            q.close()
+
+        p, taskqueue, resultqueue = self._new_worker(workerid)
+        self._workers[workerid] = (p, taskqueue)
+        self._resultqueues[workerid] = resultqueue
+
+    def _start_workers(self, num: int) -> None:
+        # replace workers exited since the previous build
+        for workerid, (p, _) in enumerate(self._workers[:num]):
+            if not p.is_alive():
+                self._restart_worker(workerid)
+
+        while len(self._workers) < num:
+            p, taskqueue, resultqueue = self._new_worker(len(self._workers))
+            self._workers.append((p, taskqueue))
+            self._resultqueues.append(resultqueue)
+
+    def _get_message(self, workerids: Iterable[int]) -> Any:
+        """Returns a message from the workers, or ("EXITED", workerid) if one
+        of the workers in workerids has exited."""
+
+        workerids = list(workerids)
+        while True:
+            for workerid in workerids:
+                try:
+                    return self._resultqueues[workerid].get_nowait()
+                except queue.Empty:
+                    pass
+
+            # messages sent before exit are received first
+            for workerid in workerids:
+                p, _ = self._workers[workerid]
+                if p.exitcode is not None:
+                    return ("EXITED", workerid)
+
+            # Queue has no public method to wait for data, so wait for the
+            # readers of the queues.
+            multiprocessing.connection.wait(
+                [self._resultqueues[workerid]._reader for workerid in workerids]
+                + [self._workers[workerid][0].sentinel for workerid in workerids]
             )
 
-        ok = err = 0
-        for fut in futs:
-            msgs = await fut
-            for msg in msgs:
-                if msg[0] == "RESULT":
-                    _ok, _err, _results, _errors = msg[1]
-                    ok += _ok
-                    err += _err
-                    results.extend(_results)
-                    errors.update(_errors)
+    def submit(
+        self,
+        site: Site,
+        batches: Sequence[List[Builder]],
+        callback: Optional[Callable[[BuiltRec], None]] = None,
+    ) -> BatchResult:
+        """Build batches in the worker processes.
 
-        return ok, err, results, errors
+        callback is called with each BuiltRec as soon as it is received.
 
-    finally:
-        if fd:
-            os.close(fd)
-        os.unlink(picklefile)
+        If a worker exits while building, builders of the batch being built
+        by the worker fail, and the batches sent to the worker but not yet
+        started are built by a new worker.
+        """
+
+        ret = BatchResults()
+        if not batches:
+            return ret.get()
+
+        fd, picklefile = tempfile.mkstemp()
+        os.close(fd)
+        fd, arenafile = tempfile.mkstemp()
+        os.close(fd)
+
+        try:
+            dump_site(site, picklefile, arenafile)
+
+            pendings = collections.deque(batches)
+
+            # avoid loading site in many processes for small builds
+            num_builders = sum(len(batch) for batch in batches)
+            max_workers = (num_builders // MIN_BATCH_SIZE) or 1
+            num = min(len(pendings), self.num_workers, max_workers)
+            self._start_workers(num)
+
+            # batches sent to each worker, in the order they are built, and
+            # number of results received for the first batch.
+            assigned: List[Deque[List[Builder]]] = [
+                collections.deque() for _ in range(num)
+            ]
+            received = [0] * num
+
+            def send(workerid: int) -> None:
+                batch = pendings.popleft()
+                _, taskqueue = self._workers[workerid]
+                taskqueue.put(("BUILD", batch))
+                assigned[workerid].append(batch)
+
+            for _, taskqueue in self._workers[:num]:
+                taskqueue.put(("SITE", picklefile))
+
+            for _ in range(PREFETCH_CHUNKS):
+                for workerid in range(num):
+                    if pendings:
+                        send(workerid)
+
+            finished = 0
+            last_progress = time.monotonic()
+
+            while any(assigned):
+                msg = self._get_message(range(num))
+                if msg[0] == "LOGS":
+                    dispatch_log(msg[1])
+
+                elif msg[0] == "BUILT":
+                    for rec in msg[2]:
+                        ret.add(rec)
+                        if callback:
+                            callback(rec)
+
+                    received[msg[1]] += len(msg[2])
+                    finished += len(msg[2])
+                    if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                        logger.info("%d/%d pages built", finished, num_builders)
+                        last_progress = time.monotonic()
+
+                elif msg[0] == "DONE":
+                    assigned[msg[1]].popleft()
+                    received[msg[1]] = 0
+                    if pendings:
+                        send(msg[1])
+
+                elif msg[0] == "EXITED":
+                    workerid = msg[1]
+                    lost = assigned[workerid]
+                    assigned[workerid] = collections.deque()
+                    if lost:
+                        # builders which may have crashed the worker are not
+                        # built again.
+                        for b in lost.popleft()[received[workerid] :]:
+                            rec = (b.contentpath, None, True, 0.0, ({}, {}))
+                            ret.add(rec)
+                            if callback:
+                                callback(rec)
+                        pendings.extendleft(reversed(lost))
+                    received[workerid] = 0
+
+                    self._restart_worker(workerid)
+                    if pendings:
+                        _, taskqueue = self._workers[workerid]
+                        taskqueue.put(("SITE", picklefile))
+                        for _ in range(PREFETCH_CHUNKS):
+                            if pendings:
+                                send(workerid)
+
+            # let workers drop the site and unmap arenafile before removing it
+            releasing = set(range(num))
+            for _, taskqueue in self._workers[:num]:
+                taskqueue.put(("RELEASE",))
+
+            while releasing:
+                msg = self._get_message(releasing)
+                if msg[0] == "LOGS":
+                    dispatch_log(msg[1])
+                elif msg[0] in ("RELEASED", "EXITED"):
+                    releasing.discard(msg[1])
+
+            return ret.get()
+
+        finally:
+            os.unlink(picklefile)
+            os.unlink(arenafile)
+
+    def close(self) -> None:
+        workers, self._workers = self._workers, []
+        for p, taskqueue in workers:
+            if p.is_alive():
+                taskqueue.put(None)
+            taskqueue.close()
+            taskqueue.join_thread()
+
+        for p, _ in workers:
+            p.join()
+
+        resultqueues, self._resultqueues = self._resultqueues, []
+        for resultqueue in resultqueues:
+            resultqueue.close()
+
+
+def submit(
+    site: Site,
+    batches: Sequence[List[Builder]],
+    pool: Optional[BuildPool] = None,
+    callback: Optional[Callable[[BuiltRec], None]] = None,
+) -> BatchResult:
+
+    if pool:
+        return pool.submit(site, batches, callback)
+
+    with BuildPool() as newpool:
+        return newpool.submit(site, batches, callback)
 
 
 def submit_debug(
-    site: Site, batches: Sequence[List[Builder]]
-) -> Tuple[int, int, BuildResult, Set[ContentPath],]:
+    site: Site,
+    batches: Sequence[List[Builder]],
+    callback: Optional[Callable[[BuiltRec], None]] = None,
+) -> BatchResult:
 
     site.load_modules()
     jinjaenv = site.build_jinjaenv()
 
-    ok = err = 0
-    ret = []
-    errors = set()
-
+    ret = BatchResults()
     for batch in batches:
-        _ok, _err, results, _errors = build_batch(site, jinjaenv, batch)
-        ok += _ok
-        err += _err
-        ret.extend(results)
-        errors.update(_errors)
+        for rec in iter_build(site, jinjaenv, batch):
+            ret.add(rec)
+            if callback:
+                callback(rec)
+
+    return ret.get()
+
+
+# Allowance for coarse timestamps of the file system.
+STORE_MTIME_RESOLUTION = 2.0
+
+
+def count_outputs(results: BuildResult) -> Tuple[int, int]:
+    """Returns number of output files written and left unchanged."""
 
-    return ok, err, ret, errors
+    written = unchanged = 0
+    for result in results:
+        for oi in result[2]:
+            if oi.written:
+                written += 1
+            else:
+                unchanged += 1
+    return written, unchanged
 
 
-def build(site: Site) -> Tuple[int, int, DependsDict, BuildResult, Set[ContentPath]]:
+def build(
+    site: Site,
+    pool: Optional[BuildPool] = None,
+    updates: Optional[Set[ContentPath]] = None,
+    recs: Optional[depends.DependsRecords] = None,
+) -> Tuple[int, int, DependsDict, BuildResult, Set[ContentPath]]:
+    """Build the site.
+
+    If updates is given, contents in updates are built instead of
+    contents selected by depends.check_depends(). recs are the records
+    of the previous build, loaded from the depends file if omitted.
+    """
+
+    if recs is None:
+        recs = depends.load_records(site)
+
     if site.rebuild:
         rebuild = True
+    elif updates is not None:
+        loaded = depends.get_depends(recs)
+        if loaded:
+            rebuild = False
+            deps, outputinfos, _ = loaded
+        else:
+            rebuild = True
     else:
-        rebuild, updates, deps, outputinfos = depends.check_depends(site)
+        rebuild, updates, deps, outputinfos = depends.check_depends(site, recs)
+
+    reads: depends.PageReads = {}
+    hashes: Optional[depends.Hashes] = None
+    if not rebuild:
+        reads = depends.get_reads(recs)
+        hashes = depends.get_hashes(recs)
 
     builders = []
+    # config entries read to create builders, e.g. the number of index pages
+    createreads: depends.PageReads = {}
     for contentpath, content in site.files.items():
-        if rebuild or (contentpath in updates):
-            builders.extend(create_builders(site, content))
+        if rebuild or (contentpath in (updates or ())):
+            with site.config.record() as configs:
+                builders.extend(create_builders(site, content))
+            createreads[contentpath] = (configs, {})
+
+    # costs are kept even if not used, to order builders when enabled later
+    costs = depends.get_costs(recs)
+    if site.config.get("/", "order_builders_by_cost"):
+        builders = sort_builders(site, builders, costs)
 
-    batches = split_batch(builders)
+    batches = split_batch(builders, pool.num_workers if pool else None)
 
     if not site.outputdir.is_dir():
         site.outputdir.mkdir(parents=True, exist_ok=True)
 
-    if not site.debug:
-        ok, err, newresults, errors = asyncio.run(submit(site, batches))
-    else:
-        ok, err, newresults, errors = submit_debug(site, batches)
-
     if rebuild:
         deps = {}
         outputinfos = []
 
-    newdeps = depends.update_deps(site, deps, newresults, errors)
-    newois = depends.update_outputinfos(site, outputinfos, newresults)
-    depends.save_deps(site, newdeps, newois, errors)
+    # merge results into depends and sitemap data while building
+    updater = depends.DependsUpdater(site, deps, outputinfos)
+
+    def on_built(rec: BuiltRec) -> None:
+        result = rec[1]
+        if result:
+            updater.add(result)
+
+    started = time.time()
+    if not site.debug:
+        ok, err, newresults, errors, newcosts, newreads = submit(
+            site, batches, pool, on_built
+        )
+    else:
+        ok, err, newresults, errors, newcosts, newreads = submit_debug(
+            site, batches, on_built
+        )
+
+    for contentpath, (configs, _) in createreads.items():
+        newreads.setdefault(contentpath, ({}, {}))[0].update(configs)
+
+    newdeps = updater.get_deps()
+    newois = updater.get_outputinfos()
+    costs = depends.update_costs(site, costs, newcosts)
+    reads = depends.update_reads(site, reads, newreads)
+    hashes = depends.update_hashes(site, hashes, newdeps, newresults)
+    depends.save_deps(site, newdeps, newois, errors, costs, reads, hashes)
+
+    store = site.render_cache.store
+    if rebuild and store and not errors:
+        # every content was rendered, so unused entries are obsolete
+        store.prune(started - STORE_MTIME_RESOLUTION)
 
     if site.config.get("/", "generate_sitemap", True):
         sitemap.write_sitemap(site, newois)
@@ -1,7 +1,18 @@
 import collections
 import datetime
 import os
-from typing import Any, Callable, DefaultDict, Dict, List, Optional, Union
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    DefaultDict,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import dateutil.parser
 
@@ -48,6 +59,7 @@ DEFAULTS = dict(
     ipynb_export_options=IPYNB_EXPORT_OPTIONS,
     ipynb_template_name="classic",
     ipynb_template_file="base.html.j2",
+    ipynb_extract_outputs=False,
     feedtype="atom",
     feed_num_articles=20,
     title="",
@@ -70,6 +82,15 @@ DEFAULTS = dict(
     has_jinja=False,
     short_header_id=False,
     strip_directory_index=False,
+    order_builders_by_cost=True,
+    render_cache=True,
+    render_cache_size=1000,
+    render_cache_dir="_render_cache",
+    jinja_bytecode_cache_dir="_jinja_cache",
+    jinja_template_cache_size=1000,
+    load_processes=0,
+    detect_changes_by_hash=False,
+    binary_output_mode="copy",
 )
 
 
@@ -87,18 +108,76 @@ def remove_theme_confs(cfg: Dict[str, Any]) -> Dict[str, Any]:
 CUMULATIVE_CONFIGS = {"imports"}
 
 
+class _Missing:
+    """Recorded value of config entries which are not found."""
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+    def __reduce__(self) -> str:
+        return "MISSING"
+
+
+MISSING = _Missing()
+
+# (dirname, name) -> value of the config entries read.
+ConfigReads = Dict[Tuple[PathTuple, str], Any]
+
+
 class Config:
     updated: float
+    generation: int
     _configs: DefaultDict[PathTuple, List[Dict[str, Any]]]
+    _recorders: List[ConfigReads]
+    _flat: Dict[PathTuple, Dict[str, Any]]
+    _resolved: Dict[Tuple[PathTuple, str], Any]
 
     def __init__(self, d: Dict[str, Any]):
         self._configs = collections.defaultdict(list)
         self.updated = 0
         self.root = d
         self.themes: List[Dict[str, Any]] = []
+        self._recorders = []
+        self.generation = 0
+        self._flat = {}
+        self._resolved = {}
+
+    def _invalidate(self) -> None:
+        self.generation += 1
+        self._flat.clear()
+        self._resolved.clear()
+
+    @contextmanager
+    def record(self) -> Iterator[ConfigReads]:
+        """Record config entries read by get() in the block."""
+
+        reads: ConfigReads = {}
+        self._recorders.append(reads)
+        try:
+            yield reads
+        finally:
+            self._recorders.pop()
+
+    def replay(self, reads: ConfigReads) -> None:
+        """Record config entries as if they were read."""
+
+        for recorder in self._recorders:
+            recorder.update(reads)
+
+    def is_updated(self, reads: ConfigReads) -> bool:
+        """True if any of recorded config entries has been changed."""
+
+        for (dirname, name), value in reads.items():
+            try:
+                if self.get(dirname, name, MISSING) != value:
+                    return True
+            except Exception:
+                return True
+        return False
 
     def add_themecfg(self, cfg: Dict[str, Any]) -> None:
         self.themes.append(cfg)
+        self._invalidate()
 
     def add(
         self,
@@ -123,6 +202,7 @@ class Config:
             self._configs[_dirname].append(cfg)
         else:
             self._configs[_dirname].insert(0, cfg)
+        self._invalidate()
 
         if contentsrc:
             if not contentsrc.package:
@@ -140,33 +220,51 @@ class Config:
         else:
             _dirname = dirname
 
-        if name in CUMULATIVE_CONFIGS:
-            return self.get_cumulative(_dirname, name, default)
+        value = self._resolve(_dirname, name)
+        for reads in self._recorders:
+            reads[(_dirname, name)] = value
 
-        while True:
-            configs = self._configs.get(_dirname, None)
-            if configs:
-                for config in configs:
-                    if name in config:
-                        return format_value(name, config[name])
+        if value is MISSING:
+            if default is not self._omit:
+                return default
+            raise exceptions.ConfigNotFound(f"{dirname}:{name}")
 
-            if not _dirname:
-                if name in self.root:
-                    return format_value(name, self.root[name])
+        return value
 
-                for config in self.themes:
-                    if name in config:
-                        return format_value(name, config[name])
+    def _resolve(self, dirname: PathTuple, name: str) -> Any:
+        key = (dirname, name)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
 
-                if name in DEFAULTS:
-                    return format_value(name, DEFAULTS[name])
+        if name in CUMULATIVE_CONFIGS:
+            value = self.get_cumulative(dirname, name, MISSING)
+        else:
+            flat = self._get_flat(dirname)
+            value = format_value(name, flat[name]) if name in flat else MISSING
+
+        self._resolved[key] = value
+        return value
+
+    def _get_flat(self, dirname: PathTuple) -> Dict[str, Any]:
+        """Config entries visible from the directory."""
 
-                if default is not self._omit:
-                    return default
+        flat = self._flat.get(dirname)
+        if flat is None:
+            if dirname:
+                flat = dict(self._get_flat(dirname[:-1]))
+            else:
+                flat = dict(DEFAULTS)
+                for config in reversed(self.themes):
+                    flat.update(config)
+                flat.update(self.root)
 
-                raise exceptions.ConfigNotFound(f"{dirname}:{name}")
+            for config in reversed(self._configs.get(dirname, ())):
+                flat.update(config)
 
-            _dirname = _dirname[:-1]
+            self._flat[dirname] = flat
+        return flat
 
     def get_cumulative(
         self, dirname: PathTuple, name: str, default: Any = _omit
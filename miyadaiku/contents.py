@@ -10,15 +10,21 @@ import string
 import unicodedata
 import urllib.parse
 from pathlib import Path, PurePosixPath
-from typing import Any, Counter, Dict, List, Optional, Tuple, cast
+from typing import Any, Counter, Dict, List, Optional, Tuple, Union, cast
 
 import pytz
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString
 
-from miyadaiku import METADATA_FILE_SUFFIX, ContentSrc, PathTuple, repr_contentpath
+from miyadaiku import (
+    METADATA_FILE_SUFFIX,
+    ContentSrc,
+    PathTuple,
+    exceptions,
+    repr_contentpath,
+)
 
-from . import config, context, extend, site
+from . import arena, config, context, extend, site
 from .jinjaenv import safepath
 
 # https://stackoverflow.com/a/2267446
@@ -52,11 +58,36 @@ class Content:
     use_abs_path = False
 
     src: ContentSrc
-    body: Optional[bytes]
+    _body: Union[None, bytes, arena.BodyRef]
+
+    # name -> (value, config entries read)
+    _metadata_cache: Dict[str, Tuple[Any, config.ConfigReads]]
+    _metadata_generation: int
 
     def __init__(self, src: ContentSrc, body: Optional[bytes]) -> None:
         self.src = src
-        self.body = body
+        self._body = body
+        self._metadata_cache = {}
+        self._metadata_generation = 0
+
+    @property
+    def body(self) -> Optional[bytes]:
+        if isinstance(self._body, arena.BodyRef):
+            return self._body.read()
+        return self._body
+
+    @body.setter
+    def body(self, body: Optional[bytes]) -> None:
+        self._body = body
+
+    def store_body(self, bodyarena: arena.BodyArena) -> Optional[bytes]:
+        """Move the body to bodyarena. Returns the body moved, if any."""
+
+        body = self._body
+        if isinstance(body, bytes) and (len(body) >= arena.MIN_BODY_SIZE):
+            self._body = bodyarena.add(body)
+            return body
+        return None
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} at {hex(id(self))} {self.src.srcpath}>"
@@ -86,12 +117,15 @@ date: {datestr}
         metafilename.write_text(yaml, "utf-8")
 
         self.src.metadata["date"] = datestr
+        self.invalidate_metadata()
+        site.files.invalidate_index()
 
     def get_body(self) -> bytes:
-        if self.body is None:
+        body = self.body
+        if body is None:
             return self.src.read_bytes()
         else:
-            return self.body
+            return body
 
     def get_parent(self) -> PathTuple:
         return self.src.contentpath[0]
@@ -111,12 +145,37 @@ date: {datestr}
             return site.config.get(dirname, name, default)
 
     def get_metadata(self, site: site.Site, name: str, default: Any = _omit) -> Any:
+        if self._metadata_generation != site.config.generation:
+            self._metadata_cache.clear()
+            self._metadata_generation = site.config.generation
+
+        cached = self._metadata_cache.get(name)
+        if cached is None:
+            with site.config.record() as reads:
+                value = self._get_metadata(site, name)
+            cached = self._metadata_cache[name] = (value, reads)
+        else:
+            site.config.replay(cached[1])
+
+        value = cached[0]
+        if value is config.MISSING:
+            if default is self._omit:
+                raise exceptions.ConfigNotFound(f"{self.get_parent()}:{name}")
+            return default
+        return value
+
+    def _get_metadata(self, site: site.Site, name: str) -> Any:
         methodname = f"metadata_{name}"
         method = getattr(self, methodname, None)
         if method:
             return method(site)
 
-        return self.get_config_metadata(site, name, default)
+        return self.get_config_metadata(site, name, config.MISSING)
+
+    def invalidate_metadata(self) -> None:
+        """Discard metadata values resolved so far."""
+
+        self._metadata_cache.clear()
 
     def metadata_has_jinja(self, site: site.Site) -> Any:
         return self.get_config_metadata(site, "has_jinja")
@@ -271,14 +330,63 @@ date: {datestr}
     def _build_html_src(self, ctx: context.OutputContext) -> None:
         ctx.set_cache("html", self, "")
 
+    def get_render_cache_key(
+        self, ctx: context.OutputContext
+    ) -> Optional[Tuple[Any, ...]]:
+        return None
+
+    def get_render_digest(
+        self, ctx: context.OutputContext, key: Tuple[Any, ...]
+    ) -> Optional[str]:
+        return None
+
     def _build_html(self, ctx: context.OutputContext) -> None:
         ret = ctx.get_cache("html", self)
         if ret is not None:
+            if ctx.is_page_dependent(self):
+                ctx.add_page_dependent(self)
             return
 
         ctx.add_depend(self)
-        with ctx.on_build_html(self):
-            self._build_html_src(ctx)
+
+        key = self.get_render_cache_key(ctx)
+        digest = None
+        if key is not None:
+            digest = self.get_render_digest(ctx, key)
+            cached = ctx.site.render_cache.get(key, digest, ctx.jinjaenv)
+            if cached is not None:
+                values, depends = cached
+                if "soup" not in values and "html" in values:
+                    values["soup"] = BeautifulSoup(values["html"], "html.parser")
+                ctx.set_content_cache(self, values)
+                for contentpath in depends:
+                    ctx.add_depend(ctx.site.files.get_content(contentpath))
+                ctx.site.config.replay(values.get("config_reads", {}))
+                ctx.jinjaenv.replay_templates(values.get("templates", ()))
+                return
+
+        with ctx.collect_depends() as depends, ctx.site.config.record() as configs:
+            with ctx.jinjaenv.record_templates() as templates:
+                with ctx.collect_page_dependents() as page_dependents:
+                    with ctx.on_build_html(self):
+                        self._build_html_src(ctx)
+        ctx.set_cache("depends", self, depends)
+        ctx.set_cache("config_reads", self, configs)
+        ctx.set_cache("templates", self, templates)
+
+        # Contents without cache key are assumed to depend on the page. HTML
+        # rendered from page dependent contents cannot be shared.
+        if key is None or page_dependents:
+            ctx.add_page_dependent(self)
+            return
+
+        values = ctx.get_content_cache(self)
+        ctx.site.render_cache.set(key, (values, depends))
+        if digest is not None:
+            values = {k: v for k, v in values.items() if k != "soup"}
+            ctx.site.render_cache.save(
+                digest, (values, depends), depends, (configs, templates)
+            )
 
     def get_html(self, ctx: context.OutputContext) -> str:
         self._build_html(ctx)
@@ -408,6 +516,44 @@ class HTMLContent(Content):
 
         return ".html"
 
+    def get_render_cache_key(
+        self, ctx: context.OutputContext
+    ) -> Optional[Tuple[Any, ...]]:
+        if not self.get_metadata(ctx.site, "render_cache"):
+            return None
+
+        if self.get_metadata(ctx.site, "has_jinja"):
+            if ctx.site.render_cache.is_page_dependent(ctx, self):
+                return None
+            return (self.src.contentpath, ctx.get_page_key())
+
+        if extend.hooks_post_build_html:
+            return (self.src.contentpath, ctx.get_page_key())
+
+        return (self.src.contentpath, None)
+
+    def get_render_digest(
+        self, ctx: context.OutputContext, key: Tuple[Any, ...]
+    ) -> Optional[str]:
+        store = ctx.site.render_cache.store
+        if store is None:
+            return None
+
+        # post_build_html hooks are not part of the digest
+        if extend.hooks_post_build_html:
+            return None
+
+        values = [
+            key,
+            store.get_content_digest(self.src.contentpath),
+            self.get_config_metadata(ctx.site, "short_header_id"),
+        ]
+        if self.get_metadata(ctx.site, "has_jinja"):
+            if ctx.site.render_cache.has_jinja_tags(ctx, self):
+                values.append(store.get_env_digest())
+
+        return store.make_digest(*values)
+
     def set_anchors(self, ctx: context.OutputContext, soup: Any) -> Any:
         """
         1. Record ".header_target" elems.
@@ -503,6 +649,8 @@ class HTMLContent(Content):
 
         if ctx.get_cache("headers", self) is not None:
             # already built
+            if ctx.is_page_dependent(self):
+                ctx.add_page_dependent(self)
             return
 
         if self._in_build_headers:
@@ -530,14 +678,42 @@ class HTMLContent(Content):
         if not soup:
             return ""
 
-        soup = copy.copy(ctx.get_cache("soup", self))
+        if abstract_length is None:
+            abstract_length = ctx.content.get_metadata(ctx.site, "abstract_length")
+
+        key = self.get_render_cache_key(ctx)
+        if ctx.is_page_dependent(self):
+            key = None
+
+        digest = None
+        if key is not None:
+            key = key + ("abstract", abstract_length, plain)
+            digest = self.get_render_digest(ctx, key)
+            cached = ctx.site.render_cache.get(key, digest, ctx.jinjaenv)
+            if cached is not None:
+                return cast(str, cached)
+
+        ret = self._build_abstract(soup, abstract_length, plain)
+        if key is not None:
+            ctx.site.render_cache.set(key, ret)
+            if digest is not None:
+                ctx.site.render_cache.save(
+                    digest,
+                    ret,
+                    ctx.get_cache("depends", self) or (),
+                    (
+                        ctx.get_cache("config_reads", self) or {},
+                        ctx.get_cache("templates", self) or {},
+                    ),
+                )
+        return ret
+
+    def _build_abstract(self, soup: Any, abstract_length: int, plain: bool) -> str:
+        soup = copy.copy(soup)
 
         for elem in soup(["head", "style", "script", "title"]):
             elem.extract()
 
-        if abstract_length is None:
-            abstract_length = ctx.content.get_metadata(ctx.site, "abstract_length")
-
         def return_abstract() -> str:
             if not plain:
                 return str(soup)
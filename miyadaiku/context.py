@@ -1,6 +1,8 @@
 from __future__ import annotations
 
+import collections
 import datetime
+import filecmp
 import os
 import posixpath
 import random
@@ -18,6 +20,7 @@ from typing import (
     Callable,
     DefaultDict,
     Dict,
+    Iterable,
     Iterator,
     List,
     NamedTuple,
@@ -31,10 +34,12 @@ from typing import (
 )
 from urllib.parse import urlparse
 
+import importlib_resources
 import jinja2.exceptions
+import jinja2.meta
+import jinja2.nodes
 import markupsafe
 from feedgenerator import Atom1Feed, Rss201rev2Feed, datetime_safe
-from jinja2 import Environment
 
 from miyadaiku import (
     ContentPath,
@@ -46,8 +51,13 @@ from miyadaiku import (
     repr_contentpath,
 )
 
+from .filecache import file_digest, src_key
+from .jinjaenv import Environment
+
 if TYPE_CHECKING:
     from .contents import Article, Content, FeedPage, IndexPage
+    from .depends import Reads
+    from .renderstore import RenderStore
     from .site import Site
 
 SAFE_STR = Union[str, markupsafe.Markup]
@@ -93,7 +103,10 @@ class ContentProxy:
         for k, v in kwargs.items():
             setattr(self.content, k, v)
 
+        self.content.invalidate_metadata()
         self.context.invalidate_cache()
+        self.context.site.render_cache.clear()
+        self.context.site.files.invalidate_index()
         return ""
 
     @safe_prop
@@ -440,10 +453,125 @@ def prepare_output_path(path: Path, directory: PathTuple, filename: str) -> Path
         except IOError:
             time.sleep(MKDIR_WAIT * random.random())
 
-    if os.path.exists(dest):
+    return Path(dest).absolute()
+
+
+def _unlink_output(dest: Path) -> None:
+    # Files are removed before written, so that files hard-linked to the
+    # output are not modified.
+    if os.path.lexists(dest):
         os.unlink(dest)
 
-    return Path(dest).absolute()
+
+def write_output(dest: Path, body: Union[str, bytes]) -> Tuple[bool, str]:
+    """Write body to dest unless dest has the same contents.
+
+    Returns a tuple of (written, digest of body).
+    """
+
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    digest = file_digest(body)
+    try:
+        if dest.stat().st_size == len(body):
+            if file_digest(dest.read_bytes()) == digest:
+                return False, digest
+    except FileNotFoundError:
+        pass
+
+    _unlink_output(dest)
+    dest.write_bytes(body)
+    return True, digest
+
+
+# ioctl request to clone a file on Linux (btrfs, XFS, etc.)
+FICLONE = 0x40049409
+
+BINARY_OUTPUT_MODES = ("copy", "hardlink", "reflink")
+
+
+def _reflink(src: str, dest: Path) -> bool:
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        try:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            return False
+    return True
+
+
+def _copy_file_range(src: str, dest: Path) -> bool:
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if not copy_file_range:
+        return False
+
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                n = copy_file_range(fsrc.fileno(), fdest.fileno(), size - copied)
+                if not n:
+                    break
+                copied += n
+        except OSError:
+            return False
+    return copied == size
+
+
+def publish_file(dest: Path, src: str, mode: str = "copy") -> bool:
+    """Publish src file to dest unless dest has the same contents.
+
+    mode is one of BINARY_OUTPUT_MODES. dest is hard linked to src in
+    "hardlink" mode, and cloned in "reflink" mode if the file system
+    supports. Otherwise, src is copied with os.copy_file_range() or
+    shutil.copyfile(). Files are copied with the mtime of src, so that
+    unchanged files can be detected without reading them.
+
+    Returns True if dest was written.
+    """
+
+    if mode not in BINARY_OUTPUT_MODES:
+        raise ValueError(f"Invalid binary_output_mode: {mode}")
+
+    srcstat = os.stat(src)
+    try:
+        deststat = dest.stat()
+    except FileNotFoundError:
+        pass
+    else:
+        if os.path.samestat(srcstat, deststat):
+            return False
+
+        if deststat.st_size == srcstat.st_size:
+            if deststat.st_mtime_ns == srcstat.st_mtime_ns:
+                return False
+
+            if (mode != "hardlink") and filecmp.cmp(src, dest, shallow=False):
+                os.utime(dest, ns=(srcstat.st_atime_ns, srcstat.st_mtime_ns))
+                return False
+
+    _unlink_output(dest)
+
+    if mode == "hardlink":
+        try:
+            os.link(src, dest)
+            return True
+        except OSError:
+            # different file systems, etc.
+            pass
+
+    if not ((mode == "reflink") and _reflink(src, dest)):
+        if not _copy_file_range(src, dest):
+            shutil.copyfile(src, dest)
+
+    os.utime(dest, ns=(srcstat.st_atime_ns, srcstat.st_mtime_ns))
+    return True
 
 
 def eval_jinja(
@@ -462,7 +590,7 @@ def eval_jinja(
     filename = f"{repr_contentpath(content.src.contentpath)}#{propname}"
 
     try:
-        template = ctx.jinjaenv.from_string(text)
+        template = ctx.jinjaenv.from_string_cached(text)
 
     except jinja2.exceptions.TemplateSyntaxError as e:
         exc = exceptions.JinjaEvalError(e)
@@ -532,6 +660,144 @@ class HTMLInfo(NamedTuple):
     ]  # ids of header elements specified by header_target class
 
 
+# Variables of the page being built. Contents refer them cannot share
+# rendered HTML with other pages.
+PAGE_VARIABLES = {"page", "context", "bases"}
+
+
+class RenderCache:
+    """Rendered HTML of contents shared between output contexts.
+
+    Entries are keyed by contentpath of the content and properties of the
+    page which can affect the rendered HTML, such as directory of the page
+    URL used to build relative links. Entries with a digest are also saved
+    to the persistent store to be reused by later builds.
+    """
+
+    maxsize: int
+    hits: int
+    misses: int
+    store_hits: int
+    store: Optional[RenderStore]
+
+    _entries: collections.OrderedDict[Tuple[Any, ...], Any]
+    _body_info: Dict[ContentPath, Tuple[bool, bool]]
+
+    def __init__(
+        self, maxsize: int = 1000, store: Optional[RenderStore] = None
+    ) -> None:
+        self.maxsize = maxsize
+        self.store = store
+        self.hits = self.misses = self.store_hits = 0
+        self._entries = collections.OrderedDict()
+        self._body_info = {}
+
+    def get(
+        self,
+        key: Tuple[Any, ...],
+        digest: Optional[str] = None,
+        jinjaenv: Optional[Environment] = None,
+    ) -> Any:
+        try:
+            value = self._entries[key]
+        except KeyError:
+            pass
+        else:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        if digest is not None and self.store is not None and jinjaenv is not None:
+            value = self.store.get(digest, jinjaenv)
+            if value is not None:
+                self.store_hits += 1
+                self.set(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key: Tuple[Any, ...], value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def save(
+        self,
+        digest: str,
+        value: Any,
+        depends: Iterable[ContentPath] = (),
+        reads: Optional[Reads] = None,
+    ) -> None:
+        if self.store is not None:
+            self.store.set(digest, value, depends, reads or ({}, {}))
+
+    def invalidate(self, contentpath: ContentPath) -> None:
+        for key in [key for key in self._entries if key[0] == contentpath]:
+            del self._entries[key]
+        self._body_info.pop(contentpath, None)
+        if self.store is not None:
+            self.store.invalidate(contentpath)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._body_info.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def _get_body_info(self, ctx: OutputContext, content: Content) -> Tuple[bool, bool]:
+        contentpath = content.src.contentpath
+        ret = self._body_info.get(contentpath)
+        if ret is None:
+            ret = self._body_info[contentpath] = _inspect_body(ctx, content)
+        return ret
+
+    def is_page_dependent(self, ctx: OutputContext, content: Content) -> bool:
+        """True if jinja tags in the body of content refer the page being built."""
+
+        return self._get_body_info(ctx, content)[0]
+
+    def has_jinja_tags(self, ctx: OutputContext, content: Content) -> bool:
+        """True if the body of content is not a plain text for jinja."""
+
+        return self._get_body_info(ctx, content)[1]
+
+
+def _inspect_body(ctx: OutputContext, content: Content) -> Tuple[bool, bool]:
+    src = (content.body or b"").decode("utf-8")
+    try:
+        ast = ctx.jinjaenv.parse(src)
+    except jinja2.exceptions.TemplateSyntaxError:
+        return True, True
+
+    has_tags = False
+    for node in ast.body:
+        if not isinstance(node, jinja2.nodes.Output):
+            has_tags = True
+            break
+        if not all(isinstance(n, jinja2.nodes.TemplateData) for n in node.nodes):
+            has_tags = True
+            break
+
+    if not has_tags:
+        return False, False
+
+    if jinja2.meta.find_undeclared_variables(ast) & PAGE_VARIABLES:
+        return True, True
+
+    # included templates can refer any variables
+    for node in ast.find_all(
+        (jinja2.nodes.Include, jinja2.nodes.Import, jinja2.nodes.FromImport)
+    ):
+        if isinstance(node, jinja2.nodes.Include):
+            return True, True
+        if getattr(node, "with_context", False):
+            return True, True
+
+    return False, True
+
+
 class OutputContext:
     is_sitemap = False
     sitemap_priority = 0.5
@@ -544,6 +810,10 @@ class OutputContext:
 
     _filename_cache: Dict[Tuple[ContentPath, Tuple[Any, ...]], str]
     _cache: DefaultDict[str, Dict[ContentPath, Any]]
+    _depend_collectors: List[Set[ContentPath]]
+    _page_dependents: Set[ContentPath]
+    _page_dependent_collectors: List[Set[ContentPath]]
+    _page_key: Optional[Tuple[Any, ...]]
 
     def __init__(
         self, site: Site, jinjaenv: Environment, contentpath: ContentPath
@@ -556,6 +826,10 @@ class OutputContext:
         self.bases = [self.content]
         self._filename_cache = {}
         self._cache = defaultdict(dict)
+        self._depend_collectors = []
+        self._page_dependents = set()
+        self._page_dependent_collectors = []
+        self._page_key = None
 
     def get_url(self) -> str:
         pageargs = self._build_pagearg()
@@ -568,11 +842,64 @@ class OutputContext:
         return prepare_output_path(self.site.outputdir, dir, filename)
 
     def add_depend(self, content: Content) -> None:
-        self.depends.add(content.src.contentpath)
+        contentpath = content.src.contentpath
+        self.depends.add(contentpath)
+
+        for collector in self._depend_collectors:
+            collector.add(contentpath)
+
+    @contextmanager
+    def collect_depends(self) -> Iterator[Set[ContentPath]]:
+        """Collect contents added by add_depend() in the block."""
+
+        collected: Set[ContentPath] = set()
+        self._depend_collectors.append(collected)
+        try:
+            yield collected
+        finally:
+            self._depend_collectors.pop()
+
+    def add_page_dependent(self, content: Content) -> None:
+        """Mark content and contents rendering it as dependent on this page."""
+
+        contentpath = content.src.contentpath
+        self._page_dependents.add(contentpath)
+
+        for collector in self._page_dependent_collectors:
+            collector.add(contentpath)
+
+    def is_page_dependent(self, content: Content) -> bool:
+        return content.src.contentpath in self._page_dependents
+
+    @contextmanager
+    def collect_page_dependents(self) -> Iterator[Set[ContentPath]]:
+        """Collect contents added by add_page_dependent() in the block."""
+
+        collected: Set[ContentPath] = set()
+        self._page_dependent_collectors.append(collected)
+        try:
+            yield collected
+        finally:
+            self._page_dependent_collectors.pop()
+
+    def get_page_key(self) -> Tuple[Any, ...]:
+        """Properties of this page which can affect HTML of the contents."""
+
+        if self._page_key is None:
+            url = self.content.build_url(self, self._build_pagearg())
+            parsed = urllib.parse.urlsplit(url)
+            self._page_key = (
+                parsed.scheme,
+                parsed.netloc,
+                posixpath.dirname(parsed.path),
+                self.content.use_abs_path,
+            )
+        return self._page_key
 
     def invalidate_cache(self) -> None:
         self._filename_cache = {}
         self._cache = defaultdict(dict)
+        self._page_dependents = set()
 
     def get_cache(self, cachename: str, content: Content) -> Any:
         return self._cache[cachename].get(content.src.contentpath, None)
@@ -580,6 +907,18 @@ class OutputContext:
     def set_cache(self, cachename: str, content: Content, value: Any) -> None:
         self._cache[cachename][content.src.contentpath] = value
 
+    def get_content_cache(self, content: Content) -> Dict[str, Any]:
+        contentpath = content.src.contentpath
+        return {
+            cachename: values[contentpath]
+            for cachename, values in self._cache.items()
+            if contentpath in values
+        }
+
+    def set_content_cache(self, content: Content, values: Dict[str, Any]) -> None:
+        for cachename, value in values.items():
+            self._cache[cachename][content.src.contentpath] = value
+
     def get_filename_cache(
         self, content: Content, tp_pagearg: Tuple[Any, ...]
     ) -> Union[str, None]:
@@ -709,23 +1048,32 @@ class OutputContext:
 
 
 class BinaryOutput(OutputContext):
-    def write_body(self, outpath: Path) -> None:
+    def write_body(self, outpath: Path) -> Tuple[bool, Optional[str]]:
+        """Write the body to outpath. Returns a tuple of (written, digest of
+        the body if known)."""
+
         body = self.content.body
         if body is None:
-            package = self.content.src.package
-            if package:
-                bytes = self.content.src.read_bytes()
-                outpath.write_bytes(bytes)
+            mode = self.content.get_metadata(self.site, "binary_output_mode")
+            src = self.content.src
+            # published file has the same contents as the source file.
+            digest = self.site.files.src_digests.get(src_key(src))
+            if src.package:
+                path = src.get_package_path()
+                # as_file() extracts the resource to a temporary file only
+                # if the package is not in the file system.
+                with importlib_resources.as_file(path) as filename:
+                    return publish_file(outpath, str(filename), mode), digest
             else:
-                assert self.content.src.srcpath
-                shutil.copyfile(self.content.src.srcpath, outpath)
+                assert src.srcpath
+                return publish_file(outpath, src.srcpath, mode), digest
         else:
-            outpath.write_bytes(body)
+            return write_output(outpath, body)
 
     def build(self) -> List[OutputInfo]:
         oi = self.build_outputinfo()
-        self.write_body(oi.filename)
-        return [oi]
+        written, digest = self.write_body(oi.filename)
+        return [oi._replace(written=written, digest=digest)]
 
 
 class JinjaOutput(OutputContext):
@@ -740,8 +1088,8 @@ class JinjaOutput(OutputContext):
         pagearg = self._build_pagearg()
         output = eval_jinja_template(self, self.content, templatename, pagearg)
 
-        oi.filename.write_text(output)
-        return [oi]
+        written, digest = write_output(oi.filename, output)
+        return [oi._replace(written=written, digest=digest)]
 
 
 class IndexOutput(OutputContext):
@@ -799,8 +1147,8 @@ class IndexOutput(OutputContext):
         pagearg = self._build_pagearg()
         output = eval_jinja_template(self, self.content, templatename, pagearg)
 
-        oi.filename.write_text(output)
-        return [oi]
+        written, digest = write_output(oi.filename, output)
+        return [oi._replace(written=written, digest=digest)]
 
 
 # from https://github.com/getpelican/feedgenerator
@@ -887,9 +1235,8 @@ class FeedOutput(OutputContext):
 
         body = feed.writeString("utf-8")
 
-        oi.filename.write_text(body)
-
-        return [oi]
+        written, digest = write_output(oi.filename, body)
+        return [oi._replace(written=written, digest=digest)]
 
 
 CONTEXTS: Dict[str, Type[OutputContext]] = {
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+import hashlib
 import os
 import pickle
 from pathlib import Path
 from typing import (
     TYPE_CHECKING,
+    Any,
     Callable,
     Dict,
     Iterator,
+    NamedTuple,
     Optional,
     Sequence,
     Set,
@@ -22,15 +25,124 @@ from miyadaiku import (
     TEMPLATES_DIR,
     BuildResult,
     ContentPath,
+    ContentSrc,
     DependsDict,
     OutputInfo,
 )
 
+from .config import MISSING, ConfigReads
+from .filecache import file_digest, src_key
+from .jinjaenv import Environment, TemplateReads, create_env
+
 if TYPE_CHECKING:
     from miyadaiku import site
 
 DEP_FILE = "_depends.pickle"
-DEP_VER = "4.0.0"
+DEP_VER = "4.4.0"
+
+BuildCosts = Dict[ContentPath, float]
+# config entries and templates read while building a content
+Reads = Tuple[ConfigReads, TemplateReads]
+PageReads = Dict[ContentPath, Reads]
+
+
+class Hashes(NamedTuple):
+    """Digests of the files. sources and dirs are recorded only if
+    detect_changes_by_hash is enabled."""
+
+    # filecache.src_key() -> digest of the source file
+    sources: Dict[str, str]
+    # output filename -> (size, mtime in ns, digest if known)
+    outputs: Dict[str, Tuple[int, int, Optional[str]]]
+    # directory name -> digest of the files in the directory
+    dirs: Dict[str, str]
+
+
+class DependsRecords(NamedTuple):
+    """Records of the previous build saved in DEP_FILE."""
+
+    mtime: float
+    ver: str
+    depends: DependsDict
+    outputinfos: Sequence[OutputInfo]
+    errors: Set[ContentPath]
+    costs: BuildCosts
+    reads: PageReads
+    siteconfigs: Dict[str, Any]
+    hashes: Optional[Hashes]
+
+
+def load_records(site: site.Site) -> Optional[DependsRecords]:
+    """Load records of the previous build. Returns None if the file is
+    missing, broken or in old format."""
+
+    deppath = site.root / DEP_FILE
+    try:
+        with open(deppath, "rb") as f:
+            recs = pickle.load(f)
+
+        if recs[1] != DEP_VER:
+            return None
+
+        return DependsRecords(*recs)
+    except Exception:
+        return None
+
+
+# Config entries used outside of builds. Changes of them rebuild all contents.
+SITE_CONFIGS = (
+    "themes",
+    "ignores",
+    "ipynb_export_options",
+    "ipynb_template_name",
+    "ipynb_template_file",
+    "ipynb_extract_outputs",
+    "pygments_css",
+    "pygments_style",
+    "detect_changes_by_hash",
+)
+
+
+def get_site_configs(site: site.Site) -> Dict[str, Any]:
+    ret = {name: site.config.get((), name, MISSING) for name in SITE_CONFIGS}
+
+    # templates loaded as global modules
+    jinjaenv = create_template_env(site)
+    ret["jinja_templates"] = {
+        name: jinjaenv.get_template_digest(templatename)
+        for name, templatename in site.jinja_templates.items()
+    }
+    return ret
+
+
+def create_template_env(site: site.Site) -> Environment:
+    """Environment to look up sources of the templates."""
+
+    return create_env(site, site.themes, [site.root / TEMPLATES_DIR])
+
+
+def get_dir_digest(path: Path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    if path.is_dir():
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                filename = Path(root) / file
+                h.update(str(filename.relative_to(path)).encode("utf-8"))
+                h.update(file_digest(filename.read_bytes()).encode("utf-8"))
+    return h.hexdigest()
+
+
+def is_output_updated(filename: Path, rec: Tuple[int, int, Optional[str]]) -> bool:
+    """True if the output file was modified since rec was recorded."""
+
+    size, mtime_ns, digest = rec
+    stat = filename.stat()
+    if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+        return False
+    if (stat.st_size != size) or (digest is None):
+        return True
+    return file_digest(filename.read_bytes()) != digest
 
 
 def is_newer(path: Path, mtime: float) -> bool:
@@ -56,53 +168,53 @@ def check_directory(
 
 
 def check_depends(
-    site: site.Site,
+    site: site.Site, recs: Optional[DependsRecords]
 ) -> Tuple[bool, Set[ContentPath], DependsDict, Sequence[OutputInfo]]:
-    deppath = site.root / DEP_FILE
-
-    mtime: float
-    ver: str
-    depends: DependsDict
-    results: BuildResult
-
-    # load depends file
-    try:
-        with open(deppath, "rb") as f:
-            recs = pickle.load(f)
-
-        if recs[1] != DEP_VER:
-            # old file format
-            return True, set(), {}, []
+    """Select contents to be rebuilt by the records of the previous build."""
 
-        mtime, ver, depends, outputinfos, errors = recs
-    except Exception:
-        # file load error
+    if recs is None:
+        # file load error or old file format
         return True, set(), {}, []
 
-    # rebuild if config file updated
-    if is_newer(site.root / CONFIG_FILE, mtime):
+    (
+        mtime,
+        ver,
+        depends,
+        outputinfos,
+        errors,
+        costs,
+        reads,
+        siteconfigs,
+        hashes,
+    ) = recs
+
+    # rebuild if config entries or templates used by the site are updated
+    if siteconfigs != get_site_configs(site):
         return True, set(), {}, []
 
-    # todo: check for removal of templates
-
-    # check modules directory
-    if any(check_directory(site.root / MODULES_DIR, mtime)):
-        return True, set(), {}, []
+    by_hash = site.config.get("/", "detect_changes_by_hash")
 
-    # check template directory
-    if any(check_directory(site.root / TEMPLATES_DIR, mtime)):
-        return True, set(), {}, []
-
-    # check nbconvert template directory
-    if any(check_directory(site.root / NBCONVERT_TEMPLATES_DIR, mtime)):
-        return True, set(), {}, []
+    jinjaenv = create_template_env(site)
 
     def is_yaml(filename: Path) -> bool:
         return filename.suffix in (".yml", ".yaml")
 
-    # check contents directory
-    if any(check_directory(site.root / CONTENTS_DIR, mtime, is_yaml)):
-        return True, set(), {}, []
+    # contents which read updated config entries or templates are rebuilt below
+    config_updated = is_newer(site.root / CONFIG_FILE, mtime) or any(
+        check_directory(site.root / CONTENTS_DIR, mtime, is_yaml)
+    )
+    templates_updated = any(check_directory(site.root / TEMPLATES_DIR, mtime))
+
+    # check modules directory and nbconvert template directory
+    for dirname in (MODULES_DIR, NBCONVERT_TEMPLATES_DIR):
+        if any(check_directory(site.root / dirname, mtime)):
+            if (
+                by_hash
+                and hashes
+                and hashes.dirs.get(dirname) == get_dir_digest(site.root / dirname)
+            ):
+                continue
+            return True, set(), {}, []
 
     # rebuild if contents are created or removed
     contentpaths = site.files.get_contentfiles_keys()
@@ -120,7 +232,33 @@ def check_depends(
             return True, set(), {}, []
 
         if ((src.mtime or 0) > mtime) or (path in errors):
-            updated.update(depends[path][1])
+            key = src_key(src)
+            if (
+                (path not in errors)
+                and by_hash
+                and hashes
+                and (key in hashes.sources)
+                and (hashes.sources[key] == site.files.src_digests.get(key))
+            ):
+                # source file was touched but not modified
+                pass
+            else:
+                updated.update(depends[path][1])
+                updated.add(path)
+                continue
+
+        # rebuild if config entries or templates read by the content are updated
+        if path in reads:
+            configreads, templatereads = reads[path]
+            if config_updated and site.config.is_updated(configreads):
+                updated.add(path)
+                continue
+
+            if jinjaenv.is_updated(templatereads):
+                updated.add(path)
+                continue
+
+        elif config_updated or templates_updated:
             updated.add(path)
             continue
 
@@ -130,6 +268,12 @@ def check_depends(
                 updated.add(path)
                 break
 
+            if hashes and (filename in hashes.outputs):
+                if is_output_updated(p, hashes.outputs[filename]):
+                    updated.add(path)
+                    break
+                continue
+
             stat = p.stat()
             if (src.mtime or 0) > stat.st_mtime:
                 updated.add(path)
@@ -139,60 +283,197 @@ def check_depends(
     return False, updated, depends, outputinfos
 
 
-def update_deps(
-    site: site.Site,
-    d: DependsDict,
-    results: BuildResult,
-    errors: Set[ContentPath],
-) -> DependsDict:
+class DependsUpdater:
+    """Merges results of the builders into the records of the previous
+    build.
+
+    Results are added as soon as they are received from the builders, so
+    that dependencies and sitemap data are up to date when the build is
+    finished.
+    """
+
+    _new: Dict[ContentPath, Tuple[Set[ContentPath], Set[str]]]
+    _outputs: Dict[str, OutputInfo]
+
+    def __init__(
+        self,
+        site: site.Site,
+        d: DependsDict,
+        outputinfos: Sequence[OutputInfo],
+    ) -> None:
+        self.site = site
 
-    new: Dict[ContentPath, Tuple[Set[ContentPath], Set[str]]] = {}
+        self._new = {}
+        for contentpath in site.files.get_contentfiles_keys():
+            self._new[contentpath] = (set(), set())
 
-    for contentpath in site.files.get_contentfiles_keys():
-        new[contentpath] = (set(), set())
+        for contentpath, (contentsrc, depends, filenames) in d.items():
+            self._new[contentpath] = (
+                depends,
+                {str(site.outputdir / f) for f in filenames},
+            )
 
-    for contentpath, (contentsrc, depends, filenames) in d.items():
-        new[contentpath] = (depends, {str(site.outputdir / f) for f in filenames})
+        self._outputs = {}
+        for oi in outputinfos:
+            if site.files.has_content(oi.contentpath):
+                self._outputs[oi.url] = oi
+
+    def add(
+        self, result: Tuple[ContentSrc, Set[ContentPath], Sequence[OutputInfo]]
+    ) -> None:
+        contentsrc, depends, outputinfos = result
 
-    for contentsrc, depends, outputinfos in results:
         filenames = {str(oi.filename) for oi in outputinfos}
-        if contentsrc.contentpath in new:
-            new[contentsrc.contentpath][1].update(filenames)
+        if contentsrc.contentpath in self._new:
+            self._new[contentsrc.contentpath][1].update(filenames)
         else:
-            new[contentsrc.contentpath] = (set(), filenames)
+            self._new[contentsrc.contentpath] = (set(), filenames)
 
         for dep_contentpath in depends:
-            if dep_contentpath in new:
-                new[dep_contentpath][0].add(contentsrc.contentpath)
+            if dep_contentpath in self._new:
+                self._new[dep_contentpath][0].add(contentsrc.contentpath)
             else:
-                new[dep_contentpath] = (set([contentsrc.contentpath]), set())
+                self._new[dep_contentpath] = (set([contentsrc.contentpath]), set())
 
-    outputpath = str(site.outputdir)
-    ret: DependsDict = {}
-    for contentpath, (depends, filenames) in new.items():
-        if site.files.has_content(contentpath):
-            src = site.files.get_content(contentpath).src
+        for oi in outputinfos:
+            self._outputs[oi.url] = oi
 
-            filenames = {os.path.relpath(f, outputpath) for f in filenames}
-            ret[contentpath] = (src, depends, filenames)
+    def get_deps(self) -> DependsDict:
+        site = self.site
+        outputpath = str(site.outputdir)
+        ret: DependsDict = {}
+        for contentpath, (depends, filenames) in self._new.items():
+            if site.files.has_content(contentpath):
+                src = site.files.get_content(contentpath).src
 
-    return ret
+                filenames = {os.path.relpath(f, outputpath) for f in filenames}
+                ret[contentpath] = (src, depends, filenames)
+
+        return ret
+
+    def get_outputinfos(self) -> Sequence[OutputInfo]:
+        return list(self._outputs.values())
+
+
+def update_deps(
+    site: site.Site,
+    d: DependsDict,
+    results: BuildResult,
+    errors: Set[ContentPath],
+) -> DependsDict:
+
+    updater = DependsUpdater(site, d, [])
+    for result in results:
+        updater.add(result)
+    return updater.get_deps()
 
 
 def update_outputinfos(
     site: site.Site, outputinfos: Sequence[OutputInfo], newresults: BuildResult
 ) -> Sequence[OutputInfo]:
 
-    merged_outputs = {}
-    for oi in outputinfos:
-        if site.files.has_content(oi.contentpath):
-            merged_outputs[oi.url] = oi
+    updater = DependsUpdater(site, {}, outputinfos)
+    for result in newresults:
+        updater.add(result)
+    return updater.get_outputinfos()
+
+
+def get_depends(
+    recs: Optional[DependsRecords],
+) -> Optional[Tuple[DependsDict, Sequence[OutputInfo], Set[ContentPath]]]:
+    """Dependencies, outputs and errors recorded by the previous build."""
+
+    if recs is None:
+        return None
+    return recs.depends, recs.outputinfos, recs.errors
+
+
+def get_costs(recs: Optional[DependsRecords]) -> BuildCosts:
+    """Build durations of contents recorded by the previous build."""
+
+    if recs is None:
+        return {}
+    return recs.costs
+
+
+def update_costs(
+    site: site.Site, costs: BuildCosts, newcosts: BuildCosts
+) -> BuildCosts:
+    ret = {
+        contentpath: cost
+        for contentpath, cost in costs.items()
+        if site.files.has_content(contentpath)
+    }
+    ret.update(newcosts)
+    return ret
+
+
+def get_reads(recs: Optional[DependsRecords]) -> PageReads:
+    """Config entries read by contents in the previous build."""
+
+    if recs is None:
+        return {}
+    return recs.reads
+
+
+def update_reads(site: site.Site, reads: PageReads, newreads: PageReads) -> PageReads:
+    ret = {
+        contentpath: r
+        for contentpath, r in reads.items()
+        if site.files.has_content(contentpath)
+    }
+    ret.update(newreads)
+    return ret
+
+
+def get_hashes(recs: Optional[DependsRecords]) -> Optional[Hashes]:
+    """Digests of the files recorded by the previous build."""
+
+    if recs is None:
+        return None
+    return recs.hashes
+
+
+def update_hashes(
+    site: site.Site,
+    hashes: Optional[Hashes],
+    depsdict: DependsDict,
+    newresults: BuildResult,
+) -> Hashes:
+
+    # keep records of outputs which were not rebuilt
+    filenames = set()
+    for contentsrc, depends, outputfiles in depsdict.values():
+        filenames.update(outputfiles)
+
+    outputs = {}
+    if hashes:
+        outputs = {
+            filename: rec
+            for filename, rec in hashes.outputs.items()
+            if filename in filenames
+        }
+
+    outputpath = str(site.outputdir)
+    for contentsrc, depends, outputinfos in newresults:
+        for oi in outputinfos:
+            filename = os.path.relpath(oi.filename, outputpath)
+            try:
+                stat = oi.filename.stat()
+            except OSError:
+                outputs.pop(filename, None)
+                continue
+            outputs[filename] = (stat.st_size, stat.st_mtime_ns, oi.digest)
+
+    if not site.config.get("/", "detect_changes_by_hash"):
+        return Hashes({}, outputs, {})
 
-    for resultrec in newresults:
-        for oi in resultrec[2]:
-            merged_outputs[oi.url] = oi
+    dirs = {
+        dirname: get_dir_digest(site.root / dirname)
+        for dirname in (MODULES_DIR, NBCONVERT_TEMPLATES_DIR)
+    }
 
-    return list(merged_outputs.values())
+    return Hashes(dict(site.files.src_digests), outputs, dirs)
 
 
 def save_deps(
@@ -200,7 +481,23 @@ def save_deps(
     depsdict: DependsDict,
     outputinfos: Sequence[OutputInfo],
     errors: Set[ContentPath],
+    costs: Optional[BuildCosts] = None,
+    reads: Optional[PageReads] = None,
+    hashes: Optional[Hashes] = None,
 ) -> None:
 
     with open(site.root / DEP_FILE, "wb") as f:
-        pickle.dump((site.files.mtime, DEP_VER, depsdict, outputinfos, errors), f)
+        pickle.dump(
+            DependsRecords(
+                site.files.mtime,
+                DEP_VER,
+                depsdict,
+                outputinfos,
+                errors,
+                costs or {},
+                reads or {},
+                get_site_configs(site),
+                hashes,
+            ),
+            f,
+        )
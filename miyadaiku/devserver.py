@@ -0,0 +1,352 @@
+"""HTTP server for previewing the output directory.
+
+Files are served by an asyncio server running in a thread, so that requests
+are handled concurrently while the site is being built. HTML pages are
+served with a small script which listens to the build events sent as
+Server-Sent Events, and reloads the page only if the page or a resource
+loaded by the page has been updated.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import json
+import logging
+import mimetypes
+import threading
+import urllib.parse
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from miyadaiku import BuildResult
+
+logger = logging.getLogger(__name__)
+
+EVENTS_PATH = "/__miyadaiku__/events"
+
+# Interval to send comments to keep the event stream open
+PING_INTERVAL = 15
+
+MAX_HEADER_SIZE = 65536
+
+RELOAD_SCRIPT = (
+    """<script>
+(function () {
+  var events = new EventSource("%s");
+  events.addEventListener("reload", function (ev) {
+    var updated = JSON.parse(ev.data);
+    var urls = [location.href];
+    performance.getEntriesByType("resource").forEach(function (e) {
+      urls.push(e.name);
+    });
+    for (var i = 0; i < urls.length; i++) {
+      var url = new URL(urls[i], location.href);
+      if (url.origin !== location.origin) {
+        continue;
+      }
+      var path = decodeURIComponent(url.pathname);
+      if (path.endsWith("/")) {
+        path += "index.html";
+      }
+      if (updated.indexOf(path) >= 0) {
+        location.reload();
+        return;
+      }
+    }
+  });
+})();
+</script>
+"""
+    % EVENTS_PATH
+).encode("utf-8")
+
+Headers = Dict[str, str]
+
+
+def updated_paths(outputdir: Path, results: BuildResult) -> Set[str]:
+    """Returns URL paths of the output files written by the build."""
+
+    root = outputdir.resolve()
+    ret = set()
+    for contentsrc, depends, outputinfos in results:
+        for oi in outputinfos:
+            if not oi.written:
+                continue
+            try:
+                relpath = Path(oi.filename).resolve().relative_to(root)
+            except ValueError:
+                continue
+            ret.add("/" + relpath.as_posix())
+    return ret
+
+
+def inject_script(body: bytes) -> bytes:
+    pos = body.lower().rfind(b"</body>")
+    if pos == -1:
+        return body + RELOAD_SCRIPT
+    return body[:pos] + RELOAD_SCRIPT + body[pos:]
+
+
+def _etag(stat: Any) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _not_modified(headers: Headers, etag: str, mtime: float) -> bool:
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        tags = [t.strip() for t in inm.split(",")]
+        return ("*" in tags) or (etag in tags) or (f"W/{etag}" in tags)
+
+    ims = headers.get("if-modified-since")
+    if ims is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since.timestamp()
+
+    return False
+
+
+class DevServer:
+    outputdir: Path
+    bind: str
+    port: int
+
+    _thread: Optional[threading.Thread]
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _stopped: Optional[asyncio.Event]
+    _clients: Set[asyncio.Queue[List[str]]]
+    _writers: Set[asyncio.StreamWriter]
+    _error: Optional[BaseException]
+
+    def __init__(self, outputdir: Path, bind: str = "", port: int = 8800) -> None:
+        self.outputdir = outputdir.resolve()
+        self.bind = bind
+        self.port = port
+        self._thread = None
+        self._loop = None
+        self._stopped = None
+        self._clients = set()
+        self._writers = set()
+        self._error = None
+
+    def start(self) -> None:
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+        if self._error:
+            raise self._error
+
+    def join(self) -> None:
+        if self._thread:
+            self._thread.join()
+
+    def stop(self) -> None:
+        if self._loop and self._stopped:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        self.join()
+
+    def notify(self, paths: Iterable[str]) -> None:
+        """Send reload event for the updated paths to the browsers."""
+
+        updated = sorted(paths)
+        if updated and self._loop:
+            self._loop.call_soon_threadsafe(self._broadcast, updated)
+
+    def _broadcast(self, paths: List[str]) -> None:
+        for queue in self._clients:
+            queue.put_nowait(paths)
+
+    def _run(self, ready: threading.Event) -> None:
+        try:
+            asyncio.run(self._serve(ready))
+        except BaseException as e:
+            self._error = e
+        finally:
+            ready.set()
+
+    async def _serve(self, ready: threading.Event) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+
+        server = await asyncio.start_server(
+            self._handle, self.bind or None, self.port, limit=MAX_HEADER_SIZE
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        ready.set()
+
+        async with server:
+            await self._stopped.wait()
+            for writer in list(self._writers):
+                writer.close()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                if not await self._respond(writer, *request):
+                    break
+        except (
+            ConnectionError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+        ):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Optional[Tuple[str, str, str, Headers]]:
+        try:
+            data = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+
+        lines = data.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split()
+        except ValueError:
+            return None
+
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        return method, target, version, headers
+
+    async def _send(
+        self,
+        writer: asyncio.StreamWriter,
+        status: str,
+        headers: Headers,
+        body: bytes = b"",
+        head: bool = False,
+    ) -> None:
+        lines = [f"HTTP/1.1 {status}"]
+        lines.extend(f"{k}: {v}" for k, v in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        if body and not head:
+            writer.write(body)
+        await writer.drain()
+
+    async def _respond(
+        self,
+        writer: asyncio.StreamWriter,
+        method: str,
+        target: str,
+        version: str,
+        headers: Headers,
+    ) -> bool:
+        """Send response to the request. Returns False if the connection
+        should be closed."""
+
+        keepalive = (version == "HTTP/1.1") and (
+            headers.get("connection", "").lower() != "close"
+        )
+        resp_headers = {"Connection": "keep-alive" if keepalive else "close"}
+
+        if method not in ("GET", "HEAD"):
+            resp_headers.update({"Allow": "GET, HEAD", "Content-Length": "0"})
+            await self._send(writer, "405 Method Not Allowed", resp_headers)
+            return False
+
+        path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+        if path == EVENTS_PATH:
+            await self._send_events(writer)
+            return False
+
+        head = method == "HEAD"
+        filename = self._get_filename(path)
+        if filename is None:
+            body = b"Not Found"
+            resp_headers.update(
+                {"Content-Type": "text/plain", "Content-Length": str(len(body))}
+            )
+            await self._send(writer, "404 Not Found", resp_headers, body, head)
+            return keepalive
+
+        if filename.is_dir():
+            location = urllib.parse.quote(path + "/")
+            resp_headers.update({"Location": location, "Content-Length": "0"})
+            await self._send(writer, "301 Moved Permanently", resp_headers)
+            return keepalive
+
+        stat = filename.stat()
+        etag = _etag(stat)
+        resp_headers.update(
+            {
+                "Cache-Control": "no-cache",
+                "ETag": etag,
+                "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+            }
+        )
+
+        if _not_modified(headers, etag, stat.st_mtime):
+            await self._send(writer, "304 Not Modified", resp_headers)
+            return keepalive
+
+        mimetype, encoding = mimetypes.guess_type(filename.name)
+        mimetype = mimetype or "application/octet-stream"
+
+        loop = asyncio.get_running_loop()
+        body = b"" if head else await loop.run_in_executor(None, filename.read_bytes)
+        if mimetype == "text/html":
+            body = inject_script(body)
+            length = len(body) if not head else stat.st_size + len(RELOAD_SCRIPT)
+        else:
+            length = len(body) if not head else stat.st_size
+
+        resp_headers.update({"Content-Type": mimetype, "Content-Length": str(length)})
+        await self._send(writer, "200 OK", resp_headers, body, head)
+        return keepalive
+
+    def _get_filename(self, path: str) -> Optional[Path]:
+        filename = (self.outputdir / path.lstrip("/")).resolve()
+        try:
+            filename.relative_to(self.outputdir)
+        except ValueError:
+            return None
+
+        if filename.is_dir() and path.endswith("/"):
+            filename = filename / "index.html"
+
+        if not filename.exists():
+            return None
+        return filename
+
+    async def _send_events(self, writer: asyncio.StreamWriter) -> None:
+        queue: asyncio.Queue[List[str]] = asyncio.Queue()
+        self._clients.add(queue)
+        try:
+            headers = {
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "Connection": "close",
+            }
+            await self._send(writer, "200 OK", headers)
+            writer.write(b"retry: 1000\n\n")
+            await writer.drain()
+
+            while True:
+                try:
+                    paths = await asyncio.wait_for(queue.get(), PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    writer.write(b": ping\n\n")
+                else:
+                    data = json.dumps(paths)
+                    writer.write(f"event: reload\ndata: {data}\n\n".encode("utf-8"))
+                await writer.drain()
+        finally:
+            self._clients.discard(queue)
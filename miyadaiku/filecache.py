@@ -0,0 +1,175 @@
+"""Cache of loaded source files.
+
+Loaded contents of the source files are stored in a SQLite database under
+the site root. The database is opened in WAL mode, so that readers are not
+blocked while another process is writing the cache.
+
+An entry is looked up by the size and mtime of the file first. If they
+differ, the digest of the file is compared, so that files touched or
+checked out again without modification are not parsed again. Entries of
+files which were not looked up while loading the site are removed by
+compact(). All entries are removed if the settings of the loaders differ
+from the settings used to build the cache.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from miyadaiku import ContentSrc
+
+logger = logging.getLogger(__name__)
+
+CACHE_VER = "2.0.0"
+
+LoadedFiles = List[Tuple[ContentSrc, Optional[bytes]]]
+
+
+def file_digest(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def src_key(src: ContentSrc) -> str:
+    return f"{src.package}_::::_{src.srcpath}"
+
+
+def _stat_key(stat: Any) -> Tuple[int, int]:
+    return stat.st_size, stat.st_mtime_ns
+
+
+class FileCache:
+    filename: Path
+    # settings of the loaders used to build the cache
+    settings: str
+    # digests of the files looked up
+    digests: Dict[str, str]
+    _conn: sqlite3.Connection
+    _used: Set[str]
+
+    def __init__(
+        self, filename: Path, rebuild: bool = False, settings: str = ""
+    ) -> None:
+        self.filename = filename
+        self.settings = settings
+        self.digests = {}
+        self._used = set()
+        self._conn = self._open(rebuild)
+
+    def _open(self, rebuild: bool) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.filename), timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime INTEGER,
+                    digest TEXT,
+                    bodies BLOB)"""
+            )
+
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if (
+                rebuild
+                or (meta.get("ver") != CACHE_VER)
+                or (meta.get("settings") != self.settings)
+            ):
+                conn.execute("DELETE FROM files")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [("ver", CACHE_VER), ("settings", self.settings)],
+                )
+            conn.commit()
+        except sqlite3.DatabaseError:
+            # broken database
+            conn.close()
+            logger.debug("Recreating file cache: %s", self.filename, exc_info=True)
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.unlink(f"{self.filename}{suffix}")
+                except FileNotFoundError:
+                    pass
+            return self._open(rebuild)
+
+        return conn
+
+    def get(self, src: ContentSrc, stat: Any) -> Optional[LoadedFiles]:
+        """Returns cached contents of the file, or None if the file is not
+        cached or has been modified."""
+
+        key = src_key(src)
+        self._used.add(key)
+
+        row = self._conn.execute(
+            "SELECT size, mtime, digest, bodies FROM files WHERE key=?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+
+        size, mtime, digest, bodies = row
+        touched = (size, mtime) != _stat_key(stat)
+        if touched:
+            if size != stat.st_size:
+                return None
+
+            if file_digest(src.read_bytes()) != digest:
+                return None
+
+        try:
+            ret: LoadedFiles = pickle.loads(bodies)
+        except Exception:
+            return None
+
+        self.digests[key] = digest
+        if touched:
+            # Unmodified file with new mtime.
+            self._conn.execute(
+                "UPDATE files SET mtime=? WHERE key=?", (stat.st_mtime_ns, key)
+            )
+            ret = [(s._replace(mtime=src.mtime), body) for s, body in ret]
+
+        return ret
+
+    def set(self, src: ContentSrc, stat: Any, loaded: LoadedFiles) -> None:
+        key = src_key(src)
+        self._used.add(key)
+
+        size, mtime = _stat_key(stat)
+        digest = self.digests[key] = file_digest(src.read_bytes())
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (key, size, mtime, digest, bodies) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                key,
+                size,
+                mtime,
+                digest,
+                pickle.dumps(loaded, pickle.HIGHEST_PROTOCOL),
+            ),
+        )
+
+    def compact(self) -> int:
+        """Remove entries of files which were not looked up."""
+
+        keys = [
+            row[0]
+            for row in self._conn.execute("SELECT key FROM files")
+            if row[0] not in self._used
+        ]
+        self._conn.executemany("DELETE FROM files WHERE key=?", ((k,) for k in keys))
+        return len(keys)
+
+    def close(self) -> None:
+        self._conn.commit()
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.close()
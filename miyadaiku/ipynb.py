@@ -3,8 +3,8 @@ import hashlib
 import html
 import os
 import re
-from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, List, Match, Optional, Tuple, Union
 
 import nbformat
 from nbconvert.exporters import HTMLExporter
@@ -20,21 +20,37 @@ exporters: Dict[Tuple[str, str], HTMLExporter] = {}
 
 root: Optional[Path] = None
 
+# Outputs extracted to binary files if ipynb_extract_outputs is enabled.
+# Other types of outputs are embedded by the templates.
+EXTRACT_OUTPUT_TYPES = ["image/png", "image/jpeg"]
+
 
 def init(site: Site) -> None:
     global options, exporters, root
 
-    options = copy.deepcopy(site.config.get("/", "ipynb_export_options"))
-    assert options
+    newoptions = copy.deepcopy(site.config.get("/", "ipynb_export_options"))
+    assert newoptions
 
     template_name = site.config.get("/", "ipynb_template_name")
-    options["TemplateExporter"]["template_name"] = template_name
+    newoptions["TemplateExporter"]["template_name"] = template_name
 
     template_file = site.config.get("/", "ipynb_template_file")
-    options["TemplateExporter"]["template_file"] = template_file
+    newoptions["TemplateExporter"]["template_file"] = template_file
+
+    if site.config.get("/", "ipynb_extract_outputs"):
+        extract = newoptions.setdefault("ExtractOutputPreprocessor", {})
+        extract["enabled"] = True
+        extract.setdefault("extract_output_types", EXTRACT_OUTPUT_TYPES)
+
+    newroot = site.root / NBCONVERT_TEMPLATES_DIR
+
+    # Keep exporters if the options are not changed, since building
+    # exporters (resolving templates, etc) is expensive.
+    if (newoptions != options) or (newroot != root):
+        exporters = {}
 
-    exporters = {}
-    root = site.root / NBCONVERT_TEMPLATES_DIR
+    options = newoptions
+    root = newroot
 
 
 def _make_exporter(
@@ -64,19 +80,20 @@ def _export(
     json: Dict[str, Any],
     template_name: Optional[str] = None,
     template_file: Optional[str] = None,
-) -> Tuple[Dict[str, Any], str]:
+    unique_key: str = "output",
+) -> Tuple[Dict[str, Any], str, Dict[str, bytes]]:
     assert options
 
     exp = _make_exporter(template_name, template_file)
 
-    html, _ = exp.from_notebook_node(json)
+    html, resources = exp.from_notebook_node(json, {"unique_key": unique_key})
     metadata = {
         "type": "article",
         "has_jinja": True,
         "loader": "ipynb",
     }
     metadata.update(json.get("metadata", {}).get("miyadaiku", {}))
-    return metadata, html
+    return metadata, html, resources.get("outputs", {})
 
 
 def get_cellfilename(cell: Dict[str, Any]) -> Optional[str]:
@@ -122,14 +139,35 @@ def build_header_id(src: str) -> str:
     return ret
 
 
-def load(src: ContentSrc) -> List[Tuple[ContentSrc, str]]:
+def restore_jinjatags(html: str, jinjatags: Dict[str, str]) -> str:
+    """Replace first occurrence of each hash in html with the jinja tag."""
+
+    if not jinjatags:
+        return html
+
+    # longest first, not to match prefix of other hashes.
+    hashes = "|".join(sorted(jinjatags, key=len, reverse=True))
+    pattern = re.compile(rf"<p>\s*({hashes})\s*</p>|({hashes})")
+
+    restored = set()
+
+    def restore(m: Match[str]) -> str:
+        hash = m[1] or m[2]
+        if hash in restored:
+            return m[0]
+        restored.add(hash)
+        return jinjatags[hash]
+
+    return pattern.sub(restore, html)
+
+
+def load(src: ContentSrc) -> List[Tuple[ContentSrc, Union[str, bytes]]]:
     s = src.read_text()
     json = nbformat.reads(s, nbformat.current_nbformat)
 
     cells = split_cells(src, json.get("cells", []))
-    ret = []
+    ret: List[Tuple[ContentSrc, Union[str, bytes]]] = []
     for subsrc, subcells in cells:
-        subjson = copy.deepcopy(json)
         cellmeta: Dict[str, Any] = {}
         if subcells:
             top = subcells[0]
@@ -180,12 +218,17 @@ def load(src: ContentSrc) -> List[Tuple[ContentSrc, str]]:
             # remove cell
             del newcells[-1]
 
+        # Share the notebook metadata. The exporter copies the notebook
+        # before processing.
+        subjson = copy.copy(json)
         subjson["cells"] = newcells
 
-        meta, html = _export(
+        stem = PurePosixPath(subsrc.contentpath[1]).stem
+        meta, html, outputs = _export(
             subjson,
             cellmeta.get("nbconvert_template", None),
             cellmeta.get("nbconvert_templatefile", None),
+            f"{stem}_output",
         )
         meta.update(cellmeta)
 
@@ -194,9 +237,39 @@ def load(src: ContentSrc) -> List[Tuple[ContentSrc, str]]:
         html = build_header_id(html)
         # restore jinja tag
         html = html.translate({ord("{"): "&#123;", ord("}"): "&#125;"})
-        for hash, s in jinjatags.items():
-            html = re.sub(rf"(<p>\s*{hash}\s*</p>)|{hash}", s, html, 1)
+        html = restore_jinjatags(html, jinjatags)
+
+        # extracted outputs are loaded as binary contents
+        has_jinja = subsrc.metadata.get("has_jinja", True)
+        outputsrcs = []
+        for filename, body in outputs.items():
+            path = _output_path(filename, has_jinja)
+            html = html.replace(f'src="{filename}"', f'src="{path}"')
+            outputsrcs.append(_output_src(subsrc, filename, body))
 
         ret.append((subsrc, html))
+        ret.extend(outputsrcs)
 
     return ret
+
+
+def _output_path(filename: str, has_jinja: bool) -> str:
+    if not has_jinja:
+        # outputs are written next to the article.
+        return filename
+
+    # relative to the page including the article, not the article.
+    return f"{{{{ content.path_to({filename!r}) }}}}"
+
+
+def _output_src(
+    src: ContentSrc, filename: str, body: bytes
+) -> Tuple[ContentSrc, bytes]:
+    outsrc = ContentSrc(
+        package=src.package,
+        srcpath=src.srcpath,
+        metadata={"type": "binary", "loader": "ipynb"},
+        contentpath=(src.contentpath[0], filename),
+        mtime=src.mtime,
+    )
+    return outsrc, body
@@ -1,15 +1,32 @@
+from __future__ import annotations
+
+import collections
+import hashlib
 import logging
 import os
 import re
 import urllib
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Tuple,
+)
 
+import jinja2
 from jinja2 import DebugUndefined  # NOQA
 from jinja2 import StrictUndefined  # NOQA
 from jinja2 import (
+    BytecodeCache,
     ChoiceLoader,
-    Environment,
+    FileSystemBytecodeCache,
     FileSystemLoader,
     PackageLoader,
     PrefixLoader,
@@ -18,7 +35,8 @@ from jinja2 import (
     select_autoescape,
 )
 
-import miyadaiku.site
+if TYPE_CHECKING:
+    import miyadaiku.site
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +61,112 @@ class PackagesLoader(PrefixLoader):
         raise TypeError("this loader cannot iterate over all templates")
 
 
+# template name -> digest of the source, or None if not found.
+TemplateReads = Dict[str, Optional[str]]
+
+
+class StringTemplateCache:
+    """LRU cache of templates compiled by from_string(), keyed by digest of
+    the source."""
+
+    maxsize: int
+    hits: int
+    misses: int
+
+    _templates: collections.OrderedDict[bytes, jinja2.Template]
+
+    def __init__(self, maxsize: int = 1000) -> None:
+        self.maxsize = maxsize
+        self.hits = self.misses = 0
+        self._templates = collections.OrderedDict()
+
+    def get(self, env: jinja2.Environment, source: str) -> jinja2.Template:
+        key = hashlib.sha1(source.encode("utf-8")).digest()
+        template = self._templates.get(key)
+        if template is not None:
+            self._templates.move_to_end(key)
+            self.hits += 1
+            return template
+
+        self.misses += 1
+        template = env.from_string(source)
+        if self.maxsize > 0:
+            self._templates[key] = template
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+
+class Environment(jinja2.Environment):
+    """Environment which records templates loaded by get_template(), include,
+    import and extends."""
+
+    string_templates: StringTemplateCache
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._template_recorders: List[TemplateReads] = []
+        self._template_digests: TemplateReads = {}
+        self.string_templates = StringTemplateCache()
+
+    def from_string_cached(self, source: str) -> jinja2.Template:
+        """from_string() which reuses templates compiled from the same source."""
+
+        return self.string_templates.get(self, source)
+
+    def _load_template(
+        self, name: str, globals: Optional[MutableMapping[str, Any]]
+    ) -> jinja2.Template:
+        template = super()._load_template(name, globals)
+        if self._template_recorders:
+            digest = self.get_template_digest(name)
+            for reads in self._template_recorders:
+                reads[name] = digest
+        return template
+
+    def get_template_digest(self, name: str) -> Optional[str]:
+        if name in self._template_digests:
+            return self._template_digests[name]
+
+        assert self.loader
+        try:
+            source, _, _ = self.loader.get_source(self, name)
+        except TemplateNotFound:
+            digest = None
+        else:
+            digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+        self._template_digests[name] = digest
+        return digest
+
+    @contextmanager
+    def record_templates(self) -> Iterator[TemplateReads]:
+        """Record templates loaded in the block."""
+
+        reads: TemplateReads = {}
+        self._template_recorders.append(reads)
+        try:
+            yield reads
+        finally:
+            self._template_recorders.pop()
+
+    def replay_templates(self, names: Iterable[str]) -> None:
+        """Record templates as if they were loaded."""
+
+        for name in names:
+            digest = self.get_template_digest(name)
+            for reads in self._template_recorders:
+                reads[name] = digest
+
+    def is_updated(self, reads: TemplateReads) -> bool:
+        """True if any of recorded templates has been changed."""
+
+        for name, digest in reads.items():
+            if self.get_template_digest(name) != digest:
+                return True
+        return False
+
+
 EXTENSIONS = ["jinja2.ext.do"]
 
 
@@ -58,6 +182,27 @@ def urlquote(s: str) -> str:
     return s
 
 
+def create_bytecode_cache(site: "miyadaiku.site.Site") -> Optional[BytecodeCache]:
+    """Compiled templates shared by builder processes and builds.
+
+    Entries are validated by checksum of the template source, and written
+    atomically by FileSystemBytecodeCache.
+    """
+
+    dirname = site.config.get("/", "jinja_bytecode_cache_dir")
+    if not dirname:
+        return None
+
+    path = site.root / dirname
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        logger.warning("Failed to create bytecode cache directory: %s", path)
+        return None
+
+    return FileSystemBytecodeCache(os.fspath(path))
+
+
 def create_env(
     site: "miyadaiku.site.Site", themes: List[str], paths: List[Path]
 ) -> Environment:
@@ -82,7 +227,9 @@ def create_env(
         loader=ChoiceLoader(loaders),
         autoescape=select_autoescape(["html", "xml", "j2"]),
         extensions=EXTENSIONS,
+        bytecode_cache=create_bytecode_cache(site),
     )
+    env.string_templates.maxsize = site.config.get("/", "jinja_template_cache_size")
 
     env.globals["str"] = str
     env.globals["list"] = list
@@ -2,15 +2,16 @@ from __future__ import annotations
 
 import collections.abc
 import fnmatch
+import importlib
 import logging
 import os
 import posixpath
-import shelve
 import time
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor  # noqa
 from pathlib import Path
 from typing import (
     Any,
+    Callable,
     Dict,
     ItemsView,
     Iterable,
@@ -21,6 +22,7 @@ from typing import (
     Sequence,
     Set,
     Tuple,
+    Union,
     cast,
 )
 
@@ -30,8 +32,9 @@ import yaml
 import miyadaiku
 from miyadaiku import ContentPath, ContentSrc, PathTuple, to_contentpath
 
-from . import config, contents, exceptions, extend, html, site
+from . import config, contents, exceptions, extend, html, query, site
 from .contents import Content
+from .filecache import FileCache
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +50,28 @@ def is_ignored(ignores: Set[str], name: str) -> bool:
     return False
 
 
+def get_contentsrc(path: Path, filename: Path) -> ContentSrc:
+    """ContentSrc of the file in the directory."""
+
+    dirname, fname = os.path.split(filename)
+    metadatafile = os.path.join(dirname, f"{fname}{miyadaiku.METADATA_FILE_SUFFIX}")
+
+    metadata: Dict[Any, Any] = {}
+
+    if os.path.isfile(metadatafile):
+        text = open(metadatafile, encoding=miyadaiku.YAML_ENCODING).read()
+        metadata = yaml.load(text, Loader=yaml.FullLoader) or {}
+
+    mtime = filename.stat().st_mtime
+    return ContentSrc(
+        package="",
+        srcpath=str(filename),
+        metadata=metadata,
+        contentpath=to_contentpath(str(filename.relative_to(path))),
+        mtime=mtime,
+    )
+
+
 def walk_directory(path: Path, ignores: Set[str]) -> Iterator[ContentSrc]:
     logger.info(f"Loading {path}")
     path = path.expanduser().resolve()
@@ -65,26 +90,7 @@ def walk_directory(path: Path, ignores: Set[str]) -> Iterator[ContentSrc]:
 
         for name in filenames:
             filename = (rootpath / name).resolve()
-
-            dirname, fname = os.path.split(filename)
-            metadatafile = os.path.join(
-                dirname, f"{fname}{miyadaiku.METADATA_FILE_SUFFIX}"
-            )
-
-            metadata: Dict[Any, Any] = {}
-
-            if os.path.isfile(metadatafile):
-                text = open(metadatafile, encoding=miyadaiku.YAML_ENCODING).read()
-                metadata = yaml.load(text, Loader=yaml.FullLoader) or {}
-
-            mtime = filename.stat().st_mtime
-            yield ContentSrc(
-                package="",
-                srcpath=str(filename),
-                metadata=metadata,
-                contentpath=to_contentpath(str(filename.relative_to(path))),
-                mtime=mtime,
-            )
+            yield get_contentsrc(path, filename)
 
 
 def _iter_package_files(path: Path, ignores: Set[str]) -> Iterator[Path]:
@@ -175,7 +181,7 @@ def mdloader(
 
 def ipynbloader(
     site: site.Site, src: ContentSrc
-) -> Sequence[Tuple[ContentSrc, Optional[str]]]:
+) -> Sequence[Tuple[ContentSrc, Union[str, bytes, None]]]:
     from . import ipynb
 
     return ipynb.load(src)
@@ -205,16 +211,38 @@ FILELOADERS = {
 
 class ContentFiles:
     _contentfiles: Dict[ContentPath, Content]
+    _index: Optional[query.ContentsIndex]
+    _index_generation: int
     mtime: float
+    # digests of the source files (see filecache.src_key())
+    src_digests: Dict[str, str]
 
     def __init__(self) -> None:
         self._contentfiles = {}
+        self.src_digests = {}
+        self._index = None
+        self._index_generation = 0
         self.mtime = time.time()
 
+    def __getstate__(self) -> Dict[str, Any]:
+        d = self.__dict__.copy()
+        d["_index"] = None
+        return d
+
+    def invalidate_index(self) -> None:
+        self._index = None
+
+    def _get_index(self, site: site.Site) -> query.ContentsIndex:
+        if self._index is None or self._index_generation != site.config.generation:
+            self._index = query.ContentsIndex(site, self._contentfiles)
+            self._index_generation = site.config.generation
+        return self._index
+
     def add(self, contentsrc: ContentSrc, body: Optional[bytes]) -> None:
         if contentsrc.contentpath not in self._contentfiles:
             content = contents.build_content(contentsrc, body)
             self._contentfiles[contentsrc.contentpath] = content
+            self._index = None
         # todo: emit log message
 
     def add_bytes(self, type: str, path: str, body: bytes) -> Content:
@@ -230,8 +258,19 @@ class ContentFiles:
 
         content = contents.build_content(contentsrc, body)
         self._contentfiles[content.src.contentpath] = content
+        self._index = None
+        return content
+
+    def replace(self, contentsrc: ContentSrc, body: Optional[bytes]) -> Content:
+        content = contents.build_content(contentsrc, body)
+        self._contentfiles[contentsrc.contentpath] = content
+        self._index = None
         return content
 
+    def remove(self, path: ContentPath) -> None:
+        del self._contentfiles[path]
+        self._index = None
+
     def get_contentfiles_keys(self) -> KeysView[ContentPath]:
         return self._contentfiles.keys()
 
@@ -247,16 +286,7 @@ class ContentFiles:
         except KeyError:
             raise exceptions.ContentNotFound(path) from None
 
-    def get_contents(
-        self,
-        site: site.Site,
-        filters: Optional[Dict[str, Any]] = None,
-        excludes: Optional[Dict[str, Any]] = None,
-        subdirs: Optional[Sequence[PathTuple]] = None,
-        recurse: bool = True,
-    ) -> List[Content]:
-        contents: Iterable[Content] = [c for c in self._contentfiles.values()]
-
+    def _default_filters(self, filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
         if filters is None:
             filters_copy = {}
         else:
@@ -266,7 +296,25 @@ class ContentFiles:
             filters_copy["draft"] = {False}
         if "type" not in filters_copy:
             filters_copy["type"] = {"article"}
+        return filters_copy
 
+    def get_contents(
+        self,
+        site: site.Site,
+        filters: Optional[Dict[str, Any]] = None,
+        excludes: Optional[Dict[str, Any]] = None,
+        subdirs: Optional[Sequence[PathTuple]] = None,
+        recurse: bool = True,
+    ) -> List[Content]:
+        filters_copy = self._default_filters(filters)
+
+        indexed = self._get_index(site).get_contents(
+            filters_copy, excludes, subdirs, recurse
+        )
+        if indexed is not None:
+            return indexed
+
+        contents: Iterable[Content]
         notfound = object()
 
         def term(key: str, value: Any, content: Content) -> bool:
@@ -355,6 +403,12 @@ class ContentFiles:
                 ((), list(self.get_contents(site, filters, excludes, subdirs, recurse)))
             ]
 
+        indexed = self._get_index(site).group_items(
+            group, self._default_filters(filters), excludes, subdirs, recurse
+        )
+        if indexed is not None:
+            return indexed
+
         d = collections.defaultdict(list)
         for c in self.get_contents(site, filters, excludes, subdirs, recurse):
             g = c.get_metadata(site, group, None)
@@ -371,63 +425,290 @@ class ContentFiles:
         return sorted(d.items())
 
 
-CACHE_FILE = "_file_cache.db"
-CACHE_VER = b"1.0.0"
-CACHE_VER_KEY = "::<<miyadaiku_cache_ver>>::"
-
+CACHE_FILE = "_file_cache.sqlite"
 
-def _load_filecache(site: site.Site) -> shelve.DbfilenameShelf:
-    filename = str(site.root / CACHE_FILE)
-    if site.rebuild:
-        file_cache = shelve.open(filename, "n")
-        file_cache[CACHE_VER_KEY] = CACHE_VER
-    else:
-        file_cache = shelve.open(filename, "c")
 
-        if file_cache.get(CACHE_VER_KEY, b"") != CACHE_VER:
-            file_cache.close()
+# Configs affecting the loaded contents.
+LOADER_CONFIGS = (
+    "ipynb_export_options",
+    "ipynb_template_name",
+    "ipynb_template_file",
+    "ipynb_extract_outputs",
+)
 
-            file_cache = shelve.open(filename, "n")
-            file_cache[CACHE_VER_KEY] = CACHE_VER
 
-    return file_cache
+def _load_filecache(site: site.Site) -> FileCache:
+    settings = repr([site.config.get("/", name) for name in LOADER_CONFIGS])
+    return FileCache(site.root / CACHE_FILE, site.rebuild, settings)
 
 
-def loadfile(
-    site: site.Site, src: ContentSrc, bin: bool, filecache: shelve.DbfilenameShelf
-) -> List[Tuple[ContentSrc, Optional[bytes]]]:
+# Builtin loaders which do not refer the site. Files using them can be loaded
+# in the child processes.
+PARALLEL_LOADERS = {
+    rstloader,
+    mdloader,
+    html.load,
+    yamlloader,
+    ipynbloader,
+    txtloader,
+    binloader,
+}
 
-    curstat = src.stat()
+# Loaders much slower than others. Files using them are loaded in the child
+# processes even if only a few files are loaded.
+HEAVY_LOADERS = {
+    ipynbloader,
+}
 
-    key = f"{src.package}_::::_{src.srcpath}"
+# Load files in the current process if number of files is smaller than this.
+MIN_PARALLEL_LOADS = 16
 
-    stat, bodies = filecache.get(key, (None, None))
-    if stat:
-        if stat == curstat:
-            return cast(List[Tuple[ContentSrc, Optional[bytes]]], bodies)
 
+def _get_loader(
+    src: ContentSrc, bin: bool
+) -> Callable[
+    [site.Site, ContentSrc], Sequence[Tuple[ContentSrc, Union[str, bytes, None]]]
+]:
     if not bin:
         assert src.srcpath
         ext = os.path.splitext(src.srcpath)[1]
-        loader = FILELOADERS.get(ext, binloader)
+        return FILELOADERS.get(ext, binloader)
     else:
-        loader = binloader
+        return binloader
+
 
+def _load(
+    site: site.Site, src: ContentSrc, bin: bool
+) -> List[Tuple[ContentSrc, Optional[bytes]]]:
+    loader = _get_loader(src, bin)
+    return _encode_bodies(loader(site, src))
+
+
+def _encode_bodies(
+    items: Sequence[Tuple[ContentSrc, Union[str, bytes, None]]]
+) -> List[Tuple[ContentSrc, Optional[bytes]]]:
     ret: List[Tuple[ContentSrc, Optional[bytes]]] = []
-    for contentsrc, body in loader(site, src):
+    for contentsrc, body in items:
         assert contentsrc.metadata["loader"]
 
         if isinstance(body, bytes):
             ret.append((contentsrc, body))
-        if isinstance(body, str):
+        elif isinstance(body, str):
             ret.append((contentsrc, body.encode("utf-8")))
         else:
             ret.append((contentsrc, None))
 
-    filecache[key] = curstat, ret
     return ret
 
 
+def loadfile(
+    site: site.Site, src: ContentSrc, bin: bool, filecache: FileCache
+) -> List[Tuple[ContentSrc, Optional[bytes]]]:
+
+    curstat = src.stat()
+
+    cached = filecache.get(src, curstat)
+    if cached is not None:
+        return cached
+
+    ret = _load(site, src, bin)
+    filecache.set(src, curstat, ret)
+    return ret
+
+
+def reloadfile(
+    site: site.Site, src: ContentSrc, bin: bool, filecache: FileCache
+) -> List[Tuple[ContentSrc, Optional[bytes]]]:
+    """Load a file with pre_load and post_load hooks."""
+
+    ret: List[Tuple[ContentSrc, Optional[bytes]]] = []
+
+    f = extend.run_pre_load(site, src, bin)
+    if not f:
+        return ret
+
+    for src, body in loadfile(site, f, bin, filecache):
+        if not src:
+            break
+
+        loaded_src, body = extend.run_post_load(site, src, bin, body)
+        if not loaded_src:
+            break
+
+        ret.append((loaded_src, body))
+
+    return ret
+
+
+def _init_load_process(
+    root: Path, themes: List[str], ipynb_state: Tuple[Any, ...]
+) -> None:
+    from . import ipynb
+
+    # load hooks and themes, which may register extensions of the loaders,
+    # as builder processes do.
+    extend.load_hook(root)
+    for theme in themes:
+        importlib.import_module(theme)
+
+    ipynb.options, ipynb.root = ipynb_state
+    ipynb.exporters = {}
+
+
+def _load_in_process(
+    src: ContentSrc, bin: bool
+) -> List[Tuple[ContentSrc, Optional[bytes]]]:
+    # Loaders in PARALLEL_LOADERS don't use site.
+    return _load(cast(site.Site, None), src, bin)
+
+
+def _get_batch_loaders() -> Dict[Any, Any]:
+    from . import md, rst
+
+    # loader -> function to load many files at once
+    return {mdloader: md.load_many, rstloader: rst.load_many}
+
+
+def _load_many_in_process(
+    srcs: Sequence[Tuple[ContentSrc, bool]]
+) -> List[List[Tuple[ContentSrc, Optional[bytes]]]]:
+    """Load a chunk of files. Files of the loaders which can load many files
+    at once are loaded in a batch."""
+
+    batch_loaders = _get_batch_loaders()
+
+    ret: List[List[Tuple[ContentSrc, Optional[bytes]]]] = [[] for _ in srcs]
+    batches: Dict[Any, List[int]] = {}
+    for i, (src, bin) in enumerate(srcs):
+        loader = _get_loader(src, bin)
+        if loader in batch_loaders:
+            batches.setdefault(loader, []).append(i)
+        else:
+            ret[i] = _load_in_process(src, bin)
+
+    for loader, indexes in batches.items():
+        loaded = batch_loaders[loader]([srcs[i][0] for i in indexes])
+        for i, items in zip(indexes, loaded):
+            ret[i] = _encode_bodies(items)
+
+    return ret
+
+
+class LoadPool:
+    """Process pool to load files in parallel. Processes are started on
+    demand and shared by all directories loaded by loadfiles()."""
+
+    num_processes: int
+    _executor: Optional[ProcessPoolExecutor]
+
+    def __init__(self, site: site.Site) -> None:
+        self.site = site
+        self._executor = None
+        if site.debug:
+            self.num_processes = 1
+        else:
+            num = site.config.get("/", "load_processes")
+            self.num_processes = num or os.cpu_count() or 1
+
+    def __enter__(self) -> LoadPool:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        from . import ipynb
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.num_processes,
+                initializer=_init_load_process,
+                initargs=(
+                    self.site.root,
+                    self.site.themes,
+                    (ipynb.options, ipynb.root),
+                ),
+            )
+        return self._executor
+
+    def loadfiles(
+        self,
+        srcs: Sequence[Tuple[ContentSrc, bool]],
+        filecache: FileCache,
+    ) -> List[List[Tuple[ContentSrc, Optional[bytes]]]]:
+        """Load files in srcs. Files which are not found in the filecache are
+        loaded in the child processes if possible. Results are returned in the
+        same order as srcs."""
+
+        results: List[Optional[List[Tuple[ContentSrc, Optional[bytes]]]]] = []
+        stats = []
+        misses = []
+        heavies = []
+
+        for src, bin in srcs:
+            curstat = src.stat()
+            stats.append(curstat)
+
+            cached = filecache.get(src, curstat)
+            if cached is not None:
+                results.append(cached)
+            else:
+                results.append(None)
+                loader = _get_loader(src, bin)
+                if loader in HEAVY_LOADERS:
+                    heavies.append(len(results) - 1)
+                elif loader in PARALLEL_LOADERS:
+                    misses.append(len(results) - 1)
+
+        if (self.num_processes > 1) and (
+            (len(heavies) > 1) or (len(misses) + len(heavies) >= MIN_PARALLEL_LOADS)
+        ):
+            logger.debug(
+                "Loading %d files in child processes", len(misses) + len(heavies)
+            )
+            executor = self._get_executor()
+
+            # Submit heavy files first, one by one, not to wait for a process
+            # loading many of them at last.
+            futures = [
+                (i, executor.submit(_load_in_process, *srcs[i])) for i in heavies
+            ]
+
+            chunksize = max(1, len(misses) // (self.num_processes * 4))
+            chunks = [
+                misses[i : i + chunksize] for i in range(0, len(misses), chunksize)
+            ]
+            chunkfutures = []
+            for chunk in chunks:
+                chunksrcs = [srcs[i] for i in chunk]
+                chunkfuture = executor.submit(_load_many_in_process, chunksrcs)
+                chunkfutures.append((chunk, chunkfuture))
+
+            for chunk, chunkfuture in chunkfutures:
+                for i, items in zip(chunk, chunkfuture.result()):
+                    results[i] = items
+                    filecache.set(srcs[i][0], stats[i], items)
+
+            for i, future in futures:
+                items = future.result()
+                results[i] = items
+                filecache.set(srcs[i][0], stats[i], items)
+
+        ret: List[List[Tuple[ContentSrc, Optional[bytes]]]] = []
+        for i, ((src, bin), result) in enumerate(zip(srcs, results)):
+            if result is None:
+                result = _load(self.site, src, bin)
+                filecache.set(src, stats[i], result)
+            ret.append(result)
+
+        return ret
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 def loadfiles(
     site: site.Site,
     files: ContentFiles,
@@ -442,7 +723,10 @@ def loadfiles(
 
     ipynb.init(site)
 
-    def load(walk: Iterator[ContentSrc], bin: bool = False) -> None:
+    # As in serial loading, pre_load hooks are called for all files in a
+    # directory before the files are loaded. post_load hooks are called
+    # afterwards for each file, in the order of the walk.
+    def load(pool: LoadPool, walk: Iterator[ContentSrc], bin: bool = False) -> None:
         f: Optional[ContentSrc]
         srcs: List[ContentSrc] = []
 
@@ -472,17 +756,19 @@ def loadfiles(
                 else:
                     files.add(loaded_src, body)
 
-        for src in srcs:
-            ret = loadfile(site, src, bin, filecache)
+        for ret in pool.loadfiles([(src, bin) for src in srcs], filecache):
             loaded(ret)
 
-    load(walk_directory(root / miyadaiku.CONTENTS_DIR, ignores))
-    load(walk_directory(root / miyadaiku.FILES_DIR, ignores), bin=True)
+    with LoadPool(site) as pool:
+        load(pool, walk_directory(root / miyadaiku.CONTENTS_DIR, ignores))
+        load(pool, walk_directory(root / miyadaiku.FILES_DIR, ignores), bin=True)
 
-    for theme in themes:
-        load(walk_package(theme, miyadaiku.CONTENTS_DIR, ignores))
-        load(walk_package(theme, miyadaiku.FILES_DIR, ignores), bin=True)
+        for theme in themes:
+            load(pool, walk_package(theme, miyadaiku.CONTENTS_DIR, ignores))
+            load(pool, walk_package(theme, miyadaiku.FILES_DIR, ignores), bin=True)
 
     extend.run_load_finished(site)
 
+    files.src_digests.update(filecache.digests)
+    filecache.compact()
     filecache.close()
@@ -1,7 +1,7 @@
 import re
 from collections import OrderedDict
 import xml.etree.ElementTree as etree
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import markdown
 import markdown.extensions.codehilite
@@ -26,6 +26,9 @@ class HtmlStash2(util.HtmlStash):  # type: ignore
 
 class Ext(markdown.Extension):  # type: ignore
     def extendMarkdown(self, md):  # type: ignore
+        self.md = md
+        md.registerExtension(self)
+
         # prior to fenced_code_block
         md.htmlStash2 = HtmlStash2()
         md.preprocessors.register(JinjaPreprocessor(md), "jinja", 27.5)
@@ -33,6 +36,15 @@ class Ext(markdown.Extension):  # type: ignore
         # top priority
         md.parser.blockprocessors.register(TargetProcessor(md.parser), "target", 110)
 
+    def reset(self):  # type: ignore
+        self.md.htmlStash2.reset()
+
+        # Before Markdown 3.7, abbreviations are registered as inline
+        # patterns, which are not removed by Markdown.reset().
+        patterns = self.md.inlinePatterns
+        for name in [name for name in patterns._data if name.startswith("abbr-")]:
+            patterns.deregister(name)
+
 
 class JinjaPreprocessor(preprocessors.Preprocessor):  # type: ignore
     def run(self, lines):  # type: ignore
@@ -106,19 +118,41 @@ def load(src: ContentSrc) -> List[Tuple[ContentSrc, str]]:
     return ret
 
 
-def _load_string(string: str) -> Tuple[Dict[str, Any], str]:
+def load_many(srcs: Sequence[ContentSrc]) -> List[List[Tuple[ContentSrc, str]]]:
+    """Load markdown files with a converter shared by all the files.
+    Returns the contents loaded from each file."""
+
+    return [load(src) for src in srcs]
+
+
+# Converter reused in this process, since setting up extensions is expensive.
+_converter: Optional[Any] = None
 
-    extensions = [
-        markdown.extensions.codehilite.CodeHiliteExtension(
-            css_class="highlight", guess_lang=False
-        ),
-        "extra",
-        "sane_lists",
-        Ext(),
-    ]
-
-    md: Any = markdown.Markdown(extensions=extensions)
-    md.postprocessors.register(JinjaPostprocessor(md), "jinja_raw_html", 0)
+
+def _get_converter() -> Any:
+    global _converter
+
+    if _converter is None:
+        extensions = [
+            markdown.extensions.codehilite.CodeHiliteExtension(
+                css_class="highlight", guess_lang=False
+            ),
+            "extra",
+            "sane_lists",
+            Ext(),
+        ]
+
+        md: Any = markdown.Markdown(extensions=extensions)
+        md.postprocessors.register(JinjaPostprocessor(md), "jinja_raw_html", 0)
+        _converter = md
+    else:
+        _converter.reset()
+
+    return _converter
+
+
+def _load_string(string: str) -> Tuple[Dict[str, Any], str]:
+    md = _get_converter()
     md.meta = {
         "type": "article",
         "has_jinja": True,
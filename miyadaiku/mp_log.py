@@ -4,11 +4,18 @@ import enum
 import logging
 import logging.config
 import sys
+import time
 import traceback
 from typing import Any, Dict, List
 
+# Records are sent to the parent process when MAX_PENDINGS records are
+# pending or FLUSH_INTERVAL seconds have passed since the last flush.
+MAX_PENDINGS = 100
+FLUSH_INTERVAL = 0.5
+
 _queue: Any = None
 _pendings: List[Dict[str, Any]] = []
+_last_flush = 0.0
 
 
 class MpLogFormatter(logging.Formatter):
@@ -45,6 +52,11 @@ class MpLogHandler(logging.Handler):
             msg = self.dictformatter.format_dict(record)
             _pendings.append(msg)
 
+            if (len(_pendings) >= MAX_PENDINGS) or (
+                time.monotonic() - _last_flush >= FLUSH_INTERVAL
+            ):
+                flush_mp_logging()
+
         except RecursionError:
             raise
         except Exception:
@@ -60,8 +72,9 @@ def init_mp_logging(queue: Any) -> None:
     global _queue
     _queue = queue
 
-    global _pendings
+    global _pendings, _last_flush
     _pendings = []
+    _last_flush = time.monotonic()
 
     LOGGING = {
         "version": 1,
@@ -78,10 +91,11 @@ def init_mp_logging(queue: Any) -> None:
 
 
 def flush_mp_logging() -> None:
-    global _pendings
+    global _pendings, _last_flush
     if _pendings:
         _queue.put(("LOGS", _pendings))
         _pendings = []
+    _last_flush = time.monotonic()
 
 
 class Color(enum.Enum):
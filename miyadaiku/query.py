@@ -0,0 +1,298 @@
+"""Indexes of contents to answer get_contents() and group_items() queries.
+
+Indexes are built on demand from the metadata of the contents, and kept
+until the contents, config or metadata are updated. Config entries read
+to build an index are replayed to the active recorders whenever the index
+is used, so that pages using the query depend on them.
+"""
+
+from __future__ import annotations
+
+import collections.abc
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from miyadaiku import ContentPath, PathTuple
+
+from .config import ConfigReads
+
+if TYPE_CHECKING:
+    from .contents import Content
+    from .site import Site
+
+_notfound = object()
+
+# sequences accepted as values of filters
+_VALUE_TYPES = (set, frozenset, list, tuple)
+
+
+class KeyIndex:
+    """Inverted index of a metadata."""
+
+    # value (or element of collection value) -> contents
+    values: Dict[Hashable, Set[ContentPath]]
+    # contents without the metadata or with an empty value
+    empty: Set[ContentPath]
+    reads: ConfigReads
+
+    def __init__(self) -> None:
+        self.values = collections.defaultdict(set)
+        self.empty = set()
+        self.reads = {}
+
+    def lookup(self, value: Any) -> Set[ContentPath]:
+        """Contents matches to the filter value."""
+
+        if value is None:
+            return self.empty
+
+        ret: Set[ContentPath] = set()
+        for v in value:
+            matched = self.values.get(v)
+            if matched:
+                ret.update(matched)
+        return ret
+
+
+class _Unindexable(Exception):
+    pass
+
+
+def _freeze(d: Optional[Dict[str, Any]]) -> Optional[Tuple[Any, ...]]:
+    if d is None:
+        return None
+
+    ret = []
+    for k, v in sorted(d.items()):
+        if isinstance(v, _VALUE_TYPES):
+            v = (type(v).__name__, frozenset(v))
+        ret.append((k, v))
+    return tuple(ret)
+
+
+class ContentsIndex:
+    site: Site
+    contents: Dict[ContentPath, Content]
+
+    _keys: Dict[str, Optional[KeyIndex]]
+    _subdirs: Optional[Dict[Tuple[PathTuple, bool], Set[ContentPath]]]
+    _sortkeys: Dict[ContentPath, Tuple[float, Any]]
+    _sortkey_reads: ConfigReads
+    _results: Dict[Hashable, Tuple[List[Content], ConfigReads]]
+    _groups: Dict[
+        Hashable, Tuple[List[Tuple[Tuple[Any, ...], List[Content]]], ConfigReads]
+    ]
+
+    def __init__(self, site: Site, contents: Dict[ContentPath, Content]) -> None:
+        self.site = site
+        self.contents = contents
+        self._keys = {}
+        self._subdirs = None
+        self._sortkeys = {}
+        self._sortkey_reads = {}
+        self._results = {}
+        self._groups = {}
+
+    def _build_keyindex(self, key: str) -> Optional[KeyIndex]:
+        index = KeyIndex()
+        with self.site.config.record() as reads:
+            for contentpath, content in self.contents.items():
+                try:
+                    prop = content.get_metadata(self.site, key, _notfound)
+                except Exception:
+                    # Let get_contents() evaluate the metadata as requested.
+                    return None
+
+                if (prop is _notfound) or (not prop):
+                    index.empty.add(contentpath)
+                    if prop is _notfound:
+                        continue
+
+                try:
+                    if isinstance(prop, str) or (
+                        not isinstance(prop, collections.abc.Collection)
+                    ):
+                        index.values[prop].add(contentpath)
+                    else:
+                        for e in prop:
+                            index.values[e].add(contentpath)
+                except TypeError:
+                    # unhashable values
+                    return None
+
+        index.reads = reads
+        return index
+
+    def _get_keyindex(self, key: str) -> Optional[KeyIndex]:
+        if key not in self._keys:
+            self._keys[key] = self._build_keyindex(key)
+        return self._keys[key]
+
+    def _term(self, key: str, value: Any, reads: ConfigReads) -> Set[ContentPath]:
+        if (value is not None) and (not isinstance(value, _VALUE_TYPES)):
+            raise _Unindexable()
+
+        index = self._get_keyindex(key)
+        if index is None:
+            raise _Unindexable()
+
+        reads.update(index.reads)
+        try:
+            return index.lookup(value)
+        except TypeError:
+            raise _Unindexable() from None
+
+    def _get_subdirs(self, dirname: PathTuple, recurse: bool) -> Set[ContentPath]:
+        if self._subdirs is None:
+            self._subdirs = collections.defaultdict(set)
+            for contentpath, content in self.contents.items():
+                parent = content.get_parent()
+                self._subdirs[(parent, False)].add(contentpath)
+                for i in range(len(parent) + 1):
+                    self._subdirs[(parent[:i], True)].add(contentpath)
+
+        return self._subdirs.get((dirname, recurse), set())
+
+    def _sortkey(self, contentpath: ContentPath) -> Tuple[float, Any]:
+        ret = self._sortkeys.get(contentpath)
+        if ret is None:
+            content = self.contents[contentpath]
+            with self.site.config.record() as reads:
+                d = content.get_metadata(self.site, "updated", None)
+                title = content.get_metadata(self.site, "title")
+            self._sortkey_reads.update(reads)
+
+            ret = self._sortkeys[contentpath] = (d.timestamp() if d else 0, title)
+        return ret
+
+    def _query(
+        self,
+        filters: Dict[str, Any],
+        excludes: Optional[Dict[str, Any]],
+        subdirs: Optional[Sequence[PathTuple]],
+        recurse: bool,
+    ) -> Tuple[List[Content], ConfigReads]:
+
+        reads: ConfigReads = {}
+        matched: Optional[Set[ContentPath]] = None
+
+        for key, value in filters.items():
+            found = self._term(key, value, reads)
+            matched = set(found) if matched is None else (matched & found)
+            if not matched:
+                break
+
+        if matched is None:
+            matched = set(self.contents)
+
+        if matched and excludes:
+            for key, value in excludes.items():
+                matched -= self._term(key, value, reads)
+
+        if matched and (subdirs is not None):
+            indirs: Set[ContentPath] = set()
+            for d in subdirs:
+                indirs.update(self._get_subdirs(tuple(d), recurse))
+            matched &= indirs
+
+        # keep order of the contents for the same sort keys.
+        order = {contentpath: i for i, contentpath in enumerate(self.contents)}
+        paths = sorted(matched, key=order.__getitem__)
+        paths.sort(reverse=True, key=self._sortkey)
+        reads.update(self._sortkey_reads)
+
+        return [self.contents[p] for p in paths], reads
+
+    def _query_key(
+        self,
+        filters: Dict[str, Any],
+        excludes: Optional[Dict[str, Any]],
+        subdirs: Optional[Sequence[PathTuple]],
+        recurse: bool,
+    ) -> Optional[Hashable]:
+        try:
+            key = (
+                _freeze(filters),
+                _freeze(excludes),
+                tuple(tuple(d) for d in subdirs) if subdirs is not None else None,
+                recurse,
+            )
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get_contents(
+        self,
+        filters: Dict[str, Any],
+        excludes: Optional[Dict[str, Any]],
+        subdirs: Optional[Sequence[PathTuple]],
+        recurse: bool,
+    ) -> Optional[List[Content]]:
+        """Returns contents matched to the query, or None if the query cannot
+        be answered by the indexes."""
+
+        key = self._query_key(filters, excludes, subdirs, recurse)
+        if key is not None and key in self._results:
+            result, reads = self._results[key]
+        else:
+            try:
+                result, reads = self._query(filters, excludes, subdirs, recurse)
+            except _Unindexable:
+                return None
+
+            if key is not None:
+                self._results[key] = (result, reads)
+
+        self.site.config.replay(reads)
+        return list(result)
+
+    def group_items(
+        self,
+        group: str,
+        filters: Dict[str, Any],
+        excludes: Optional[Dict[str, Any]],
+        subdirs: Optional[Sequence[PathTuple]],
+        recurse: bool,
+    ) -> Optional[List[Tuple[Tuple[Any, ...], List[Content]]]]:
+        """Returns contents grouped by the metadata, or None if the query
+        cannot be answered by the indexes."""
+
+        key = self._query_key(filters, excludes, subdirs, recurse)
+        if key is None:
+            return None
+
+        cached = self._groups.get((group, key))
+        if cached is None:
+            with self.site.config.record() as reads:
+                contents = self.get_contents(filters, excludes, subdirs, recurse)
+                if contents is None:
+                    return None
+
+                d = collections.defaultdict(list)
+                for c in contents:
+                    g = c.get_metadata(self.site, group, None)
+
+                    if g is not None:
+                        if isinstance(g, str):
+                            d[(g,)].append(c)
+                        elif isinstance(g, collections.abc.Collection):
+                            for e in g:
+                                d[(e,)].append(c)
+                        else:
+                            d[(g,)].append(c)
+
+            cached = self._groups[(group, key)] = (sorted(d.items()), reads)
+
+        groups, reads = cached
+        self.site.config.replay(reads)
+        return [(g, list(items)) for g, items in groups]
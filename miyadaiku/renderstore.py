@@ -0,0 +1,230 @@
+"""Rendered HTML of contents persisted across builds.
+
+Entries are stored in a content-addressed directory under the site root.
+The digest of an entry is computed from the body and the metadata of the
+content, the themes, hooks and modules of the site if the body is evaluated
+by Jinja, and the properties of the page. Contents, config entries and templates which
+the rendered HTML depends on are recorded with the entry and are compared
+to the current site when the entry is loaded.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional
+
+import miyadaiku
+
+from . import MODULES_DIR, NBCONVERT_TEMPLATES_DIR, ContentPath
+
+if TYPE_CHECKING:
+    from .depends import Reads
+    from .jinjaenv import Environment
+    from .site import Site
+
+logger = logging.getLogger(__name__)
+
+STORE_VER = "3"
+
+
+def _hash(*values: Any) -> str:
+    h = hashlib.sha1()
+    for value in values:
+        if not isinstance(value, bytes):
+            value = repr(value).encode("utf-8")
+        h.update(len(value).to_bytes(8, "little"))
+        h.update(value)
+    return h.hexdigest()
+
+
+def _hash_files(h: Any, path: Path, suffix: str = "") -> None:
+    if not path.is_dir():
+        return
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            if not file.endswith(suffix):
+                continue
+            filename = Path(root) / file
+            h.update(str(filename.relative_to(path)).encode("utf-8"))
+            h.update(filename.read_bytes())
+
+
+def _hash_module(h: Any, name: str) -> None:
+    """Update h with the Python files of the module or package."""
+
+    spec = importlib.util.find_spec(name)
+    if not spec:
+        return
+
+    if spec.submodule_search_locations:
+        for location in spec.submodule_search_locations:
+            h.update(location.encode("utf-8"))
+            _hash_files(h, Path(location), ".py")
+    elif spec.origin and os.path.isfile(spec.origin):
+        h.update(spec.origin.encode("utf-8"))
+        h.update(Path(spec.origin).read_bytes())
+
+
+class RenderStore:
+    """Persistent store of rendered HTML."""
+
+    site: Site
+    path: Path
+
+    _digests: Dict[ContentPath, str]
+    _env_digest: Optional[str]
+
+    def __init__(self, site: Site, path: Path) -> None:
+        self.site = site
+        self.path = path
+        self._digests = {}
+        self._env_digest = None
+
+    def get_env_digest(self) -> str:
+        """Digest of the themes, hooks and modules of the site."""
+
+        if self._env_digest is None:
+            h = hashlib.sha1()
+            h.update(_hash(miyadaiku.__version__, STORE_VER).encode("utf-8"))
+            h.update(_hash(self.site.themes).encode("utf-8"))
+
+            # Python code of the themes may register jinja globals or
+            # modify contents.
+            for theme in self.site.themes:
+                _hash_module(h, theme)
+
+            hooks = self.site.root / "hooks.py"
+            if hooks.is_file():
+                h.update(hooks.read_bytes())
+
+            for dirname in (MODULES_DIR, NBCONVERT_TEMPLATES_DIR):
+                _hash_files(h, self.site.root / dirname)
+
+            self._env_digest = h.hexdigest()
+
+        return self._env_digest
+
+    def get_content_digest(self, contentpath: ContentPath) -> Optional[str]:
+        """Digest of the body and the metadata of the content."""
+
+        ret = self._digests.get(contentpath)
+        if ret is None:
+            if not self.site.files.has_content(contentpath):
+                return None
+            content = self.site.files.get_content(contentpath)
+            ret = _hash(
+                content.body or b"",
+                sorted(content.src.metadata.items(), key=lambda item: item[0]),
+            )
+            self._digests[contentpath] = ret
+        return ret
+
+    def invalidate(self, contentpath: ContentPath) -> None:
+        self._digests.pop(contentpath, None)
+
+    def clear(self) -> None:
+        self._digests.clear()
+        self._env_digest = None
+
+    def make_digest(self, *values: Any) -> str:
+        return _hash(STORE_VER, *values)
+
+    def _filename(self, digest: str) -> Path:
+        return self.path / digest[:2] / digest[2:]
+
+    def get(self, digest: str, jinjaenv: Environment) -> Any:
+        if self.site.rebuild:
+            # render all contents again, and replace the stored entries.
+            return None
+
+        filename = self._filename(digest)
+        try:
+            with open(filename, "rb") as f:
+                value, depends, reads = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.debug("Failed to load render cache: %s", filename, exc_info=True)
+            return None
+
+        for contentpath, depdigest in depends:
+            if self.get_content_digest(contentpath) != depdigest:
+                return None
+
+        configreads, templatereads = reads
+        if self.site.config.is_updated(configreads):
+            return None
+
+        if jinjaenv.is_updated(templatereads):
+            return None
+
+        # Mark as used by this build.
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+
+        return value
+
+    def set(
+        self,
+        digest: str,
+        value: Any,
+        depends: Iterable[ContentPath],
+        reads: Reads,
+    ) -> None:
+        deps = []
+        for contentpath in depends:
+            depdigest = self.get_content_digest(contentpath)
+            if depdigest is None:
+                return
+            deps.append((contentpath, depdigest))
+
+        filename = self._filename(digest)
+        tmpname = None
+        try:
+            filename.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=filename.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((value, deps, reads), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, filename)
+        except Exception:
+            logger.debug("Failed to save render cache: %s", filename, exc_info=True)
+            if tmpname:
+                try:
+                    os.unlink(tmpname)
+                except OSError:
+                    pass
+
+    def prune(self, before: float) -> int:
+        """Remove entries which were not used since `before`."""
+
+        if not self.path.is_dir():
+            return 0
+
+        removed = 0
+        for root, dirs, files in os.walk(self.path):
+            for file in files:
+                filename = os.path.join(root, file)
+                try:
+                    if os.stat(filename).st_mtime < before:
+                        os.unlink(filename)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+def create_store(site: Site) -> Optional[RenderStore]:
+    dirname = site.config.get("/", "render_cache_dir")
+    if not dirname:
+        return None
+    return RenderStore(site, site.root / dirname)
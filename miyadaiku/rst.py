@@ -1,8 +1,9 @@
 import collections
+import copy
 import html
 import os
 import re
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import docutils
 import docutils.core
@@ -166,20 +167,45 @@ class HTMLTranslator(docutils.writers.html5_polyglot.HTMLTranslator):  # type: i
         pass
 
 
+# Publisher prepared once in this process. The components and settings are
+# reused by the publishers, since processing settings is expensive.
+_prototype: Optional[Any] = None
+
+
+def _get_prototype() -> Any:
+    global _prototype
+
+    if _prototype is None:
+        pub = docutils.core.Publisher(
+            reader=Reader(),
+            source_class=docutils.io.StringInput,
+            destination_class=docutils.io.StringOutput,
+        )
+
+        pub.set_components("standalone", "restructuredtext", "html5")
+
+        settings = RST_SETTINGS.copy()
+
+        pub.process_programmatic_settings(None, settings, None)
+        pub.writer.translator_class = HTMLTranslator
+        _prototype = pub
+
+    return _prototype
+
+
 def _make_pub(source_class):  # type: ignore
+    prototype = _get_prototype()
     pub = docutils.core.Publisher(
-        reader=Reader(),
+        reader=prototype.reader,
+        parser=prototype.parser,
+        writer=prototype.writer,
         source_class=source_class,
         destination_class=docutils.io.StringOutput,
     )
 
-    pub.set_components("standalone", "restructuredtext", "html5")
-
-    settings = RST_SETTINGS.copy()
-
-    pub.process_programmatic_settings(None, settings, None)
-    pub.writer.translator_class = HTMLTranslator
-
+    # settings are updated while publishing. Lists in the settings (e.g.
+    # stylesheet_path) are copied too, not to share them between documents.
+    pub.settings = copy.deepcopy(prototype.settings)
     return pub
 
 
@@ -232,3 +258,10 @@ def load(src: ContentSrc) -> List[Tuple[ContentSrc, str]]:
 
     src.metadata.update(metadata)
     return [(src, body)]
+
+
+def load_many(srcs: Sequence[ContentSrc]) -> List[List[Tuple[ContentSrc, str]]]:
+    """Load reST files with the publisher components shared by all the files.
+    Returns the contents loaded from each file."""
+
+    return [load(src) for src in srcs]
@@ -1,21 +1,17 @@
 # type: ignore
 import argparse
 import datetime
-import http.server
 import locale
 import logging
 import multiprocessing
-import os
 import signal
 import sys
-import threading
-import time
 from pathlib import Path
 
 import miyadaiku.site
 from miyadaiku import OUTPUTS_DIR
 
-from .. import mp_log
+from .. import builder, devserver, mp_log, watch
 from . import observer
 
 logger = logging.getLogger(__name__)
@@ -23,35 +19,34 @@ logger = logging.getLogger(__name__)
 locale.setlocale(locale.LC_ALL, "")
 
 
-class MiyadaikuHTTPHandler(http.server.SimpleHTTPRequestHandler):
-    def end_headers(self):
-        self.send_header("cache-control", "no-cache")
-        return super().end_headers()
-
-
-def exec_server(dir, bind, port):
-    os.chdir(dir)
-    http.server.test(MiyadaikuHTTPHandler, bind=bind, port=port)
-
-
-def build(path, outputdir, props, args):
+def build(
+    path, outputdir, props, args, pool=None, resident=None, paths=None, server=None
+):
     print(f"Building {path.resolve()} ...")
     start = datetime.datetime.now()
 
-    site = miyadaiku.site.Site(rebuild=args.rebuild, debug=args.debug)
-    site.load(path, props, outputdir)
-    ok, err, *_ = site.build()
+    if resident:
+        ok, err, deps, results, errors = resident.build(paths, pool)
+    else:
+        site = miyadaiku.site.Site(rebuild=args.rebuild, debug=args.debug)
+        site.load(path, props, outputdir)
+        ok, err, deps, results, errors = site.build(pool)
+    written, unchanged = builder.count_outputs(results)
 
     finished = datetime.datetime.now()
     secs = (finished - start).total_seconds()
     msg = f"""Build finished at {finished}(ellapsed: {secs} secs)
 Built {ok} files. {err} error found.
+Wrote {written} files. {unchanged} files unchanged.
 """
 
     if err:
         mp_log.Color.RED.value + msg + mp_log.Color.RESET.value
     print(msg)
 
+    if server:
+        server.notify(devserver.updated_paths(outputdir, results))
+
     return err
 
 
@@ -83,6 +78,13 @@ parser.add_argument(
     "--watch", "-w", action="store_true", help="Watch for contents update."
 )
 
+parser.add_argument(
+    "--quiet-period",
+    default=0.2,
+    type=float,
+    help="Seconds to wait for more updates before building in watch mode",
+)
+
 parser.add_argument("--server", "-s", action="store_true", help="Run http server.")
 
 parser.add_argument("--port", "-p", default=8800, type=int, help="http port")
@@ -117,14 +119,15 @@ def _main() -> None:
     if not outputs.is_dir():
         outputs.mkdir()
 
+    server = None
     if args.server:
-        server = multiprocessing.Process(
-            target=exec_server,
-            kwargs=dict(dir=str(outputs), port=args.port, bind=args.bind),
-            daemon=True,
-        )
-
+        server = devserver.DevServer(outputs, bind=args.bind, port=args.port)
         server.start()
+        host = f"[{args.bind}]" if ":" in args.bind else args.bind
+        print(
+            f"Serving HTTP on {args.bind} port {server.port} "
+            f"(http://{host}:{server.port}/) ..."
+        )
 
     try:
         if not args.watch:
@@ -135,24 +138,26 @@ def _main() -> None:
         else:
             print(f"Watching {d.resolve()} ...")
 
-            ev = threading.Event()
+            changes = watch.ChangedPaths(args.quiet_period)
 
-            obsrv = observer.create_observer(d, ev)
+            obsrv = observer.create_observer(d, changes)
             obsrv.start()
 
-            ev.set()  # run once at least
-            while True:
-                ev.wait()
-                time.sleep(0.1)
-                ev.clear()
-
-                build(d, outputs, props, args)
+            # keep the site loaded and reuse builder processes across builds
+            resident = watch.ResidentSite(
+                d, props, outputs, rebuild=args.rebuild, debug=args.debug
+            )
+            with builder.BuildPool() as pool:
+                paths = None  # load the site at first
+                while True:
+                    build(d, outputs, props, args, pool, resident, paths, server)
+                    paths = changes.wait()
 
         if args.server:
             server.join()
     finally:
-        if args.server:
-            server.terminate()
+        if server:
+            server.stop()
 
     return
 
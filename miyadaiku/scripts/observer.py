@@ -4,63 +4,76 @@ import os
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
-from miyadaiku import CONFIG_FILE, CONTENTS_DIR, FILES_DIR, MODULES_DIR, TEMPLATES_DIR
+from miyadaiku import (
+    CONFIG_FILE,
+    CONTENTS_DIR,
+    FILES_DIR,
+    MODULES_DIR,
+    NBCONVERT_TEMPLATES_DIR,
+    TEMPLATES_DIR,
+)
 
 
 class ContentDirHandler(FileSystemEventHandler):
-    def __init__(self, ev):
-        self._ev = ev
+    def __init__(self, changes):
+        self._changes = changes
 
     def on_created(self, event):
-        if event.is_directory:
-            return
-        self._ev.set()
+        self._changes.add(event.src_path)
 
     def on_modified(self, event):
         if event.is_directory:
             return
-        self._ev.set()
+        self._changes.add(event.src_path)
 
     def on_deleted(self, event):
-        if event.is_directory:
-            return
-        self._ev.set()
+        self._changes.add(event.src_path)
+
+    def on_moved(self, event):
+        self._changes.add(event.src_path, event.dest_path)
 
 
-DIRS = [CONTENTS_DIR, FILES_DIR, MODULES_DIR, TEMPLATES_DIR]
+DIRS = [CONTENTS_DIR, FILES_DIR, MODULES_DIR, TEMPLATES_DIR, NBCONVERT_TEMPLATES_DIR]
+ROOT_FILES = [CONFIG_FILE, "hooks.py"]
 
 
 class RootHandler(FileSystemEventHandler):
-    def __init__(self, ev):
-        self._ev = ev
+    def __init__(self, changes):
+        self._changes = changes
 
     def on_created(self, event):
         if event.is_directory:
             if os.path.split(event.src_path)[1] in DIRS:
                 OBSERVER.schedule(
-                    ContentDirHandler(self._ev), event.src_path, recursive=True
+                    ContentDirHandler(self._changes), event.src_path, recursive=True
                 )
+                self._changes.add(event.src_path)
             return
 
-        if os.path.split(event.src_path)[1] == CONFIG_FILE:
-            self._ev.set()
+        if os.path.split(event.src_path)[1] in ROOT_FILES:
+            self._changes.add(event.src_path)
 
     def on_modified(self, event):
-        if os.path.split(event.src_path)[1] == CONFIG_FILE:
-            self._ev.set()
+        if os.path.split(event.src_path)[1] in ROOT_FILES:
+            self._changes.add(event.src_path)
 
     def on_deleted(self, event):
-        if os.path.split(event.src_path)[1] == CONFIG_FILE:
-            self._ev.set()
+        if os.path.split(event.src_path)[1] in ROOT_FILES:
+            self._changes.add(event.src_path)
+
+    def on_moved(self, event):
+        for path in (event.src_path, event.dest_path):
+            if os.path.split(path)[1] in ROOT_FILES:
+                self._changes.add(path)
 
 
-def create_observer(path, ev):
+def create_observer(path, changes):
     global OBSERVER
     OBSERVER = Observer()
     for subdir in DIRS:
         d = path / subdir
         if d.is_dir():
-            OBSERVER.schedule(ContentDirHandler(ev), str(d), recursive=True)
+            OBSERVER.schedule(ContentDirHandler(changes), str(d), recursive=True)
 
-    OBSERVER.schedule(RootHandler(ev), str(path), recursive=False)
+    OBSERVER.schedule(RootHandler(changes), str(path), recursive=False)
     return OBSERVER
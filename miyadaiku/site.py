@@ -11,14 +11,15 @@ from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set, Tupl
 import dateutil
 import importlib_resources
 import yaml
-from jinja2 import Environment
 
 import miyadaiku
 
-from . import BuildResult, ContentPath, DependsDict, extend, loader
-from .builder import Builder, build
+from . import BuildResult, ContentPath, DependsDict, extend, loader, renderstore
+from .builder import Builder, BuildPool, build
 from .config import Config
-from .jinjaenv import create_env
+from .context import RenderCache
+from .depends import DependsRecords
+from .jinjaenv import Environment, create_env
 
 if TYPE_CHECKING:
     pass
@@ -52,6 +53,7 @@ class Site:
 
     jinja_global_vars: Dict[str, Any]
     jinja_templates: Dict[str, Any]
+    render_cache: RenderCache
 
     def __init__(self, rebuild: bool = False, debug: bool = False) -> None:
         self.rebuild = rebuild
@@ -155,6 +157,9 @@ class Site:
         self.load_hooks()
         self._load_config(props)
         self.files = loader.ContentFiles()
+        self.render_cache = RenderCache(
+            self.config.get("/", "render_cache_size"), renderstore.create_store(self)
+        )
 
         extend.run_initialized(self)
 
@@ -190,5 +195,10 @@ class Site:
 
         return jinjaenv
 
-    def build(self) -> Tuple[int, int, DependsDict, BuildResult, Set[ContentPath]]:
-        return build(self)
+    def build(
+        self,
+        pool: Optional[BuildPool] = None,
+        updates: Optional[Set[ContentPath]] = None,
+        recs: Optional[DependsRecords] = None,
+    ) -> Tuple[int, int, DependsDict, BuildResult, Set[ContentPath]]:
+        return build(self, pool, updates, recs)
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
+import io
 import xml.etree.ElementTree as ET
 from typing import TYPE_CHECKING, Sequence
 
 from miyadaiku import SITEMAP_CHANGEFREQ, SITEMAP_FILENAME, OutputInfo
 
+from .context import write_output
+
 if TYPE_CHECKING:
     from .site import Site
 
@@ -28,6 +31,6 @@ def write_sitemap(site: Site, outputinfos: Sequence[OutputInfo]) -> None:
         ET.SubElement(url, "priority").text = str(oi.sitemap_priority)
 
     tree = ET.ElementTree(root)
-    tree.write(
-        site.outputdir / SITEMAP_FILENAME, encoding="utf-8", xml_declaration=True
-    )
+    f = io.BytesIO()
+    tree.write(f, encoding="utf-8", xml_declaration=True)
+    write_output(site.outputdir / SITEMAP_FILENAME, f.getvalue())
@@ -0,0 +1,325 @@
+"""Site kept loaded between builds in watch mode.
+
+Changed files are applied to the loaded site instead of loading the whole
+site again, and the contents affected by the changes are rebuilt. The
+site is loaded again if files which affect whole the site (config.yml,
+hooks.py, modules, etc) are changed.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import importlib_resources
+
+import miyadaiku
+
+from . import (
+    CONFIG_FILE,
+    CONTENTS_DIR,
+    FILES_DIR,
+    MODULES_DIR,
+    NBCONVERT_TEMPLATES_DIR,
+    TEMPLATES_DIR,
+    BuildResult,
+    ContentPath,
+    DependsDict,
+    depends,
+    loader,
+)
+from .builder import BuildPool
+from .site import Site
+
+logger = logging.getLogger(__name__)
+
+HOOK_FILE = "hooks.py"
+
+
+# Wait for the quiet period at most this times.
+MAX_QUIET_PERIODS = 20
+
+
+class ChangedPaths:
+    """Paths changed since the last build.
+
+    Events are coalesced until no event is received in the quiet period, so
+    that bursts of events (editors writing temporary files, git pull, etc.)
+    trigger a single build. Events received while building are merged into
+    the next build.
+    """
+
+    quiet_period: float
+    event: threading.Event
+    _paths: Set[str]
+    _last: float
+
+    def __init__(self, quiet_period: float = 0.2) -> None:
+        self.quiet_period = quiet_period
+        self._lock = threading.Lock()
+        self._paths = set()
+        self._last = 0.0
+        self.event = threading.Event()
+
+    def add(self, *paths: str) -> None:
+        with self._lock:
+            self._paths.update(paths)
+            self._last = time.monotonic()
+            self.event.set()
+
+    def take(self) -> Set[str]:
+        with self._lock:
+            ret, self._paths = self._paths, set()
+            self.event.clear()
+            return ret
+
+    def wait(self) -> Set[str]:
+        """Wait for changes and returns the changed paths."""
+
+        self.event.wait()
+
+        deadline = time.monotonic() + self.quiet_period * MAX_QUIET_PERIODS
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                remains = self._last + self.quiet_period - now
+            if remains <= 0 or now >= deadline:
+                break
+            time.sleep(min(remains, deadline - now))
+
+        return self.take()
+
+
+class _Reload(Exception):
+    """The site should be loaded again."""
+
+
+class ResidentSite:
+    root: Path
+    props: Dict[str, Any]
+    outputdir: Optional[Path]
+    rebuild: bool
+    debug: bool
+    site: Optional[Site]
+
+    def __init__(
+        self,
+        root: Path,
+        props: Dict[str, Any],
+        outputdir: Optional[Path] = None,
+        rebuild: bool = False,
+        debug: bool = False,
+    ) -> None:
+        self.root = root
+        self.props = props
+        self.outputdir = outputdir
+        self.rebuild = rebuild
+        self.debug = debug
+        self.site = None
+
+    def load(self) -> Site:
+        site = Site(rebuild=self.rebuild, debug=self.debug)
+        site.load(self.root, self.props, self.outputdir)
+        self.site = site
+        return site
+
+    def build(
+        self,
+        paths: Optional[Iterable[str]] = None,
+        pool: Optional[BuildPool] = None,
+    ) -> Tuple[int, int, DependsDict, BuildResult, Set[ContentPath]]:
+        """Build the site. paths are the files changed since the last build,
+        or None to load the site again."""
+
+        updates = None
+        recs = None
+        if (self.site is not None) and (paths is not None):
+            recs = depends.load_records(self.site)
+            try:
+                updates = self.update(self.site, paths, recs)
+            except _Reload:
+                logger.info("Loading site")
+
+        if (self.site is None) or (updates is None):
+            site = self.load()
+            ret = site.build(pool)
+        else:
+            site = self.site
+            ret = site.build(pool, updates, recs)
+
+        # rebuild only once
+        site.rebuild = self.rebuild = False
+        return ret
+
+    def _get_srcfiles(
+        self, site: Site, paths: Iterable[str]
+    ) -> Tuple[Dict[Path, Tuple[Path, bool]], Set[str]]:
+        srcfiles: Dict[Path, Tuple[Path, bool]] = {}
+        templates: Set[str] = set()
+        ignores = site.ignores | set(miyadaiku.IGNORE)
+
+        for p in paths:
+            path = Path(p).resolve()
+            try:
+                parts = path.relative_to(site.root).parts
+            except ValueError:
+                continue
+
+            if not parts:
+                continue
+
+            if len(parts) == 1:
+                if parts[0] in (CONFIG_FILE, HOOK_FILE, CONTENTS_DIR, FILES_DIR):
+                    raise _Reload()
+                continue
+
+            top = parts[0]
+            if top in (MODULES_DIR, NBCONVERT_TEMPLATES_DIR):
+                raise _Reload()
+
+            if top == TEMPLATES_DIR:
+                templates.add("/".join(parts[1:]))
+                continue
+
+            if top not in (CONTENTS_DIR, FILES_DIR):
+                continue
+
+            if path.is_dir():
+                # directories moved into the site
+                raise _Reload()
+
+            if path.name.lower().endswith(miyadaiku.METADATA_FILE_SUFFIX):
+                path = path.with_name(path.name[: -len(miyadaiku.METADATA_FILE_SUFFIX)])
+                parts = path.relative_to(site.root).parts
+
+            if any(loader.is_ignored(ignores, part) for part in parts[1:]):
+                continue
+
+            if (top == CONTENTS_DIR) and path.suffix in (".yml", ".yaml"):
+                # may be a directory config
+                raise _Reload()
+
+            srcfiles[path] = (site.root / top, top == FILES_DIR)
+
+        return srcfiles, templates
+
+    def _is_in_themes(self, site: Site, dirname: Path, filename: Path) -> bool:
+        relpath = filename.relative_to(dirname)
+        for theme in site.themes:
+            path = importlib_resources.files(theme).joinpath(
+                dirname.name, *relpath.parts
+            )
+            if path.is_file():
+                return True
+        return False
+
+    def update(
+        self,
+        site: Site,
+        paths: Iterable[str],
+        recs: Optional[depends.DependsRecords],
+    ) -> Set[ContentPath]:
+        """Apply changed files to the site, and returns contents to be rebuilt.
+        recs are the records of the previous build."""
+
+        srcfiles, templates = self._get_srcfiles(site, paths)
+
+        jinja_templates = set(site.jinja_templates.values())
+        if templates & jinja_templates:
+            raise _Reload()
+
+        loaded = depends.get_depends(recs)
+        if not loaded:
+            raise _Reload()
+        deps, outputinfos, errors = loaded
+
+        site.files.mtime = time.time()
+
+        by_srcpath: Dict[str, List[ContentPath]] = {}
+        for contentpath, content in site.files.items():
+            if content.src.srcpath and not content.src.package:
+                by_srcpath.setdefault(content.src.srcpath, []).append(contentpath)
+
+        updated: Set[ContentPath] = set()
+        all_updated = False
+
+        filecache = loader._load_filecache(site)
+        try:
+            for filename, (dirname, bin) in srcfiles.items():
+                olds = by_srcpath.get(str(filename), [])
+                oldcontents = {cp: site.files.get_content(cp) for cp in olds}
+
+                if not filename.is_file():
+                    if not olds:
+                        prefix = os.path.join(filename, "")
+                        if any(p.startswith(prefix) for p in by_srcpath):
+                            # directory was removed
+                            raise _Reload()
+                        continue
+
+                    for cp in olds:
+                        site.files.remove(cp)
+
+                    if self._is_in_themes(site, dirname, filename):
+                        # content in the theme is no longer overridden
+                        raise _Reload()
+
+                    logger.info("Removed %s", filename)
+                    all_updated = True
+                    continue
+
+                logger.info("Loading %s", filename)
+                src = loader.get_contentsrc(dirname.resolve(), filename)
+                news = loader.reloadfile(site, src, bin, filecache)
+
+                for loaded_src, body in news:
+                    if (not bin) and (loaded_src.metadata["type"] == "config"):
+                        raise _Reload()
+
+                    content = site.files.replace(loaded_src, body)
+                    content.generate_metadata_file(site)
+
+                    contentpath = loaded_src.contentpath
+                    updated.add(contentpath)
+                    site.render_cache.invalidate(contentpath)
+
+                    old = oldcontents.get(contentpath)
+                    if (old is None) or (old.src.metadata != loaded_src.metadata):
+                        # metadata may be used by other contents
+                        all_updated = True
+
+                newpaths = set(src.contentpath for src, body in news)
+                for cp in olds:
+                    if cp not in newpaths:
+                        site.files.remove(cp)
+                        all_updated = True
+
+        finally:
+            site.files.src_digests.update(filecache.digests)
+            filecache.close()
+
+        if all_updated:
+            site.render_cache.clear()
+            return set(site.files.get_contentfiles_keys())
+
+        for contentpath in list(updated):
+            if contentpath in deps:
+                updated.update(deps[contentpath][1])
+
+        updated.update(errors)
+
+        if templates:
+            site.render_cache.clear()
+            jinjaenv = depends.create_template_env(site)
+            reads = depends.get_reads(recs)
+            for contentpath in site.files.get_contentfiles_keys():
+                if contentpath not in reads:
+                    updated.add(contentpath)
+                elif jinjaenv.is_updated(reads[contentpath][1]):
+                    updated.add(contentpath)
+
+        return updated
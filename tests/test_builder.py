@@ -1,9 +1,10 @@
+import pickle
 from typing import Any, List, cast
 from unittest.mock import patch
 
 from conftest import SiteRoot
 
-from miyadaiku import builder
+from miyadaiku import arena, builder
 
 
 def test_builder(siteroot: SiteRoot) -> None:
@@ -120,23 +121,39 @@ groupby: tags
 @patch("multiprocessing.cpu_count", return_value=3)
 def test_split_batch(cpu_count: Any) -> None:
 
+    assert builder.split_batch([]) == []
+
     ret = builder.split_batch([i for i in range(25)])
-    assert len(ret) == 2
-    assert set(ret[0] + ret[1]) == set(range(25))
+    assert ret == [[i, i + 1] for i in range(0, 24, 2)] + [[24]]
+
+    ret = builder.split_batch([i for i in range(3)])
+    assert ret == [[0], [1], [2]]
 
-    with patch("miyadaiku.builder.MIN_BATCH_SIZE", 1):
+    ret = builder.split_batch([i for i in range(1000)], num_workers=2)
+    assert len(ret) == 50
+    assert ret[0] == list(range(20))
 
-        ret = builder.split_batch([1])
-        assert ret == [[1]]
+    with patch("miyadaiku.builder.MAX_CHUNK_SIZE", 1):
+        ret = builder.split_batch([i for i in range(100)])
+        assert ret == [[i] for i in range(100)]
 
-        ret = builder.split_batch([i for i in range(3)])
-        assert ret == [[0], [1], [2]]
 
-        ret = builder.split_batch([i for i in range(4)])
-        assert ret == [[0, 3], [1], [2]]
+def test_sort_builders(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "small.html", "a")
+    siteroot.write_text(siteroot.contents / "large.html", "a" * 1000)
+    siteroot.write_text(siteroot.contents / "timed.html", "a")
+    site = siteroot.load({}, {})
+
+    builders = [
+        builder.Builder(site.files.get_content(((), name)))
+        for name in ["small.html", "large.html", "timed.html"]
+    ]
 
-        ret = builder.split_batch([i for i in range(6)])
-        assert ret == [[0, 3], [1, 4], [2, 5]]
+    ret = builder.sort_builders(site, builders, {})
+    assert [b.contentpath[1] for b in ret] == ["large.html", "small.html", "timed.html"]
+
+    ret = builder.sort_builders(site, builders, {((), "timed.html"): 10.0})
+    assert [b.contentpath[1] for b in ret] == ["timed.html", "large.html", "small.html"]
 
 
 def test_mpbuild(siteroot: SiteRoot) -> None:
@@ -145,3 +162,168 @@ def test_mpbuild(siteroot: SiteRoot) -> None:
     site = siteroot.load({}, {})
 
     site.build()
+
+
+def test_buildpool(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "test.txt", "test")
+
+    with builder.BuildPool(num_workers=2) as pool:
+        site = siteroot.load({}, {}, debug=False)
+        ok, err, *_ = site.build(pool)
+        assert (ok, err) == (1, 0)
+        pids = [p.pid for p, _ in pool._workers]
+        assert len(pids) == 1
+
+        siteroot.write_text(siteroot.contents / "test.txt", "test2")
+        site = siteroot.load({}, {}, debug=False)
+        site.rebuild = True
+        ok, err, *_ = site.build(pool)
+        assert (ok, err) == (1, 0)
+        assert [p.pid for p, _ in pool._workers] == pids
+        assert (siteroot.outputs / "test.txt").read_text() == "test2"
+
+    assert pool._workers == []
+
+
+def test_buildpool_exited(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "test.txt", "test")
+
+    with builder.BuildPool(num_workers=1) as pool:
+        site = siteroot.load({}, {}, debug=False)
+        ok, err, *_ = site.build(pool)
+        assert (ok, err) == (1, 0)
+
+        # killed worker is replaced by the next build
+        ((p, _),) = pool._workers
+        p.kill()
+        p.join()
+
+        site = siteroot.load({}, {}, debug=False)
+        site.rebuild = True
+        ok, err, *_ = site.build(pool)
+        assert (ok, err) == (1, 0)
+        assert pool._workers[0][0].pid != p.pid
+
+
+def test_buildpool_crash(siteroot: SiteRoot) -> None:
+    siteroot.write_text(
+        siteroot.path / "hooks.py",
+        """
+import os
+from miyadaiku.extend import *
+
+@pre_build
+def pre_build1(ctx):
+    if ctx.content.src.contentpath == ((), "crash.txt"):
+        os._exit(1)
+    return ctx
+""",
+    )
+
+    for i in range(30):
+        siteroot.write_text(siteroot.contents / f"{i:02}.txt", str(i))
+    siteroot.write_text(siteroot.contents / "crash.txt", "crash")
+
+    site = siteroot.load({}, {}, debug=False)
+    builders: List[builder.Builder] = []
+    for contentpath, content in site.files.items():
+        builders.extend(builder.create_builders(site, content))
+    batches = [[b] for b in builders]
+
+    with builder.BuildPool(num_workers=2) as pool:
+        # only the batch which crashed the worker fails
+        ok, err, results, errors, costs, reads = pool.submit(site, batches)
+        assert (ok, err) == (30, 1)
+        assert errors == {((), "crash.txt")}
+
+        (siteroot.contents / "crash.txt").unlink()
+        site = siteroot.load({}, {}, debug=False)
+        site.rebuild = True
+        ok, err, *_ = site.build(pool)
+        assert (ok, err) == (30, 0)
+
+
+def test_dump_site(siteroot: SiteRoot, tmpdir: Any) -> None:
+    body = "<p>" + "a" * 2000 + "</p>"
+    siteroot.write_text(siteroot.contents / "large.html", body)
+    siteroot.write_text(siteroot.contents / "small.html", "small")
+    site = siteroot.load({}, {})
+
+    picklefile = str(tmpdir / "site.pickle")
+    arenafile = str(tmpdir / "arena")
+    builder.dump_site(site, picklefile, arenafile)
+
+    # bodies of the site are restored
+    large = site.files.get_content(((), "large.html"))
+    assert isinstance(large._body, bytes)
+
+    with open(picklefile, "rb") as f:
+        loaded = pickle.load(f)
+
+    try:
+        large = loaded.files.get_content(((), "large.html"))
+        assert isinstance(large._body, arena.BodyRef)
+        assert large.body == body.encode("utf-8")
+
+        small = loaded.files.get_content(((), "small.html"))
+        assert small._body == b"small"
+    finally:
+        arena.close()
+
+
+def test_buildpool_arena(siteroot: SiteRoot) -> None:
+    body = "<p>" + "a" * 2000 + "</p>"
+    siteroot.write_text(siteroot.contents / "large.html", body)
+    site = siteroot.load({}, {}, debug=False)
+
+    with builder.BuildPool(num_workers=1) as pool:
+        ok, err, *_ = site.build(pool)
+
+    assert (ok, err) == (1, 0)
+    assert body in (siteroot.outputs / "large.html").read_text()
+
+
+def test_buildpool_callback(siteroot: SiteRoot) -> None:
+    for i in range(3):
+        siteroot.write_text(siteroot.contents / f"{i}.txt", str(i))
+    site = siteroot.load({}, {}, debug=False)
+
+    builders: List[builder.Builder] = []
+    for contentpath, content in site.files.items():
+        builders.extend(builder.create_builders(site, content))
+
+    recs: List[builder.BuiltRec] = []
+    with builder.BuildPool(num_workers=1) as pool:
+        ok, err, results, errors, costs, reads = pool.submit(
+            site, builder.split_batch(builders), recs.append
+        )
+
+    assert (ok, err) == (3, 0)
+    assert len(results) == 3
+    assert {rec[0] for rec in recs} == {((), f"{i}.txt") for i in range(3)}
+    assert set(costs) == {((), f"{i}.txt") for i in range(3)}
+
+
+def test_unchanged_outputs(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "file1.rst", "abc")
+    siteroot.write_text(siteroot.files / "file2.bin", "def")
+
+    site = siteroot.load({}, {})
+    ok, err, deps, results, errors = site.build()
+    assert builder.count_outputs(results) == (2, 0)
+
+    output = siteroot.outputs / "file1.html"
+    mtime = output.stat().st_mtime_ns
+
+    site = siteroot.load({}, {})
+    site.rebuild = True
+    ok, err, deps, results, errors = site.build()
+    assert builder.count_outputs(results) == (0, 2)
+    assert output.stat().st_mtime_ns == mtime
+
+    siteroot.write_text(siteroot.files / "file2.bin", "xyz")
+    site = siteroot.load({}, {})
+    site.rebuild = True
+    ok, err, deps, results, errors = site.build()
+    assert builder.count_outputs(results) == (1, 1)
+    assert (siteroot.outputs / "file2.bin").read_text() == "xyz"
@@ -82,3 +82,37 @@ def test_import() -> None:
     cfg.add_themecfg({"imports": "c"})
 
     assert set(cfg.get(("dir1",), "imports")) == {"a", "b", "c"}
+
+
+def test_flattened() -> None:
+    cfg = config.Config({"prop": "root_value"})
+    cfg.add_themecfg({"prop": "theme_value", "theme": "theme_value"})
+    cfg.add(("dir1",), {"prop": "value1"})
+
+    assert cfg.get(("dir1", "dir2"), "prop") == "value1"
+    assert cfg.get(("dir1", "dir2"), "theme") == "theme_value"
+    assert cfg.get(("dir2",), "prop") == "root_value"
+    assert cfg.get(("dir2",), "missing", None) is None
+
+    # resolved values are discarded by add()
+    generation = cfg.generation
+    cfg.add(("dir1", "dir2"), {"prop": "value2"})
+    assert cfg.generation != generation
+    assert cfg.get(("dir1", "dir2"), "prop") == "value2"
+    assert cfg.get(("dir1",), "prop") == "value1"
+
+
+def test_record() -> None:
+    cfg = config.Config({"prop": "root_value"})
+    with cfg.record() as reads:
+        cfg.get(("dir1",), "prop")
+        cfg.get(("dir1",), "missing", None)
+
+    assert reads == {
+        (("dir1",), "prop"): "root_value",
+        (("dir1",), "missing"): config.MISSING,
+    }
+    assert not cfg.is_updated(reads)
+
+    cfg.add(("dir1",), {"missing": "value"})
+    assert cfg.is_updated(reads)
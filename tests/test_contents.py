@@ -454,3 +454,24 @@ def test_headers(siteroot: SiteRoot) -> None:
 
     assert soup.select("#h_doc_html_text")[0].text == "text"
     assert soup.select("#h_doc_html_text_1")[0].text == "text"
+
+
+def test_metadata_cache(siteroot: SiteRoot) -> None:
+    (ctx,) = create_contexts(siteroot, srcs=[("doc.html", "hi")])
+    site = ctx.site
+
+    assert ctx.content.get_metadata(site, "lang") == "en-US"
+    assert ctx.content.get_metadata(site, "unknown", "default") == "default"
+
+    # config entries read are reported by cached metadata
+    with site.config.record() as reads:
+        assert ctx.content.get_metadata(site, "lang") == "en-US"
+    assert reads == {((), "lang"): "en-US"}
+
+    site.config.add((), {"lang": "ja"})
+    assert ctx.content.get_metadata(site, "lang") == "ja"
+
+    proxy = context.ContentProxy(ctx, ctx.content)
+    ctx.content.src.metadata["lang"] = "fr"
+    proxy.set()
+    assert ctx.content.get_metadata(site, "lang") == "fr"
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 import pytest
@@ -36,6 +37,37 @@ def test_binarycontext(siteroot: SiteRoot) -> None:
     assert Path(outputinfo.filename).read_text() == "subdir/file1"
 
 
+@pytest.mark.parametrize("mode", ["copy", "hardlink", "reflink"])
+def test_publish_file(tmp_path: Path, mode: str) -> None:
+    src = tmp_path / "src.bin"
+    src.write_bytes(b"abc")
+    dest = tmp_path / "dest.bin"
+
+    assert context.publish_file(dest, str(src), mode)
+    assert dest.read_bytes() == b"abc"
+    assert dest.stat().st_mtime_ns == src.stat().st_mtime_ns
+    assert os.path.samefile(src, dest) == (mode == "hardlink")
+
+    # unchanged
+    assert not context.publish_file(dest, str(src), mode)
+
+    # modified
+    src.unlink()
+    src.write_bytes(b"xyz")
+    os.utime(src, ns=(0, 0))
+    assert context.publish_file(dest, str(src), mode)
+    assert dest.read_bytes() == b"xyz"
+
+    # identical contents with different mtime
+    if mode != "hardlink":
+        os.utime(src, ns=(10**9, 10**9))
+        assert not context.publish_file(dest, str(src), mode)
+        assert dest.stat().st_mtime_ns == 10**9
+
+    with pytest.raises(ValueError):
+        context.publish_file(dest, str(src), "xxx")
+
+
 def test_load(siteroot: SiteRoot) -> None:
     siteroot.write_text(siteroot.contents / "A/B/C/file1.html", "A/B/C/file1.html")
     siteroot.write_text(siteroot.contents / "A/B/D/file2.html", "A/B/D/file1.html")
@@ -227,3 +259,28 @@ prop2: value3
 
     with pytest.raises(exceptions.ConfigNotFound):
         assert proxy["prop3"]
+
+
+def test_string_template_cache(siteroot: SiteRoot) -> None:
+    ctx1, ctx2 = create_contexts(
+        siteroot,
+        srcs=[("doc1.html", "{{ 1 + 1 }}"), ("doc2.html", "{{ 1 + 1 }}")],
+        config={"jinja_template_cache_size": 2},
+    )
+
+    cache = ctx1.jinjaenv.string_templates
+    assert cache.maxsize == 2
+
+    # filename_templ is compiled once
+    ctx1.content.build_filename(ctx1, {})
+    ctx2.content.build_filename(ctx2, {})
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # bodies with the same source share the template
+    assert ctx1.content.get_html(ctx1) == "2"
+    assert ctx2.content.get_html(ctx2) == "2"
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    context.eval_jinja(ctx1, ctx1.content, "prop", "{{ 1 }}", {})
+    context.eval_jinja(ctx1, ctx1.content, "prop", "{{ 2 }}", {})
+    assert len(cache._templates) == 2
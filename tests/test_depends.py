@@ -1,3 +1,6 @@
+import os
+import time
+
 from conftest import SiteRoot
 
 from miyadaiku import depends
@@ -24,7 +27,8 @@ def test_update(siteroot: SiteRoot) -> None:
 
     # test no-update
     site.load(site.root, {})
-    rebuild, updated, depdict, outputinfos = depends.check_depends(site)
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
 
     assert rebuild is False
     assert updated == set()
@@ -33,7 +37,8 @@ def test_update(siteroot: SiteRoot) -> None:
     # test update
     (siteroot.contents / "file1.rst").write_text("")
     site.load(site.root, {})
-    rebuild, updated, depdict, outputinfos = depends.check_depends(site)
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
 
     assert rebuild is False
     assert updated == set((((), "file1.rst"),))
@@ -63,7 +68,9 @@ def test_update_file(siteroot: SiteRoot) -> None:
     output = siteroot.outputs / "file1.html"
     output.unlink()
 
-    rebuild, updated, depdict, outputinfos = depends.check_depends(site)
+    recs = depends.load_records(site)
+
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
     assert rebuild is False
     assert updated == set((((), "file1.rst"),))
 
@@ -96,7 +103,8 @@ def test_refs(siteroot: SiteRoot) -> None:
     # test update depends
     (siteroot.contents / "file2.rst").write_text("")
     site.load(site.root, {})
-    rebuild, updated, depdict, outputfinos = depends.check_depends(site)
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputfinos = depends.check_depends(site, recs)
 
     assert rebuild is False
     assert updated == set(
@@ -120,7 +128,8 @@ def test_rebuild(siteroot: SiteRoot) -> None:
     # test new file
     (siteroot.contents / "file3.rst").write_text("")
     site.load(site.root, {})
-    rebuild, updated, depdict, outputinfos = depends.check_depends(site)
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
 
     assert rebuild is True
 
@@ -129,13 +138,44 @@ def test_yaml(siteroot: SiteRoot) -> None:
     siteroot.write_text(siteroot.contents / "file1.rst", "")
 
     site = siteroot.load({}, {})
-    ok, err, deps, results, errors = site.build()
-    orig_outputinfos = depends.update_outputinfos(site, [], results)
-    depends.save_deps(site, deps, orig_outputinfos, errors)
+    site.build()
+
+    siteroot.write_text(siteroot.contents / "config.yml", "unused: 1")
+    site = siteroot.load({}, {})
+
+    recs = depends.load_records(site)
+
+    rebuild, updated, depdict, outputresults = depends.check_depends(site, recs)
+    assert rebuild is False
+    assert updated == set()
+
+
+def test_config_reads(siteroot: SiteRoot) -> None:
+    siteroot.write_text(
+        siteroot.contents / "file1.rst", ":jinja:`{{ config.custom_value }}`"
+    )
+    siteroot.write_text(siteroot.contents / "file2.rst", "")
+
+    site = siteroot.load({"custom_value": "value1"}, {})
+    site.build()
+
+    # unused entry
+    site = siteroot.load({"custom_value": "value1", "unused": 1}, {})
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputresults = depends.check_depends(site, recs)
+    assert rebuild is False
+    assert updated == set()
 
-    siteroot.write_text(siteroot.contents / "file2.yml", "")
+    site = siteroot.load({"custom_value": "value2"}, {})
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputresults = depends.check_depends(site, recs)
+    assert rebuild is False
+    assert updated == {((), "file1.rst")}
 
-    rebuild, updated, depdict, outputresults = depends.check_depends(site)
+    # entries used by the site
+    site = siteroot.load({"custom_value": "value1", "ignores": ["*.txt"]}, {})
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputresults = depends.check_depends(site, recs)
     assert rebuild is True
 
 
@@ -157,7 +197,8 @@ file1-new-title
 """
     )
     site.load(site.root, {})
-    rebuild, updated, depdict, outputinfos = depends.check_depends(site)
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
 
     assert rebuild is True
 
@@ -204,3 +245,118 @@ file1-new-title
 ----------------------------
 """
     )
+
+
+def test_costs(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "file1.rst", "")
+    siteroot.write_text(siteroot.contents / "file2.rst", "")
+
+    site = siteroot.load({}, {})
+    site.build()
+
+    costs = depends.get_costs(depends.load_records(site))
+    assert set(costs) == {((), "file1.rst"), ((), "file2.rst")}
+
+    (siteroot.contents / "file2.rst").unlink()
+    site = siteroot.load({}, {})
+    costs = depends.update_costs(site, costs, {})
+    assert set(costs) == {((), "file1.rst")}
+
+
+def test_costs_unordered(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "file1.rst", "")
+    siteroot.write_text(siteroot.contents / "file2.rst", "")
+
+    site = siteroot.load({"order_builders_by_cost": True}, {})
+    site.build()
+
+    # costs of contents not rebuilt are kept
+    siteroot.write_text(siteroot.contents / "file1.rst", "updated")
+    site = siteroot.load({"order_builders_by_cost": False}, {})
+    site.build()
+
+    costs = depends.get_costs(depends.load_records(site))
+    assert set(costs) == {((), "file1.rst"), ((), "file2.rst")}
+
+
+def test_templates(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.templates / "t1.html", "t1{{ page.html }}")
+    siteroot.write_text(siteroot.templates / "t2.html", "t2{% include 'inc.html' %}")
+    siteroot.write_text(siteroot.templates / "inc.html", "inc")
+
+    siteroot.write_text(
+        siteroot.contents / "doc1.html", "article_template: t1.html\n\ndoc1"
+    )
+    siteroot.write_text(
+        siteroot.contents / "doc2.html", "article_template: t2.html\n\ndoc2"
+    )
+    siteroot.write_text(siteroot.contents / "doc3.html", "doc3")
+
+    site = siteroot.load({}, {})
+    site.build()
+
+    siteroot.write_text(siteroot.templates / "inc.html", "inc2")
+    site = siteroot.load({}, {})
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
+    assert rebuild is False
+    assert updated == {((), "doc2.html")}
+
+    (siteroot.templates / "t1.html").unlink()
+    site = siteroot.load({}, {})
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
+    assert rebuild is False
+    assert updated == {((), "doc1.html"), ((), "doc2.html")}
+
+
+def test_hash(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "file1.rst", "abc")
+    siteroot.write_text(siteroot.contents / "file2.rst", "def")
+    siteroot.write_text(siteroot.files / "file3.bin", "ghi")
+
+    site = siteroot.load({"detect_changes_by_hash": True}, {})
+    site.build()
+
+    # touched but not modified
+    future = time.time() + 10
+    os.utime(siteroot.contents / "file1.rst", (future, future))
+    os.utime(siteroot.outputs / "file2.html", (0, 0))
+    os.utime(siteroot.outputs / "file3.bin", (0, 0))
+
+    site.load(site.root, {})
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
+    assert rebuild is False
+    assert updated == set()
+
+    # modified
+    siteroot.write_text(siteroot.contents / "file1.rst", "xyz")
+    (siteroot.outputs / "file2.html").write_text("")
+
+    site.load(site.root, {})
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
+    assert rebuild is False
+    assert updated == {((), "file1.rst"), ((), "file2.rst")}
+
+
+def test_index_config_reads(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "index.yml", "type: index\n")
+    for i in range(4):
+        siteroot.write_text(siteroot.contents / f"doc{i}.rst", f"doc{i}")
+
+    site = siteroot.load({"indexpage_max_articles": 10}, {})
+    site.build()
+    assert not (siteroot.outputs / "index_2.html").exists()
+
+    # number of articles in an index page is read to split the index
+    site = siteroot.load({"indexpage_max_articles": 2}, {})
+    recs = depends.load_records(site)
+    rebuild, updated, depdict, outputinfos = depends.check_depends(site, recs)
+    assert rebuild is False
+    assert updated == {((), "index.yml")}
+
+    ok, err, deps, results, errors = site.build()
+    assert (ok, err) == (2, 0)
+    assert (siteroot.outputs / "index_2.html").exists()
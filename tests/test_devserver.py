@@ -0,0 +1,86 @@
+import http.client
+import json
+from pathlib import Path
+
+from miyadaiku import BuildResult, ContentSrc, OutputInfo, devserver
+
+
+def test_updated_paths(tmp_path: Path) -> None:
+    src = ContentSrc(package=None, srcpath=None, metadata={}, contentpath=((), ""))
+
+    def oi(filename: Path, written: bool) -> OutputInfo:
+        return OutputInfo(
+            ((), filename.name), filename, "", "", None, None, True, 0.1, written
+        )
+
+    results: BuildResult = [
+        (src, set(), [oi(tmp_path / "a.html", True), oi(tmp_path / "b.html", False)]),
+        (src, set(), [oi(tmp_path / "dir/index.html", True)]),
+    ]
+    assert devserver.updated_paths(tmp_path, results) == {
+        "/a.html",
+        "/dir/index.html",
+    }
+
+
+def test_devserver(tmp_path: Path) -> None:
+    (tmp_path / "index.html").write_text("<html><body>index</body></html>")
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "dir" / "style.css").write_text("body {}")
+
+    server = devserver.DevServer(tmp_path, "127.0.0.1", 0)
+    server.start()
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", server.port)
+
+        conn.request("GET", "/")
+        resp = conn.getresponse()
+        body = resp.read()
+        assert resp.status == 200
+        assert body.startswith(b"<html><body>index<script>")
+        assert body.endswith(b"</script>\n</body></html>")
+        etag = resp.getheader("ETag")
+        lastmodified = resp.getheader("Last-Modified")
+        assert etag and lastmodified
+
+        # keep-alive
+        conn.request("GET", "/", headers={"If-None-Match": etag})
+        resp = conn.getresponse()
+        resp.read()
+        assert resp.status == 304
+
+        conn.request("HEAD", "/index.html", headers={"If-Modified-Since": lastmodified})
+        resp = conn.getresponse()
+        resp.read()
+        assert resp.status == 304
+
+        conn.request("GET", "/dir/style.css")
+        resp = conn.getresponse()
+        assert resp.read() == b"body {}"
+        assert resp.getheader("Content-Type") == "text/css"
+
+        conn.request("GET", "/dir")
+        resp = conn.getresponse()
+        resp.read()
+        assert resp.status == 301
+        assert resp.getheader("Location") == "/dir/"
+
+        conn.request("GET", "/../index.html")
+        resp = conn.getresponse()
+        resp.read()
+        assert resp.status == 404
+
+        events = http.client.HTTPConnection("127.0.0.1", server.port, timeout=5)
+        events.request("GET", devserver.EVENTS_PATH)
+        resp = events.getresponse()
+        assert resp.getheader("Content-Type") == "text/event-stream"
+        assert resp.readline() == b"retry: 1000\n"
+        assert resp.readline() == b"\n"
+
+        server.notify(["/index.html", "/dir/style.css"])
+        assert resp.readline() == b"event: reload\n"
+        data = resp.readline()
+        assert json.loads(data[len(b"data: ") :]) == ["/dir/style.css", "/index.html"]
+        events.close()
+    finally:
+        server.stop()
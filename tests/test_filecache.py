@@ -0,0 +1,94 @@
+import os
+from pathlib import Path
+
+from miyadaiku import ContentSrc
+from miyadaiku.filecache import FileCache
+
+
+def make_src(path: Path) -> ContentSrc:
+    return ContentSrc(
+        package="",
+        srcpath=str(path),
+        metadata={},
+        contentpath=((), path.name),
+        mtime=path.stat().st_mtime,
+    )
+
+
+def test_filecache(tmp_path: Path) -> None:
+    dbfile = tmp_path / "cache.sqlite"
+    file1 = tmp_path / "file1.txt"
+    file1.write_text("abc")
+    file2 = tmp_path / "file2.txt"
+    file2.write_text("def")
+
+    src1 = make_src(file1)
+    src2 = make_src(file2)
+
+    cache = FileCache(dbfile)
+    assert cache.get(src1, file1.stat()) is None
+    cache.set(src1, file1.stat(), [(src1, b"body1")])
+    cache.set(src2, file2.stat(), [(src2, None)])
+    cache.close()
+
+    cache = FileCache(dbfile)
+    assert cache.get(src1, file1.stat()) == [(src1, b"body1")]
+
+    # touched but not modified
+    os.utime(file1, (0, 100))
+    src1 = make_src(file1)
+    ret = cache.get(src1, file1.stat())
+    assert ret == [(src1, b"body1")]
+    assert ret[0][0].mtime == 100  # type: ignore
+
+    # modified
+    file1.write_text("xyz")
+    src1 = make_src(file1)
+    assert cache.get(src1, file1.stat()) is None
+
+    # file2 is not looked up
+    assert cache.compact() == 1
+    cache.close()
+
+    cache = FileCache(dbfile)
+    assert cache.get(src2, file2.stat()) is None
+    cache.close()
+
+
+def test_filecache_rebuild(tmp_path: Path) -> None:
+    dbfile = tmp_path / "cache.sqlite"
+    file1 = tmp_path / "file1.txt"
+    file1.write_text("abc")
+    src1 = make_src(file1)
+
+    cache = FileCache(dbfile)
+    cache.set(src1, file1.stat(), [(src1, b"body1")])
+    cache.close()
+
+    cache = FileCache(dbfile, rebuild=True)
+    assert cache.get(src1, file1.stat()) is None
+    cache.close()
+
+    dbfile.write_bytes(b"broken")
+    cache = FileCache(dbfile)
+    assert cache.get(src1, file1.stat()) is None
+    cache.close()
+
+
+def test_settings(tmp_path: Path) -> None:
+    dbfile = tmp_path / "cache.sqlite"
+    file1 = tmp_path / "file1.txt"
+    file1.write_text("abc")
+    src1 = make_src(file1)
+
+    cache = FileCache(dbfile, settings="a")
+    cache.set(src1, file1.stat(), [(src1, b"body1")])
+    cache.close()
+
+    cache = FileCache(dbfile, settings="a")
+    assert cache.get(src1, file1.stat()) == [(src1, b"body1")]
+    cache.close()
+
+    cache = FileCache(dbfile, settings="b")
+    assert cache.get(src1, file1.stat()) is None
+    cache.close()
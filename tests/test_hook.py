@@ -72,6 +72,46 @@ def load_finished1(site):
     assert 1 == extend.hooks_load_finished[0].called  # type: ignore
 
 
+@pytest.mark.parametrize("debug", [True, False])
+def test_load_order(siteroot: SiteRoot, debug: bool) -> None:
+    siteroot.write_text(
+        siteroot.path / "hooks.py",
+        """
+from miyadaiku.extend import *
+
+calls = []
+
+@pre_load
+def pre_load1(site, contentsrc, binary):
+    calls.append(("pre", contentsrc.contentpath))
+    return contentsrc
+
+@post_load
+def post_load1(site, contentsrc, binary, bytes):
+    calls.append(("post", contentsrc.contentpath))
+    return contentsrc, bytes
+
+pre_load1.calls = calls
+""",
+    )
+
+    for i in range(20):
+        siteroot.write_text(siteroot.contents / f"doc{i}.rst", f"doc{i}")
+
+    extend.load_hook(siteroot.path)
+    siteroot.load({}, {}, debug=debug)
+
+    calls = extend.hooks_pre_load[0].calls  # type: ignore
+    pres = [contentpath for hook, contentpath in calls if hook == "pre"]
+    posts = [contentpath for hook, contentpath in calls if hook == "post"]
+
+    # pre_load hooks are called for all files in the directory before
+    # they are loaded, and post_load hooks are called in the same order.
+    assert calls == [("pre", cp) for cp in pres] + [("post", cp) for cp in posts]
+    assert pres == posts
+    assert len(pres) == 20
+
+
 @pytest.mark.parametrize("debug", [True, False])
 def test_build(siteroot: SiteRoot, debug: bool) -> None:
     siteroot.write_text(
@@ -1,7 +1,9 @@
+from typing import Any, Dict, Tuple
+
 from bs4 import BeautifulSoup
 from conftest import SiteRoot, create_contexts
 
-from miyadaiku import context
+from miyadaiku import builder, context, site
 
 
 def test_build(siteroot: SiteRoot) -> None:
@@ -205,3 +207,186 @@ def test_link_recurse(siteroot: SiteRoot) -> None:
     soup = BeautifulSoup(proxy2.html, "html.parser")
     a = soup.find_all("a")[-1]
     assert "Circular reference detected" in a.text
+
+
+def test_render_cache(siteroot: SiteRoot) -> None:
+    ctx1, ctx2, ctx3 = create_contexts(
+        siteroot,
+        srcs=[
+            ("doc1.html", "<h1>header</h1>{{ content.link_to('sub/doc3.html') }}"),
+            ("doc2.html", "{{ content.load('doc1.html').html }}"),
+            ("sub/doc3.html", "{{ content.load('../doc1.html').html }}"),
+        ],
+    )
+
+    site = ctx1.site
+    html = ctx1.content.get_html(ctx1)
+    assert 'href="sub/doc3.html"' in html
+    assert (site.render_cache.hits, site.render_cache.misses) == (0, 1)
+
+    # pages in the same directory share the html
+    ctx2.content.get_html(ctx2)
+    assert site.render_cache.hits == 1
+    assert ctx2.depends == {ctx1.contentpath, ctx2.contentpath, ctx3.contentpath}
+    assert ctx1.content.get_headers(ctx2) == ctx1.content.get_headers(ctx1)
+
+    # relative links differ in other directories
+    html = ctx3.content.get_html(ctx3)
+    assert 'href="doc3.html"' in html
+    assert site.render_cache.hits == 1
+
+
+def test_render_cache_page(siteroot: SiteRoot) -> None:
+    ctx1, ctx2 = create_contexts(
+        siteroot,
+        srcs=[
+            ("doc1.html", "title: doc1\n\n{{ page.title }}"),
+            ("doc2.html", "title: doc2\n\n{{ content.load('doc1.html').html }}"),
+        ],
+    )
+
+    assert ctx1.content.get_html(ctx1) == "doc1"
+    assert ctx2.content.get_html(ctx2) == "doc2"
+    assert ctx1.site.render_cache.hits == 0
+
+
+def test_render_cache_nested_page(siteroot: SiteRoot) -> None:
+    ctx1, ctx2, ctx3, ctx4, ctx5 = create_contexts(
+        siteroot,
+        srcs=[
+            ("doc1.html", "TITLE={{ page.title }}"),
+            ("wrap.html", "{{ content.load('doc1.html').html }}"),
+            ("a.html", "title: PAGE_A\n\n{{ content.load('wrap.html').html }}"),
+            ("b.html", "title: PAGE_B\n\n{{ content.load('wrap.html').html }}"),
+            (
+                "c.html",
+                "title: PAGE_C\n\n{{ content.load('doc1.html').html }}"
+                "{{ content.load('wrap.html').abstract }}",
+            ),
+        ],
+    )
+
+    assert ctx3.content.get_html(ctx3) == "TITLE=PAGE_A"
+    assert ctx4.content.get_html(ctx4) == "TITLE=PAGE_B"
+
+    # doc1 is already rendered when wrap.html is rendered
+    assert ctx5.content.get_html(ctx5) == "TITLE=PAGE_CTITLE=PAGE_C"
+    assert ctx2.content.build_abstract(ctx4) == "TITLE=PAGE_B"
+
+    assert ctx3.site.render_cache.hits == 0
+    assert ctx3.site.render_cache.store_hits == 0
+
+
+def test_render_cache_abstract(siteroot: SiteRoot) -> None:
+    ctx1, ctx2 = create_contexts(
+        siteroot,
+        srcs=[
+            ("doc1.html", "<p>abcdefg</p>"),
+            ("doc2.html", "doc2"),
+        ],
+    )
+
+    site = ctx1.site
+    assert ctx1.content.build_abstract(ctx1, 3) == "<p>abc</p>"
+
+    hits = site.render_cache.hits
+    assert ctx1.content.build_abstract(ctx2, 3) == "<p>abc</p>"
+    assert site.render_cache.hits == hits + 2
+    assert ctx1.content.build_abstract(ctx2, 4) == "<p>abcd</p>"
+
+
+def test_render_store(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "doc1.html", "<h1>header</h1>")
+    siteroot.write_text(
+        siteroot.contents / "doc2.html",
+        "{{ content.link_to('doc3.html') }}",
+    )
+    siteroot.write_text(siteroot.contents / "doc3.html", "title: doc3\n\ntext")
+
+    def render(config: Dict[Any, Any], filename: str) -> Tuple[site.Site, str]:
+        site = siteroot.load(config, {})
+        jinjaenv = site.build_jinjaenv()
+        content = site.files.get_content(((), filename))
+        (b,) = builder.create_builders(site, content)
+        ctx = b.build_context(site, jinjaenv)
+        return site, ctx.content.get_html(ctx)
+
+    site1, html1 = render({}, "doc1.html")
+    site1, html2 = render({}, "doc2.html")
+    assert site1.render_cache.store_hits == 0
+
+    # bodies without jinja are reused after the config is updated
+    site2, html = render({"site_title": "updated"}, "doc1.html")
+    assert site2.render_cache.store_hits == 1
+    assert html == html1
+
+    # bodies with jinja are reused unless config entries they read are updated
+    site2, html = render({"site_title": "updated"}, "doc2.html")
+    assert site2.render_cache.store_hits == 1
+    assert html == html2
+
+    site2, html = render({"site_url": "http://example.com/"}, "doc2.html")
+    assert site2.render_cache.store_hits == 0
+
+    site2, html = render({}, "doc2.html")
+    assert site2.render_cache.store_hits == 1
+
+    # updated dependency
+    siteroot.write_text(siteroot.contents / "doc3.html", "title: doc3-2\n\ntext")
+    site3, html = render({}, "doc2.html")
+    assert site3.render_cache.store_hits == 0
+    assert "doc3-2" in html
+
+
+def test_render_store_env(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "doc1.html", "{{ value }}")
+    siteroot.write_text(
+        siteroot.path / "hooks.py",
+        """
+from miyadaiku.extend import *
+
+jinja_globals["value"] = "value1"
+""",
+    )
+
+    def render(rebuild: bool = False) -> Tuple[site.Site, str]:
+        site = siteroot.load({}, {})
+        site.rebuild = rebuild
+        jinjaenv = site.build_jinjaenv()
+        content = site.files.get_content(((), "doc1.html"))
+        (b,) = builder.create_builders(site, content)
+        ctx = b.build_context(site, jinjaenv)
+        return site, ctx.content.get_html(ctx)
+
+    site1, html = render()
+    site1, html = render()
+    assert site1.render_cache.store_hits == 1
+    assert html == "value1"
+
+    # updated hooks
+    siteroot.write_text(
+        siteroot.path / "hooks.py",
+        """
+from miyadaiku.extend import *
+
+jinja_globals["value"] = "value2"
+""",
+    )
+    site2, html = render()
+    assert site2.render_cache.store_hits == 0
+    assert html == "value2"
+
+    # stored entries are not used to rebuild
+    site3, html = render(rebuild=True)
+    assert site3.render_cache.store_hits == 0
+
+
+def test_render_store_failure(siteroot: SiteRoot) -> None:
+    site = siteroot.load({}, {})
+    store = site.render_cache.store
+    assert store
+
+    # unpicklable value
+    store.set("0123456789", lambda: None, [], ({}, {}))
+    assert not list(store.path.glob("**/*.tmp"))
+    assert store.get("0123456789", site.build_jinjaenv()) is None
@@ -1,4 +1,7 @@
+import base64
+import json
 from pathlib import Path
+from typing import Any, Dict
 
 from bs4 import BeautifulSoup
 from conftest import SiteRoot
@@ -129,3 +132,78 @@ def test_split(siteroot: SiteRoot) -> None:
         "has_jinja": True,
         "loader": "ipynb",
     }
+
+
+def test_restore_jinjatags() -> None:
+    tags = {"abc1": "{{ a }}", "abc10": "{{ b }}", "def2": r"{{ '\n' }}"}
+    html = "<p> abc1 </p>\n<p>x abc10 def2 abc1</p>"
+
+    assert (
+        ipynb.restore_jinjatags(html, tags)
+        == "{{ a }}\n<p>x {{ b }} {{ '\\n' }} abc1</p>"
+    )
+
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+def write_plot_notebook(siteroot: SiteRoot, metadata: Dict[str, Any]) -> None:
+    nb = {
+        "cells": [
+            {"cell_type": "markdown", "metadata": {}, "source": "# title"},
+            {
+                "cell_type": "code",
+                "execution_count": None,
+                "metadata": {},
+                "source": "plot()",
+                "outputs": [
+                    {
+                        "output_type": "display_data",
+                        "metadata": {},
+                        "data": {"image/png": base64.b64encode(PNG).decode()},
+                    }
+                ],
+            },
+        ],
+        "metadata": metadata,
+        "nbformat": 4,
+        "nbformat_minor": 4,
+    }
+    siteroot.write_text(siteroot.contents / "dir/nb.ipynb", json.dumps(nb))
+
+
+def test_extract_outputs(siteroot: SiteRoot) -> None:
+    write_plot_notebook(siteroot, {})
+
+    site = siteroot.load({"ipynb_extract_outputs": True}, {})
+    site.build()
+
+    html = (siteroot.outputs / "dir/nb.html").read_text()
+    assert 'src="nb_output_1_0.png"' in html
+    assert "base64" not in html
+    assert (siteroot.outputs / "dir/nb_output_1_0.png").read_bytes() == PNG
+
+
+def test_extract_outputs_nojinja(siteroot: SiteRoot) -> None:
+    write_plot_notebook(siteroot, {"miyadaiku": {"has_jinja": False}})
+
+    site = siteroot.load({"ipynb_extract_outputs": True}, {})
+    site.build()
+
+    html = (siteroot.outputs / "dir/nb.html").read_text()
+    assert 'src="nb_output_1_0.png"' in html
+    assert "content.path_to" not in html
+    assert (siteroot.outputs / "dir/nb_output_1_0.png").read_bytes() == PNG
+
+
+def test_keep_exporters(siteroot: SiteRoot) -> None:
+    site = siteroot.load({}, {})
+    ipynb.init(site)
+    exporter = ipynb._make_exporter(None, None)
+
+    ipynb.init(site)
+    assert ipynb._make_exporter(None, None) is exporter
+
+    site = siteroot.load({"ipynb_template_name": "lab"}, {})
+    ipynb.init(site)
+    assert ipynb._make_exporter(None, None) is not exporter
@@ -1,3 +1,4 @@
+from pathlib import Path
 from typing import Set
 
 from conftest import SiteRoot
@@ -252,3 +253,137 @@ test
 
     found = s.files.get_contents(s, excludes=dict(tags=None))
     assert set(f.src.contentpath for f in found) == set([((), "a.rst"), ((), "c.rst")])
+
+
+def test_get_contents_index(siteroot: SiteRoot) -> None:
+    siteroot.write_text(
+        siteroot.contents / "a.rst",
+        """
+.. article::
+   :date: 2017-01-01
+   :tags: tag1
+test
+""",
+    )
+
+    siteroot.write_text(
+        siteroot.contents / "sub1/b.rst",
+        """
+.. article::
+   :date: 2017-01-02
+   :tags: tag1, tag2
+test
+""",
+    )
+
+    siteroot.write_text(
+        siteroot.contents / "sub1/sub2/c.rst",
+        """
+.. article::
+   :date: 2017-01-03
+   :tags: tag2
+test
+""",
+    )
+
+    s = siteroot.load({}, {})
+
+    found = s.files.get_contents(s)
+    assert [f.src.contentpath for f in found] == [
+        (("sub1", "sub2"), "c.rst"),
+        (("sub1",), "b.rst"),
+        ((), "a.rst"),
+    ]
+
+    found = s.files.get_contents(s, subdirs=[("sub1",)])
+    assert [f.src.contentpath for f in found] == [
+        (("sub1", "sub2"), "c.rst"),
+        (("sub1",), "b.rst"),
+    ]
+
+    found = s.files.get_contents(s, subdirs=[("sub1",)], recurse=False)
+    assert [f.src.contentpath for f in found] == [(("sub1",), "b.rst")]
+
+    # results are cached but returned as copies
+    found.clear()
+    found = s.files.get_contents(s, subdirs=[("sub1",)], recurse=False)
+    assert [f.src.contentpath for f in found] == [(("sub1",), "b.rst")]
+
+    # config entries read by the query are recorded on every call
+    with s.config.record() as reads:
+        s.files.get_contents(s, filters={"tags": {"tag2"}})
+    assert ((), "draft") in reads
+
+    s.files.add_bytes("article", "/sub1/d.rst", b"")
+    s.files.get_content((("sub1",), "d.rst")).src.metadata["tags"] = "tag2"
+    found = s.files.get_contents(s, filters={"tags": {"tag2"}})
+    assert set(f.src.contentpath for f in found) == set(
+        [(("sub1", "sub2"), "c.rst"), (("sub1",), "b.rst"), (("sub1",), "d.rst")]
+    )
+
+    s.config.add((), {"draft": True})
+    assert s.files.get_contents(s) == []
+
+
+def test_loadfiles_parallel(siteroot: SiteRoot) -> None:
+    for i in range(loader.MIN_PARALLEL_LOADS * 2):
+        siteroot.write_text(
+            siteroot.contents / f"dir{i % 3}/{i}.md",
+            f"""
+title: title{i}
+date: 2017-01-01
+
+body{i}
+""",
+        )
+        siteroot.write_bytes(siteroot.files / f"{i}.bin", b"x" * i)
+
+    siteroot.write_text(siteroot.contents / "0.yml", "prop: value")
+
+    s = siteroot.load({"load_processes": 2}, {}, debug=False)
+    paths = list(s.files.get_contentfiles_keys())
+
+    s2 = siteroot.load({"load_processes": 1}, {}, debug=False)
+    assert list(s2.files.get_contentfiles_keys()) == paths
+
+    assert s.config.get((), "prop") == "value"
+    for i in range(loader.MIN_PARALLEL_LOADS * 2):
+        content = s.files.get_content(((f"dir{i % 3}",), f"{i}.md"))
+        assert content.get_metadata(s, "title") == f"title{i}"
+        assert f"body{i}" in content.body.decode("utf-8")  # type: ignore
+
+        content = s.files.get_content(((), f"{i}.bin"))
+        assert content.body is None
+        assert content.src.read_bytes() == b"x" * i
+
+
+def test_load_many_in_process(siteroot: SiteRoot) -> None:
+    srcs = []
+    for i, name in enumerate(["a.md", "b.txt", "c.md", "d.rst"]):
+        path = siteroot.write_text(siteroot.contents / name, f"body{i}")
+        srcs.append((loader.get_contentsrc(siteroot.contents, path), False))
+
+    loaded = loader._load_many_in_process(srcs)
+    assert loaded == [loader._load_in_process(src, bin) for src, bin in srcs]
+    loaders = [items[0][0].metadata["loader"] for items in loaded]
+    assert loaders == ["md", "text", "md", "rst"]
+
+
+def test_loadfiles_notebooks(siteroot: SiteRoot) -> None:
+    nb = (Path(__file__).parent / "test.ipynb").read_text()
+    for i in range(3):
+        siteroot.write_text(siteroot.contents / f"nb{i}.ipynb", nb)
+        siteroot.write_text(siteroot.contents / f"{i}.md", f"body{i}")
+
+    s = siteroot.load({"load_processes": 2}, {}, debug=False)
+    paths = list(s.files.get_contentfiles_keys())
+
+    # load without the file cache
+    (siteroot.path / loader.CACHE_FILE).unlink()
+    s2 = siteroot.load({"load_processes": 1}, {}, debug=False)
+    assert list(s2.files.get_contentfiles_keys()) == paths
+
+    for i in range(3):
+        content = s.files.get_content(((), f"nb{i}.ipynb"))
+        assert content.get_metadata(s, "loader") == "ipynb"
+        assert content.body == s2.files.get_content(((), f"nb{i}.ipynb")).body
@@ -1,4 +1,5 @@
-from typing import Any
+import logging
+from typing import Any, List
 from unittest.mock import patch
 
 import pytest
@@ -26,6 +27,35 @@ def test_mpbuild(log: Any, siteroot: SiteRoot) -> None:
     assert str(siteroot.contents / "test.html") in kwargs["extra"]["msgdict"]["msg"]
 
 
+def test_mp_log_flush() -> None:
+    class Queue(List[Any]):
+        def put(self, msg: Any) -> None:
+            self.append(msg)
+
+    queue = Queue()
+    with patch("miyadaiku.mp_log.MAX_PENDINGS", 2), patch(
+        "miyadaiku.mp_log.FLUSH_INTERVAL", 1000
+    ):
+        try:
+            mp_log.init_mp_logging(queue)
+            logger = logging.getLogger("test_mp_log_flush")
+
+            logger.info("1")
+            assert queue == []
+
+            logger.info("2")
+            assert [[r["msg"] for r in msgs] for _, msgs in queue] == [["1", "2"]]
+
+            logger.info("3")
+            mp_log.flush_mp_logging()
+            assert [[r["msg"] for r in msgs] for _, msgs in queue] == [
+                ["1", "2"],
+                ["3"],
+            ]
+        finally:
+            mp_log.init_logging()
+
+
 def test_jinja_str_err(siteroot: SiteRoot) -> None:
     (ctx,) = create_contexts(
         siteroot,
@@ -218,3 +218,49 @@ second
     assert src2.metadata["type"] == "article"
     assert src2.contentpath == ((), "c.md")
     assert text2 == "<p>second</p>"
+
+
+def test_reuse_converter(sitedir: Path) -> None:
+    sitedir.joinpath("a.md").write_text(
+        """title: a
+
+a :jinja:`{{abc}}` [^1]
+
+[^1]: note
+"""
+    )
+    sitedir.joinpath("b.md").write_text("b :jinja:`{{def}}` [^1]")
+
+    ((src1, text1),) = md.load(to_contentsrc(sitedir / "a.md"))
+    ((src2, text2),) = md.load(to_contentsrc(sitedir / "b.md"))
+
+    assert src1.metadata["title"] == "a"
+    assert "{{abc}}" in text1
+    assert "note" in text1
+
+    # states of the converter are reset
+    assert "title" not in src2.metadata
+    assert text2 == "<p>b {{def}} [^1]</p>"
+
+
+def test_load_many(sitedir: Path) -> None:
+    sitedir.joinpath("a.md").write_text(
+        """title: a
+
+*[HTML]: Hyper Text Markup Language
+
+HTML
+"""
+    )
+    sitedir.joinpath("b.md").write_text("HTML")
+
+    ((src1, text1),), ((src2, text2),) = md.load_many(
+        [to_contentsrc(sitedir / "a.md"), to_contentsrc(sitedir / "b.md")]
+    )
+
+    assert src1.metadata["title"] == "a"
+    assert text1 == '<p><abbr title="Hyper Text Markup Language">HTML</abbr></p>'
+
+    # abbreviations are not shared between documents
+    assert "title" not in src2.metadata
+    assert text2 == "<p>HTML</p>"
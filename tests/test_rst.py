@@ -1,4 +1,10 @@
-from conftest import SiteRoot, create_contexts
+import copy
+from pathlib import Path
+
+import docutils.io
+from conftest import SiteRoot, create_contexts, to_contentsrc
+
+from miyadaiku import rst
 
 
 def test_load(siteroot: SiteRoot) -> None:
@@ -177,3 +183,79 @@ def test_pygments(siteroot: SiteRoot) -> None:
 
     assert ctx.content.body
     assert b":jinja:`&#123;&#123;&#125;&#125;`" in ctx.content.body
+
+
+def test_reuse_publisher(sitedir: Path) -> None:
+    sitedir.joinpath("a.rst").write_text(
+        """
+.. article::
+   :tags: a
+
+title1
+------
+
+body1
+"""
+    )
+    sitedir.joinpath("b.rst").write_text("body2")
+
+    ((src1, text1),) = rst.load(to_contentsrc(sitedir / "a.rst"))
+    ((src2, text2),) = rst.load(to_contentsrc(sitedir / "b.rst"))
+
+    assert src1.metadata["title"] == "title1"
+    assert src1.metadata["tags"] == "a"
+    assert text1 == "<p>body1</p>\n"
+
+    assert not src2.metadata["title"]
+    assert "tags" not in src2.metadata
+    assert text2 == "<p>body2</p>\n"
+
+
+def test_load_many(sitedir: Path) -> None:
+    sitedir.joinpath("a.rst").write_text(
+        """
+.. article::
+   :tags: a
+
+title1
+------
+
+body1
+"""
+    )
+    sitedir.joinpath("b.rst").write_text("body2")
+
+    ((src1, text1),), ((src2, text2),) = rst.load_many(
+        [to_contentsrc(sitedir / "a.rst"), to_contentsrc(sitedir / "b.rst")]
+    )
+
+    assert src1.metadata["title"] == "title1"
+    assert src1.metadata["tags"] == "a"
+    assert text1 == "<p>body1</p>\n"
+
+    assert not src2.metadata["title"]
+    assert "tags" not in src2.metadata
+    assert text2 == "<p>body2</p>\n"
+
+
+def test_settings_isolated(sitedir: Path) -> None:
+    sitedir.joinpath("a.rst").write_text("body1")
+    sitedir.joinpath("b.rst").write_text("body2")
+
+    prototype = rst._get_prototype()
+    orig = copy.deepcopy(prototype.settings.stylesheet_path)
+
+    pub1 = rst._make_pub(docutils.io.FileInput)  # type: ignore
+    pub2 = rst._make_pub(docutils.io.FileInput)  # type: ignore
+
+    # mutable settings are not shared between the documents
+    pub1.settings.stylesheet_path.append("extra.css")
+    assert "extra.css" not in pub2.settings.stylesheet_path
+
+    pub1.set_source(source_path=str(sitedir / "a.rst"))
+    pub2.set_source(source_path=str(sitedir / "b.rst"))
+    assert rst._parse(pub1)[1] == "<p>body1</p>\n"
+    assert rst._parse(pub2)[1] == "<p>body2</p>\n"
+
+    assert prototype.settings.stylesheet_path == orig
+    assert pub1.settings.record_dependencies is not pub2.settings.record_dependencies
@@ -32,3 +32,22 @@ generate_metadata_file: true
     assert site.config.get((), "package3_prop") == "package3_prop_value"
     assert site.config.get((), "package3_prop_a1") == "value_package3_a1"
     assert site.config.get((), "package4_prop") == "package4_prop_value"
+
+
+def test_bytecode_cache(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.templates / "templ.html", "{{ 1 + 1 }}")
+
+    site = siteroot.load({}, {})
+    jinjaenv = site.build_jinjaenv()
+    assert jinjaenv.get_template("templ.html").render() == "2"
+
+    cachedir = siteroot.path / "_jinja_cache"
+    assert any(cachedir.iterdir())
+
+    # updated templates are compiled again
+    siteroot.write_text(siteroot.templates / "templ.html", "{{ 1 + 2 }}")
+    jinjaenv = site.build_jinjaenv()
+    assert jinjaenv.get_template("templ.html").render() == "3"
+
+    site = siteroot.load({"jinja_bytecode_cache_dir": ""}, {})
+    assert site.build_jinjaenv().bytecode_cache is None
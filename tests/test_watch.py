@@ -0,0 +1,96 @@
+import threading
+import time
+from typing import Any, Set
+
+from conftest import SiteRoot
+
+from miyadaiku import ContentPath, watch
+
+
+def built(results: Any) -> Set[ContentPath]:
+    return {contentsrc.contentpath for contentsrc, depends, outputs in results}
+
+
+def test_resident_site(siteroot: SiteRoot) -> None:
+    siteroot.write_text(
+        siteroot.contents / "file1.rst",
+        """
+:jinja:`{{ page.link_to("./file2.rst") }}`
+""",
+    )
+    siteroot.write_text(siteroot.contents / "file2.rst", "file2")
+    siteroot.write_text(siteroot.contents / "file3.rst", "file3")
+    siteroot.write_text(siteroot.path / "config.yml", "")
+
+    resident = watch.ResidentSite(siteroot.path, {}, debug=True)
+    ok, err, deps, results, errors = resident.build()
+    assert built(results) == {
+        ((), "file1.rst"),
+        ((), "file2.rst"),
+        ((), "file3.rst"),
+    }
+    site = resident.site
+    assert site
+
+    # modified
+    file2 = siteroot.write_text(siteroot.contents / "file2.rst", "updated")
+    ok, err, deps, results, errors = resident.build([str(file2)])
+    assert resident.site is site
+    assert built(results) == {((), "file1.rst"), ((), "file2.rst")}
+    assert "updated" in (siteroot.outputs / "file2.html").read_text()
+
+    # no changes
+    ok, err, deps, results, errors = resident.build([])
+    assert built(results) == set()
+
+    # created
+    file4 = siteroot.write_text(siteroot.contents / "file4.rst", "file4")
+    ok, err, deps, results, errors = resident.build([str(file4)])
+    assert resident.site is site
+    assert len(built(results)) == 4
+
+    # removed
+    file4.unlink()
+    ok, err, deps, results, errors = resident.build([str(file4)])
+    assert resident.site is site
+    assert not site.files.has_content(((), "file4.rst"))
+
+    # config
+    config = siteroot.write_text(siteroot.path / "config.yml", "site_title: abc")
+    ok, err, deps, results, errors = resident.build([str(config)])
+    assert resident.site is not site
+
+
+def test_resident_site_templates(siteroot: SiteRoot) -> None:
+    siteroot.write_text(siteroot.contents / "file1.rst", "file1")
+    siteroot.write_text(siteroot.contents / "file2.html", "file2")
+    siteroot.write_text(
+        siteroot.contents / "file2.html.props.yml", "article_template: page2.html"
+    )
+    siteroot.write_text(siteroot.templates / "page2.html", "page2")
+    siteroot.write_text(siteroot.path / "config.yml", "")
+
+    resident = watch.ResidentSite(siteroot.path, {}, debug=True)
+    resident.build()
+
+    template = siteroot.write_text(siteroot.templates / "page2.html", "updated")
+    ok, err, deps, results, errors = resident.build([str(template)])
+    assert built(results) == {((), "file2.html")}
+    assert (siteroot.outputs / "file2.html").read_text() == "updated"
+
+
+def test_changed_paths() -> None:
+    changes = watch.ChangedPaths(0.1)
+
+    def add() -> None:
+        for i in range(5):
+            changes.add(f"file{i}", "file0")
+            time.sleep(0.02)
+
+    thread = threading.Thread(target=add)
+    thread.start()
+    paths = changes.wait()
+    thread.join()
+
+    assert paths == {f"file{i}" for i in range(5)}
+    assert not changes.event.is_set()